@@ -8,10 +8,11 @@ import cv2
 import numpy as np
 
 from sensor_msgs.msg import Image
-from std_msgs.msg import Float32, Float32MultiArray, Int32MultiArray, MultiArrayDimension, String, UInt8MultiArray
+from std_msgs.msg import Bool, Float32, Float32MultiArray, Int32MultiArray, MultiArrayDimension, String, UInt8MultiArray
 
 from cameraService.cameraClient import CameraClient
 from affordance_analyzer.srv import *
+import rob9Utils.services as services
 
 def get_optimal_font_scale(text, width):
     """https://stackoverflow.com/questions/52846474/how-to-resize-text-for-cv2-puttext-according-to-the-image-size-in-opencv-python"""
@@ -79,11 +80,9 @@ class AffordanceClient(object):
 
     def getName(self):
 
-        rospy.wait_for_service("/affordance/name")
-        nameService = rospy.ServiceProxy("/affordance/name", getNameSrv)
         msg = getNameSrv()
         msg.data = True
-        response = nameService(msg)
+        response = services.call("/affordance/name", getNameSrv, msg)
 
         return response.name.data
 
@@ -94,50 +93,92 @@ class AffordanceClient(object):
     def start(self, GPU=False):
         self.GPU = GPU
 
-        rospy.wait_for_service("/affordance/start")
-        startAffordanceNetService = rospy.ServiceProxy("/affordance/start", startAffordanceSrv)
         msg = startAffordanceSrv()
         msg.data = GPU
-        response = startAffordanceNetService(msg)
+        response = services.call("/affordance/start", startAffordanceSrv, msg)
 
         return response.status.data
 
 
     def stop(self):
-        rospy.wait_for_service("/affordance/stop")
-        stopAffordanceNetService = rospy.ServiceProxy("/affordance/stop", stopAffordanceSrv)
         msg = stopAffordanceSrv()
         msg.data = True
-        response = startAffordanceNetService(msg)
+        response = services.call("/affordance/stop", stopAffordanceSrv, msg)
 
         return response.status.data
 
     def run(self, img, CONF_THRESHOLD = 0.7):
-        rospy.wait_for_service("/affordance/run")
-        runAffordanceNetService = rospy.ServiceProxy("/affordance/run", runAffordanceSrv)
+        imgMsg = self.packImage(img)
 
-        imgMsg = Image()
-        imgMsg.height = img.shape[0]
-        imgMsg.width = img.shape[1]
-        imgMsg.data = img.flatten().tolist()
-
-        response = runAffordanceNetService(imgMsg, Float32(CONF_THRESHOLD))
+        response = services.call("/affordance/run", runAffordanceSrv, imgMsg, Float32(CONF_THRESHOLD))
 
         return response.success.data
 
-    def getAffordanceResult(self):
+    def runAndGetResult(self, img, CONF_THRESHOLD = 0.7, GPU = True):
+        """ Does start(), run() and getAffordanceResult() in one service call,
+            the server keeps the network loaded between calls.
+
+            Input:
+            img             - np.array, uint8, shape (h, w, 3)
+            CONF_THRESHOLD  - float, minimum detection confidence
+            GPU             - bool, run the network on the GPU
+
+            Output:
+            masks           - np.array, uint8, shape (N, classes, h, w)
+            objects         - np.array, int, shape (N), object class ids
+            scores          - np.array, shape (N)
+            bbox            - np.array, int, shape (N, 4), x1, y1, x2, y2
+
+            N is 0 if the prediction failed
+        """
+
+        self.GPU = GPU
 
-        s1 = time.time()
-        rospy.wait_for_service("/affordance/result")
-        affordanceNetService = rospy.ServiceProxy("/affordance/result", getAffordanceSrv)
-        #print("Waiting for affordance service took: ", (time.time() - s1) * 1000 )
+        response = services.call("/affordance/run_and_get", runAndGetAffordanceSrv,
+                                    self.packImage(img), Float32(CONF_THRESHOLD), Bool(GPU))
+
+        self.masks = self.unpackMasksRLE(response.masks_rle)
+        self.bbox = self.unpackBBox(response.bbox)
+        self.objects = self.unpackObjects(response.object)
+        self.scores = self.unpackScores(response.confidence)
+
+        if not response.success.data:
+            print("Affordance prediction failed, no objects returned")
+            self.masks, self.bbox = self.masks[:0], self.bbox[:0]
+            self.objects, self.scores = self.objects[:0], self.scores[:0]
+        self.no_objects = self.masks.shape[0]
+
+        return self.masks, self.objects, self.scores, self.bbox
+
+    def packImage(self, img):
+        """ Input:
+            img         - np.array, uint8, shape (h, w, 3), bgr
+
+            Output:
+            msg         - sensor_msgs.msg.Image, data is the raw image buffer
+        """
+
+        img = np.ascontiguousarray(img, dtype = np.uint8)
+
+        msg = Image()
+        msg.height = img.shape[0]
+        msg.width = img.shape[1]
+        msg.encoding = "bgr8"
+        msg.step = int(img.strides[0])
+        msg.data = img.tobytes()
+
+        return msg
+
+    def getAffordanceResult(self):
 
-        s2 = time.time()
         msg = getAffordanceSrv()
         msg.data = True
-        response = affordanceNetService(msg)
+        response = services.call("/affordance/result", getAffordanceSrv, msg)
 
-        self.masks = self.unpackMasks(response.masks)
+        if len(response.masks_rle.data) > 0:
+            self.masks = self.unpackMasksRLE(response.masks_rle)
+        else: # servers sending the full mask tensor
+            self.masks = self.unpackMasks(response.masks)
         self.no_objects = self.masks.shape[0]
         self.bbox = self.unpackBBox(response.bbox)
         self.objects = self.unpackObjects(response.object)
@@ -226,6 +267,113 @@ class AffordanceClient(object):
 
         return msg
 
+    def packMasksRLE(self, masks):
+        """ Packs the per object argmax label maps, see packLabelMapsRLE()
+
+            Input:
+            masks       - np.array, shape (N, classes, h, w) or
+                          (N * classes, h, w)
+
+            Output:
+            msg         - std_msgs.msg.UInt8MultiArray()
+        """
+
+        masks = np.asanyarray(masks)
+        if len(masks.shape) <= 3:
+            masks = np.reshape(masks, (-1, self.noLabelClass, masks.shape[-2], masks.shape[-1]))
+
+        label_maps = np.argmax(masks, axis = 1).astype(np.uint8)
+
+        return self.packLabelMapsRLE(label_maps, masks.shape[1])
+
+    def packLabelMapsRLE(self, label_maps, num_classes):
+        """ Every label map is cropped to the pixels with a label other than
+            background and the crop is run length encoded row major. Layout of
+            the bytes, all integers are little endian uint32:
+
+            [N, classes, h, w], then per object [y0, x0, crop h, crop w, runs],
+            run labels (uint8 x runs), run lengths (uint32 x runs)
+
+            Input:
+            label_maps  - np.array, uint8, shape (N, h, w), affordance label per pixel
+            num_classes - int, number of affordance classes
+
+            Output:
+            msg         - std_msgs.msg.UInt8MultiArray()
+        """
+
+        label_maps = np.asanyarray(label_maps, dtype = np.uint8)
+        num_objects, height, width = label_maps.shape
+
+        chunks = [np.array([num_objects, num_classes, height, width], dtype = '<u4').view(np.uint8)]
+        for label_map in label_maps:
+            rows = np.flatnonzero(np.any(label_map, axis = 1))
+            if rows.shape[0] == 0:
+                chunks.append(np.zeros(5, dtype = '<u4').view(np.uint8))
+                continue
+
+            cols = np.flatnonzero(np.any(label_map, axis = 0))
+            y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+            crop = label_map[y0:y1, x0:x1].ravel()
+
+            starts = np.concatenate(([0], np.flatnonzero(crop[1:] != crop[:-1]) + 1))
+            lengths = np.diff(np.append(starts, crop.shape[0]))
+
+            header = np.array([y0, x0, y1 - y0, x1 - x0, starts.shape[0]], dtype = '<u4')
+            chunks.append(header.view(np.uint8))
+            chunks.append(crop[starts])
+            chunks.append(lengths.astype('<u4').view(np.uint8))
+
+        msg = UInt8MultiArray()
+        msg.data = np.concatenate(chunks).tobytes()
+
+        return msg
+
+    def unpackLabelMapsRLE(self, msg):
+        """ Inverse of packLabelMapsRLE()
+
+            Input:
+            msg         - std_msgs.msg.UInt8MultiArray()
+
+            Output:
+            label_maps  - np.array, uint8, shape (N, h, w)
+            num_classes - int
+        """
+
+        data = np.frombuffer(bytes(msg.data), dtype = np.uint8)
+        num_objects, num_classes, height, width = data[:16].view('<u4').astype(int)
+
+        label_maps = np.zeros((num_objects, height, width), dtype = np.uint8)
+        offset = 16
+        for i in range(num_objects):
+            y0, x0, h, w, runs = data[offset:offset + 20].view('<u4').astype(int)
+            offset += 20
+
+            values = data[offset:offset + runs]
+            offset += runs
+            lengths = data[offset:offset + 4 * runs].view('<u4')
+            offset += 4 * runs
+
+            label_maps[i, y0:y0 + h, x0:x0 + w] = np.repeat(values, lengths).reshape(h, w)
+
+        return label_maps, num_classes
+
+    def unpackMasksRLE(self, msg):
+        """ Input:
+            msg         - std_msgs.msg.UInt8MultiArray(), see packLabelMapsRLE()
+
+            Output:
+            masks       - np.array, uint8, shape (N, classes, h, w), 255 for the
+                          label of a pixel and 0 for the others, so
+                          processMasks() gives the same result as for the full
+                          mask tensor
+        """
+
+        label_maps, num_classes = self.unpackLabelMapsRLE(msg)
+        masks = label_maps[:, np.newaxis] == np.arange(num_classes, dtype = np.uint8).reshape(1, -1, 1, 1)
+
+        return masks.astype(np.uint8) * 255
+
     def unpackBBox(self, msg):
         return np.asarray(msg.data).reshape((-1,4))
 
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+import os
+import time
+import argparse
+import numpy as np
+import cv2
+
+import torch
+
+import utils
+import inference
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Annotate recorded scenes with affordance masks, several images per forward pass')
+    parser.add_argument('--gpu', dest='gpu',
+                        help='GPU device id to use if not declared will use CPU',
+                        action='store_true')
+    parser.add_argument('--input', dest='input_path',
+                        help='Root folder of the recorded scenes, searched recursively',
+                        default=None, type=str, required=True)
+    parser.add_argument('--output', dest='output_path',
+                        help='Output folder, the folder structure of the input is kept',
+                        default=None, type=str, required=True)
+    parser.add_argument('--weights', dest='weights_path',
+                        help='Pre-trained weights file, default weights.pth next to this script',
+                        default=None, type=str)
+    parser.add_argument('--image_name', dest='image_name',
+                        help='File name of the rgb image of a scene, default = img.png',
+                        default='img.png', type=str)
+    parser.add_argument('--batch_size', dest='batch_size',
+                        help='Number of images per forward pass, default = 4',
+                        default=4, type=int)
+    parser.add_argument('--object_threshold', dest='object_confidence_thresh',
+                        help='Confidence threshold score for object detection, between 0 and 1, default = 0.5',
+                        default=0.5, type=float)
+
+    return parser.parse_args()
+
+def find_scenes(root, image_name):
+    """ Input:
+        root        - str, root folder
+        image_name  - str, file name of the scene image
+
+        Output:
+        scenes      - list[str], sorted paths to every image_name below root
+    """
+
+    scenes = []
+    for folder, _, files in os.walk(root):
+        if image_name in files:
+            scenes.append(os.path.join(folder, image_name))
+    return sorted(scenes)
+
+def save_result(folder, result, num_affordances):
+    """ Saves masks, labels, scores and bboxs like the experiments do, masks
+        equal AffordanceClient.processMasks(masks, conf_threshold = 0,
+        erode_kernel = (1,1)) but stored as uint8 """
+
+    if result is None:
+        bbox = np.zeros((0, 4))
+        objects = np.zeros(0, dtype=int)
+        scores = np.zeros(0)
+        masks = np.zeros((0, num_affordances, 0, 0), dtype=np.uint8)
+    else:
+        bbox, objects, label_maps, scores = result
+        masks = label_maps[:, np.newaxis] == np.arange(num_affordances, dtype=np.uint8).reshape(1, -1, 1, 1)
+        masks[:, 0] = False
+        masks = masks.astype(np.uint8)
+
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    np.save(os.path.join(folder, "masks.npy"), masks)
+    np.save(os.path.join(folder, "labels.npy"), objects)
+    np.save(os.path.join(folder, "scores.npy"), scores)
+    np.save(os.path.join(folder, "bboxs.npy"), bbox)
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    weights_path = args.weights_path
+    if weights_path is None:
+        weights_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "weights.pth")
+
+    scenes = find_scenes(args.input_path, args.image_name)
+
+    print()
+    print("*************************************************************")
+    print("********************* Annotating with ***********************")
+    print("*************************************************************")
+    print("Input folder: ", args.input_path)
+    print("Output folder: ", args.output_path)
+    print("Weights file: ", weights_path)
+    print("Scenes: ", len(scenes))
+    print("Batch size: ", args.batch_size)
+    print("Object detection confidence score threshold: ", args.object_confidence_thresh)
+    if args.gpu:
+        print("With GPU")
+    else:
+        print("With CPU")
+    print("*************************************************************")
+
+    device = torch.device('cpu')
+    if args.gpu:
+        device = torch.device('cuda')
+
+    num_classes, num_affordances = 23, 11 # same network as server_synth.py
+    model = utils.get_model_instance_segmentation(num_classes, num_affordances)
+    model.load_state_dict(torch.load(weights_path, map_location=device))
+    model.to(device)
+    model.eval()
+
+    ts = time.time()
+    for start in range(0, len(scenes), args.batch_size):
+        batch = scenes[start:start + args.batch_size]
+        imgs = [cv2.imread(scene) for scene in batch] # bgr like the camera images
+
+        results = inference.predict_batch(model, device, imgs, CONF_THRESHOLD = args.object_confidence_thresh)
+
+        for scene, result in zip(batch, results):
+            folder = os.path.join(args.output_path, os.path.relpath(os.path.dirname(scene), args.input_path))
+            save_result(folder, result, num_affordances)
+
+            num_objects = 0 if result is None else result[1].shape[0]
+            print(scene, ": ", num_objects, " objects")
+
+        print(min(start + args.batch_size, len(scenes)), " / ", len(scenes))
+
+    te = time.time()
+    print("Annotated ", len(scenes), " scenes in ", round(te - ts, 2), " s")
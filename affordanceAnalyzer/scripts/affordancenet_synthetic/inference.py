@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+import time
+import numpy as np
+import cv2
+
+import torch
+import torch.nn.functional as F
+import torchvision
+
+def run_net_batch(net, x, CONF_THRESHOLD = 0.7):
+    """ Runs the network on all images in one forward pass, the model
+        transform resizes them and batch_images() pads them into one tensor.
+
+        Input:
+        net             - the model, in eval mode
+        x               - list[torch.Tensor], shape (3, h_i, w_i), on the device
+        CONF_THRESHOLD  - float, minimum detection confidence
+
+        Output:
+        results         - list, per image (boxes, labels, masks, scores) with
+                          np.arrays and masks a torch.Tensor on the device,
+                          shape (N, classes, h_i, w_i), None for an image
+                          without any detection
+    """
+
+    ts = time.time() * 1000
+    with torch.no_grad():
+        predictions = net(x)
+    te = time.time() * 1000
+    print("Prediction of ", len(x), " images took: ", te - ts, " ms")
+
+    results = []
+    for prediction in predictions:
+        boxes, labels, scores, masks = prediction['boxes'], prediction['labels'], prediction['scores'], prediction['masks']
+
+        if not torch.is_tensor(masks): # nothing detected, see GeneralizedRCNNTransform.postprocess()
+            results.append(None)
+            continue
+
+        idx = scores > CONF_THRESHOLD
+        results.append((boxes[idx].cpu().numpy(), labels[idx].cpu().numpy(),
+                        masks[idx], scores[idx].cpu().numpy()))
+
+    return results
+
+def pasteLabelMaps(masks, height, width):
+    """ Upsamples the mask probabilities to the image size and takes the
+        per pixel argmax on the device of the network. Only the region of
+        each object where its network mask is non zero is sampled, all
+        objects in one grid_sample call, which equals a bilinear
+        F.interpolate to (height, width) cropped to that region.
+
+        Input:
+        masks           - torch.Tensor, shape (N, classes, h, w), on the device
+        height          - int, image height
+        width           - int, image width
+
+        Output:
+        label_maps      - np.array, uint8, shape (N, height, width)
+    """
+
+    num_objects, _, h, w = masks.shape
+    label_maps = np.zeros((num_objects, height, width), dtype=np.uint8)
+    if num_objects == 0:
+        return label_maps
+
+    with torch.no_grad():
+        occupied = masks.amax(dim=1) > 0
+        rows = occupied.any(dim=2)
+        cols = occupied.any(dim=1)
+        present = rows.any(dim=1)
+
+        # first and last occupied network row and column
+        extents = torch.stack((rows.byte().argmax(dim=1), h - 1 - rows.flip(1).byte().argmax(dim=1),
+                                cols.byte().argmax(dim=1), w - 1 - cols.flip(1).byte().argmax(dim=1)), dim=1)
+        extents = extents.cpu().numpy()
+        present = present.cpu().numpy()
+
+        # image pixel y samples network row (y + 0.5) * h / height - 0.5,
+        # bilinear sampling reaches one network pixel beyond the extent
+        scale_y, scale_x = height / h, width / w
+        y0 = np.clip(np.floor((extents[:, 0] - 0.5) * scale_y - 0.5), 0, height).astype(int)
+        y1 = np.clip(np.ceil((extents[:, 1] + 1.5) * scale_y - 0.5) + 1, 0, height).astype(int)
+        x0 = np.clip(np.floor((extents[:, 2] - 0.5) * scale_x - 0.5), 0, width).astype(int)
+        x1 = np.clip(np.ceil((extents[:, 3] + 1.5) * scale_x - 0.5) + 1, 0, width).astype(int)
+        y1[~present], x1[~present] = y0[~present], x0[~present]
+
+        crop_h, crop_w = y1 - y0, x1 - x0
+        max_h, max_w = int(np.max(crop_h)), int(np.max(crop_w))
+        if max_h == 0 or max_w == 0:
+            return label_maps
+
+        device = masks.device
+        ys = torch.as_tensor(y0, device=device)[:, None] + torch.arange(max_h, device=device)[None]
+        xs = torch.as_tensor(x0, device=device)[:, None] + torch.arange(max_w, device=device)[None]
+        grid_y = (ys.clamp(max=height - 1).to(masks.dtype) + 0.5) / height * 2 - 1
+        grid_x = (xs.clamp(max=width - 1).to(masks.dtype) + 0.5) / width * 2 - 1
+        grid = torch.stack((grid_x[:, None, :].expand(-1, max_h, -1),
+                            grid_y[:, :, None].expand(-1, -1, max_w)), dim=-1)
+
+        sampled = F.grid_sample(masks, grid, mode='bilinear', padding_mode='border', align_corners=False)
+        crops = sampled.argmax(dim=1).to(torch.uint8).cpu().numpy()
+
+    for i in range(num_objects):
+        label_maps[i, y0[i]:y1[i], x0[i]:x1[i]] = crops[i, :crop_h[i], :crop_w[i]]
+
+    return label_maps
+
+def predict_batch(net, device, imgs, CONF_THRESHOLD = 0.7, net_height = 450):
+    """ Runs the network on a stack of images, e.g. several camera views or
+        recorded scenes, in one forward pass and returns the results in the
+        resolution of each image.
+
+        Input:
+        net             - the model, in eval mode
+        device          - torch.device of the model
+        imgs            - list[np.array], uint8, shape (h_i, w_i, 3)
+        CONF_THRESHOLD  - float, minimum detection confidence
+        net_height      - int, images are resized to this height first
+
+        Output:
+        results         - list, per image (bbox, objects, label_maps, scores),
+                          bbox shape (N, 4), objects shape (N), label_maps uint8
+                          shape (N, h_i, w_i), scores shape (N), None for an
+                          image without any detection
+    """
+
+    x = []
+    for img in imgs:
+        ratio = img.shape[1] / img.shape[0]
+        img = cv2.resize(img, (int(net_height * ratio), net_height), interpolation = cv2.INTER_AREA)
+        x.append(torchvision.transforms.ToTensor()(img).to(device))
+
+    results = []
+    for img, net_img, result in zip(imgs, x, run_net_batch(net, x, CONF_THRESHOLD = CONF_THRESHOLD)):
+        if result is None:
+            results.append(None)
+            continue
+
+        bbox, objects, masks, scores = result
+        height, width = img.shape[0], img.shape[1]
+        label_maps = pasteLabelMaps(masks, height, width)
+
+        bbox[:, [0, 2]] = bbox[:, [0, 2]] * (width / net_img.shape[2])
+        bbox[:, [1, 3]] = bbox[:, [1, 3]] * (height / net_img.shape[1])
+
+        results.append((bbox, objects, label_maps, scores))
+
+    return results
@@ -73,8 +73,10 @@ def maskrcnn_inference(x, labels):
     """
     #mask_prob = x
     mask_prob = x.sigmoid()
-    
-    mask_prob = mask_prob[None, :]
+
+    # every affordance channel is kept, split the masks per image of the batch
+    boxes_per_image = [label.shape[0] for label in labels]
+    mask_prob = mask_prob.split(boxes_per_image, dim=0)
     """
     #print("input mask prob: ", mask_prob.shape)
 
@@ -475,8 +477,28 @@ def _onnx_paste_masks_in_image_loop(masks, boxes, im_h, im_w):
     return res_append
 
 
-def paste_masks_in_image(masks, boxes, img_shape, padding=1):
-    # type: (Tensor, Tensor, Tuple[int, int], int) -> Tensor
+def paste_masks_in_image(masks, boxes, img_shape, padding=1, bbox_local=False):
+    # type: (Tensor, Tensor, Tuple[int, int], int, bool) -> Tensor
+    """
+    Pastes the masks of all detections and all affordance channels at once.
+    Every mask is resampled to its box with one batched grid_sample, the
+    inverse mapping of F.interpolate(mode='bilinear', align_corners=False),
+    and the pixels inside the image are written to the canvas with a single
+    indexed assignment. Runs on the device of masks.
+
+    Args:
+        masks (Tensor): shape (N, C, M, M), mask probabilities
+        boxes (Tensor): shape (N, 4), x1, y1, x2, y2 in image coordinates
+        img_shape (Tuple[int, int]): image height and width
+        padding (int): mask padding, see expand_masks
+        bbox_local (bool): return the masks in box coordinates instead of
+            pasting them into the image
+
+    Returns:
+        masks (Tensor): shape (1, N, C, H, W), or if bbox_local a tuple of
+            the masks, shape (1, N, C, max box h, max box w), mask n valid
+            in [:h_n, :w_n], and the expanded integer boxes, shape (N, 4)
+    """
     masks, scale = expand_masks(masks, padding=padding)
     boxes = expand_boxes(boxes, scale).to(dtype=torch.int64)
     im_h, im_w = img_shape
@@ -485,16 +507,48 @@ def paste_masks_in_image(masks, boxes, img_shape, padding=1):
         return _onnx_paste_masks_in_image_loop(masks, boxes,
                                                torch.scalar_tensor(im_h, dtype=torch.int64),
                                                torch.scalar_tensor(im_w, dtype=torch.int64))[:, None]
-    res = [
-        paste_mask_in_image(m, b, im_h, im_w)
-        for m, b in zip(masks, boxes)
-    ]
-    
-    if len(res) > 0:
-        ret = torch.stack(res, dim=1)
-    else:
-        ret = masks.new_empty((0, 1, im_h, im_w))
-    return ret
+
+    if masks.shape[0] == 0:
+        if bbox_local:
+            return masks.new_empty((1, 0, masks.shape[1], 0, 0)), boxes
+        return masks.new_empty((0, 1, im_h, im_w))
+
+    num_masks = masks.shape[0]
+    device = masks.device
+    TO_REMOVE = 1
+    box_w = (boxes[:, 2] - boxes[:, 0] + TO_REMOVE).clamp(min=1)
+    box_h = (boxes[:, 3] - boxes[:, 1] + TO_REMOVE).clamp(min=1)
+    max_h, max_w = int(box_h.max()), int(box_w.max())
+
+    # local pixel (y, x) of box n samples the resized mask at its pixel center
+    ys = torch.arange(max_h, device=device)
+    xs = torch.arange(max_w, device=device)
+    grid_y = (ys[None].to(masks.dtype) + 0.5) / box_h[:, None].to(masks.dtype) * 2 - 1
+    grid_x = (xs[None].to(masks.dtype) + 0.5) / box_w[:, None].to(masks.dtype) * 2 - 1
+    grid = torch.stack((grid_x[:, None, :].expand(-1, max_h, -1),
+                        grid_y[:, :, None].expand(-1, -1, max_w)), dim=-1)
+
+    local_masks = F.grid_sample(masks, grid, mode='bilinear', padding_mode='border', align_corners=False)
+
+    inside_y = ys[None] < box_h[:, None]
+    inside_x = xs[None] < box_w[:, None]
+
+    if bbox_local:
+        inside = inside_y[:, :, None] & inside_x[:, None, :]
+        return (local_masks * inside[:, None].to(masks.dtype))[None], boxes
+
+    # keep the pixels inside the box and inside the image
+    im_y = ys[None] + boxes[:, 1:2]
+    im_x = xs[None] + boxes[:, 0:1]
+    valid_y = inside_y & (im_y >= 0) & (im_y < im_h)
+    valid_x = inside_x & (im_x >= 0) & (im_x < im_w)
+    n, local_y, local_x = torch.nonzero(valid_y[:, :, None] & valid_x[:, None, :], as_tuple=True)
+
+    im_mask = torch.zeros((num_masks, masks.shape[1], im_h, im_w), dtype=masks.dtype, device=device)
+    im_mask.permute(0, 2, 3, 1)[n, im_y[n, local_y], im_x[n, local_x]] = \
+        local_masks.permute(0, 2, 3, 1)[n, local_y, local_x]
+
+    return im_mask[None]
 
 
 class RoIHeads(nn.Module):
@@ -12,6 +12,7 @@ from torchvision.models.detection.faster_rcnn import FastRCNNPredictor
 from lib.mask_rcnn import MaskRCNNPredictor, MaskAffordancePredictor, MaskRCNNHeads
 import lib.mask_rcnn as mask_rcnn
 import utils
+import inference
 import argparse
 from PIL import Image
 import numpy as np
@@ -19,7 +20,6 @@ import cv2
 import time
 from config import IITAFF
 import os
-from skimage.transform import resize
 from affordanceService.client import AffordanceClient
 
 from affordance_analyzer.srv import *
@@ -38,6 +38,7 @@ class AffordanceAnalyzer(object):
 
         self.serviceGet = rospy.Service('/affordance/result', getAffordanceSrv, self.getAffordance)
         self.serviceRun = rospy.Service('/affordance/run', runAffordanceSrv, self.analyzeAffordance)
+        self.serviceRunAndGet = rospy.Service('/affordance/run_and_get', runAndGetAffordanceSrv, self.runAndGetAffordance)
         self.serviceStart = rospy.Service('/affordance/start', startAffordanceSrv, self.startAffordance)
         self.serviceStop = rospy.Service('/affordance/stop', stopAffordanceSrv, self.stopAffordance)
         self.serviceName = rospy.Service('/affordance/name', getNameSrv, self.getName)
@@ -53,48 +54,27 @@ class AffordanceAnalyzer(object):
 
 
     def run_net(self, x, CONF_THRESHOLD = 0.7):
+        """ Runs the network on a single image list, see run_net_batch() """
 
-        #ori_height, ori_width, _ = im.shape
-
-        # Detect all object classes and regress object bounds
-        #timer = Timer()
-        #timer.tic()
-        ts = time.time() * 1000
-
-        predictions = self.net(x)[0]
-        boxes, labels, scores, masks = predictions['boxes'], predictions['labels'], predictions['scores'], predictions['masks']
-        print("Found: ")
-
-        for label, score in zip(labels, scores):
-            print(label, score)
-        te = time.time() * 1000
-        print("Prediction took: ", te - ts, " ms")
         try:
-            idx = scores > CONF_THRESHOLD
-            labels = labels.cpu().detach().numpy()
-
-
-            boxes = boxes[idx].cpu().detach().numpy()
-            labels = labels[idx.cpu().detach().numpy()]
-            scores = scores[idx].cpu().detach().numpy()
-            masks = masks[idx].cpu().detach().numpy()
-
-            masks = masks * 255
-
-        except:
-            pass
+            return self.run_net_batch(x, CONF_THRESHOLD = CONF_THRESHOLD)[0]
+        except RuntimeError as e: # e.g. out of device memory
+            print("Prediction failed: ", e)
+            return 0
 
+    def run_net_batch(self, x, CONF_THRESHOLD = 0.7):
+        """ Input:
+            x               - list[torch.Tensor], shape (3, h_i, w_i), on the device
+            CONF_THRESHOLD  - float, minimum detection confidence
 
-        #timer.toc()
-        #print ('Detection took {:.3f}s for '
-        #       '{:d} object proposals').format(timer.total_time, rois_final.shape[0])
+            Output:
+            results         - list, per image (boxes, labels, masks, scores), see
+                              inference.run_net_batch()
+        """
 
-        try:
-            return boxes, labels, masks, scores
-        except:
-            return 0
+        return inference.run_net_batch(self.net, x, CONF_THRESHOLD = CONF_THRESHOLD)
 
-    def sendResults(self, bbox, objects, masks, scores):
+    def sendResults(self, bbox, objects, label_maps, scores):
         intToLabel = {0: 'class', 1: 'height', 2: 'width'}
         msg = getAffordanceSrvResponse()
 
@@ -114,7 +94,7 @@ class AffordanceAnalyzer(object):
         masks = masks.flatten().astype(int).tolist()
         #msg.masks.data = masks
         """
-        msg.masks = aff_client.packMasks(masks)
+        msg.masks_rle = aff_client.packLabelMapsRLE(label_maps, 11)
 
         # constructing bounding box message
         msg.bbox.data = bbox.flatten().astype(int).tolist()
@@ -129,72 +109,136 @@ class AffordanceAnalyzer(object):
 
     def analyzeAffordance(self, msg):
 
-        img = np.frombuffer(msg.img.data, dtype=np.uint8).reshape(msg.img.height, msg.img.width, -1)
-        width, height = img.shape[1], img.shape[0]
-        ratio = width / height
-        img = cv2.resize(img, (int(450 * ratio), 450), interpolation = cv2.INTER_AREA)
-        x = [torchvision.transforms.ToTensor()(img).to(self.device)]
         self.CONF_THRESHOLD = msg.confidence_threshold.data
+        success = self.predict(self.imageFromMsg(msg.img))
+
+        response = runAffordanceSrvResponse()
+        response.success.data = success
+        return response
+
+    def runAndGetAffordance(self, msg):
+        """ Loads the network if it is not loaded on the requested device, runs
+            it and returns the result in the same response, replaces calling
+            /affordance/start, /affordance/run and /affordance/result """
+
+        self.loadModel(msg.GPU.data)
+
+        self.CONF_THRESHOLD = msg.confidence_threshold.data
+        success = self.predict(self.imageFromMsg(msg.img))
+
+        result = self.sendResults(self.bbox, self.objects, self.label_maps, self.scores)
+
+        response = runAndGetAffordanceSrvResponse()
+        response.success.data = success
+        response.masks_rle = result.masks_rle
+        response.bbox = result.bbox
+        response.object = result.object
+        response.confidence = result.confidence
+
+        return response
+
+    def imageFromMsg(self, msg):
+        """ Input:
+            msg         - sensor_msgs.msg.Image, 8 bit channels
+
+            Output:
+            img         - np.array, uint8, shape (h, w, channels), view of msg.data
+        """
+
+        img = np.frombuffer(msg.data, dtype=np.uint8)
+        if msg.step > 0: # rows may be padded
+            channels = msg.step // msg.width
+            img = img.reshape(msg.height, msg.step)[:, :msg.width * channels]
+        return img.reshape(msg.height, msg.width, -1)
+
+    def predict(self, img):
+        """ Runs the network on img and keeps bbox, objects, the per object
+            affordance label maps and scores in full image resolution
+
+            Input:
+            img         - np.array, uint8, shape (h, w, 3)
+
+            Output:
+            success     - bool, False if the network failed, an image without
+                          objects is a successful empty result
+        """
 
         print("Analyzing affordance with confidence threshold: ", self.CONF_THRESHOLD)
+        if self.net is None:
+            print("Network is not loaded, call /affordance/start first")
+            self.clearResult(img.shape[0], img.shape[1])
+            return False
+
         try:
-            bbox, objects, masks, scores = self.run_net(x, CONF_THRESHOLD=self.CONF_THRESHOLD)
-            #bbox = bbox[:,1:]
-            print(masks.shape, bbox.shape, objects.shape, scores.shape)
-            try:
-                m = np.zeros((11, height, width))
-                for c, m_t in enumerate(masks[0]):
-                    m[c] = resize(m_t, (height, width))
-            except Exception as e:
-                print(e)
-                raise
-            #m = resize(m, (width, height))
-            #m = cv2.resize(m, (width, height), interpolation=cv2.INTER_NEAREST)
-            try:
-                for c, mask in enumerate(masks):
-                    if c > 0:
-                        m_aff = np.zeros((11, height, width))
-                        for c_a, aff_mask in enumerate(mask):
-                            m_aff[c_a] = resize(aff_mask, (height, width))
-                        m = np.vstack((m,m_aff))
-            except Exception as e:
-                print(e)
-                raise
-            masks = m
-
-            for b_c, box in enumerate(bbox):
-                box[0] = box[0] * (width / (450 * ratio))
-                box[2] = box[2] * (width / (450 * ratio))
-                box[1] = box[1] * (height / 450)
-                box[3] = box[3] * (height / 450)
-                bbox[b_c] = box
-
-
-            self.bbox = bbox
-            self.objects = objects
-            self.masks = masks
-            self.scores = scores
-        except:
-            bbox = np.zeros((1, 4))
-            objects = np.zeros((1,1))
-            masks = np.zeros((1, 11, 244, 244))
-            scores = np.zeros(1)
-
-        return runAffordanceSrvResponse()
+            result = self.predictBatch([img])[0]
+        except RuntimeError as e: # e.g. out of device memory
+            print("Prediction failed: ", e)
+            self.clearResult(img.shape[0], img.shape[1])
+            return False
+
+        if result is None: # nothing detected
+            self.clearResult(img.shape[0], img.shape[1])
+            return True
+
+        bbox, objects, label_maps, scores = result
+        print(label_maps.shape, bbox.shape, objects.shape, scores.shape)
+
+        self.bbox = bbox
+        self.objects = objects
+        self.label_maps = label_maps
+        self.scores = scores
+
+        return True
+
+    def clearResult(self, height, width):
+        """ Stores a result without any object """
+
+        self.bbox = np.zeros((0, 4))
+        self.objects = np.zeros(0, dtype=int)
+        self.label_maps = np.zeros((0, height, width), dtype=np.uint8)
+        self.scores = np.zeros(0)
+
+    def predictBatch(self, imgs):
+        """ Runs the network on several images, e.g. camera views, in one
+            forward pass
+
+            Input:
+            imgs        - list[np.array], uint8, shape (h_i, w_i, 3)
+
+            Output:
+            results     - list, per image (bbox, objects, label_maps, scores) in
+                          the resolution of the image, None for an image
+                          without any detection
+        """
+
+        return inference.predict_batch(self.net, self.device, imgs, CONF_THRESHOLD = self.CONF_THRESHOLD)
 
     def getAffordance(self, msg):
 
-        return self.sendResults(self.bbox, self.objects, self.masks, self.scores)
+        return self.sendResults(self.bbox, self.objects, self.label_maps, self.scores)
 
     def startAffordance(self, msg):
+
+        self.loadModel(msg.GPU.data)
+
+        msg = startAffordanceSrvResponse()
+        return msg
+
+    def loadModel(self, GPU):
+        """ Loads the weights onto the requested device, does nothing if the
+            network is already loaded there """
+
         #weights_path = os.path.dirname(os.path.realpath(__file__)) + "/14.pth"
         weights_path = os.path.dirname(os.path.realpath(__file__)) + "/weights.pth"
 
-        GPU = msg.GPU.data
         device = torch.device('cpu')
 
         if GPU:
             device = torch.device('cuda')
+
+        if self.net is not None and self.device == device:
+            return
+
         self.device = device
         print("Device is: ", self.device)
 
@@ -207,9 +251,6 @@ class AffordanceAnalyzer(object):
         # load network
         self.net = model
 
-        msg = startAffordanceSrvResponse()
-        return msg
-
     def stopAffordance(self, msg):
         del self.net
         self.net = None
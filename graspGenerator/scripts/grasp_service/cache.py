@@ -0,0 +1,209 @@
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from scipy.spatial.transform import Rotation as R
+
+from grasp_service.collision import GripperCollisionModel
+
+class GraspCache(object):
+    """ LRU cache of grasp service results. An entry is found by the request
+        settings and a voxel fingerprint of the grasp points, either an exact
+        fingerprint match or a voxel overlap above min_overlap. The
+        environment is stored as a set of occupied voxels, when it changed
+        only the points in newly occupied voxels are checked against the
+        cached grasps and colliding grasps are dropped.
+    """
+
+    def __init__(self, max_entries = 16, grasp_voxel_size = 0.01, env_voxel_size = 0.01,
+                    min_overlap = 0.9, max_env_change = 0.2, opening = 0.12):
+        """ Input:
+            max_entries         - int, least recently used entries are evicted beyond
+            grasp_voxel_size    - float, voxel size of the grasp point fingerprint, m
+            env_voxel_size      - float, voxel size of the environment diff, m
+            min_overlap         - float, min intersection over union of grasp point
+                                  voxels for a non exact match
+            max_env_change      - float, fraction of environment voxels that may be
+                                  new before the entry is recomputed
+            opening             - float, gripper opening used by the grasp server
+        """
+
+        self.max_entries = max_entries
+        self.grasp_voxel_size = grasp_voxel_size
+        self.env_voxel_size = env_voxel_size
+        self.min_overlap = min_overlap
+        self.max_env_change = max_env_change
+        self.gripper = GripperCollisionModel(opening = opening)
+
+        self.entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "evicted": 0}
+
+    def voxelKeys(self, points, voxel_size):
+        """ Input:
+            points          - np.array, shape (N, 3)
+            voxel_size      - float
+
+            Output:
+            keys            - np.array, shape (M, 3), sorted unique occupied voxels
+        """
+
+        points = np.asanyarray(points)
+        if points.shape[0] == 0:
+            return np.zeros((0, 3), dtype=np.int64)
+
+        return np.unique(np.floor(points / voxel_size).astype(np.int64), axis=0)
+
+    def fingerprint(self, voxel_keys):
+        return hashlib.sha1(np.ascontiguousarray(voxel_keys).tobytes()).hexdigest()
+
+    def overlap(self, keys_a, keys_b):
+        """ Intersection over union of two sets of voxels """
+
+        if keys_a.shape[0] == 0 and keys_b.shape[0] == 0:
+            return 1.0
+
+        both = np.unique(np.vstack((keys_a, keys_b)), axis=0).shape[0]
+        shared = keys_a.shape[0] + keys_b.shape[0] - both
+        return shared / both
+
+    def find(self, settings, grasp_keys):
+        """ Output:
+            key             - key of the best matching entry, None if none match
+        """
+
+        key = (settings, self.fingerprint(grasp_keys))
+        if key in self.entries:
+            return key
+
+        best_key, best_overlap = None, self.min_overlap
+        for entry_key, entry in self.entries.items():
+            if entry_key[0] != settings:
+                continue
+            entry_overlap = self.overlap(entry["grasp_keys"], grasp_keys)
+            if entry_overlap >= best_overlap:
+                best_key, best_overlap = entry_key, entry_overlap
+
+        return best_key
+
+    def lookup(self, grasp_points, env_points, settings):
+        """ Input:
+            grasp_points    - np.array, shape (N, 3), sampled grasp points
+            env_points      - np.array, shape (M, 3), environment point cloud
+            settings        - tuple, hashable, everything else the result depends
+                              on, e.g. sweep settings, frame, tool and affordance id
+
+            Output:
+            grasps          - list[rob9.msg.GraspMsg], None on a miss or when no
+                              cached grasp is left after revalidation
+        """
+
+        grasp_keys = self.voxelKeys(grasp_points, self.grasp_voxel_size)
+        key = self.find(settings, grasp_keys)
+        if key is None:
+            self.stats["misses"] += 1
+            return None
+
+        entry = self.entries[key]
+        env_keys = self.voxelKeys(env_points, self.env_voxel_size)
+
+        if not np.array_equal(env_keys, entry["env_keys"]):
+            new_voxels = self.newVoxels(entry["env_keys"], env_keys)
+
+            if new_voxels.shape[0] > self.max_env_change * max(env_keys.shape[0], 1):
+                self.stats["misses"] += 1
+                return None
+
+            if new_voxels.shape[0] > 0:
+                env_voxels = np.floor(np.asanyarray(env_points) / self.env_voxel_size).astype(np.int64)
+                changed_points = np.asanyarray(env_points)[self.isIn(env_voxels, new_voxels)]
+                entry["grasps"] = self.revalidate(entry["grasps"], changed_points)
+
+                if len(entry["grasps"]) == 0: # every cached grasp collides now
+                    del self.entries[key]
+                    self.stats["misses"] += 1
+                    return None
+
+            entry["env_keys"] = env_keys
+            self.stats["revalidated"] += 1
+        else:
+            self.stats["hits"] += 1
+
+        self.entries.move_to_end(key)
+        return entry["grasps"]
+
+    def store(self, grasp_points, env_points, settings, grasps):
+        """ Input:
+            grasp_points    - np.array, shape (N, 3), sampled grasp points
+            env_points      - np.array, shape (M, 3), environment point cloud
+            settings        - tuple, see lookup()
+            grasps          - list[rob9.msg.GraspMsg], result of the grasp service
+        """
+
+        grasp_keys = self.voxelKeys(grasp_points, self.grasp_voxel_size)
+        key = (settings, self.fingerprint(grasp_keys))
+
+        self.entries[key] = {"grasp_keys": grasp_keys,
+                            "env_keys": self.voxelKeys(env_points, self.env_voxel_size),
+                            "grasps": list(grasps)}
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evicted"] += 1
+
+    def newVoxels(self, old_keys, new_keys):
+        """ Voxels occupied in new_keys but not in old_keys """
+
+        return new_keys[~self.isIn(new_keys, old_keys)]
+
+    def isIn(self, keys, reference):
+        """ Input:
+            keys            - np.array, shape (N, 3)
+            reference       - np.array, shape (M, 3), unique voxels
+
+            Output:
+            mask            - np.array, bool, shape (N), True if the voxel is in reference
+        """
+
+        if reference.shape[0] == 0 or keys.shape[0] == 0:
+            return np.zeros(keys.shape[0], dtype=bool)
+
+        dtype = np.dtype((np.void, keys.dtype.itemsize * 3))
+        keys_void = np.ascontiguousarray(keys).view(dtype).ravel()
+        reference_void = np.ascontiguousarray(reference).view(dtype).ravel()
+        return np.isin(keys_void, reference_void)
+
+    def revalidate(self, grasps, points):
+        """ Input:
+            grasps          - list[rob9.msg.GraspMsg]
+            points          - np.array, shape (N, 3), points in changed voxels
+
+            Output:
+            grasps          - list[rob9.msg.GraspMsg], the grasps not colliding
+                              with points
+        """
+
+        if points.shape[0] == 0:
+            return grasps
+
+        valid = []
+        for grasp in grasps:
+            position = grasp.pose.position
+            orientation = grasp.pose.orientation
+            translation = np.array([position.x, position.y, position.z])
+            rotation = R.from_quat([orientation.x, orientation.y, orientation.z, orientation.w]).as_matrix()
+
+            if not np.any(self.gripper.checkCollision(points, rotation[np.newaxis], translation)):
+                valid.append(grasp)
+
+        return valid
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats["entries"] = len(self.entries)
+        return stats
+
+    def clear(self):
+        self.entries.clear()
+
+# shared by every GraspingGeneratorClient in the process
+grasp_cache = GraspCache()
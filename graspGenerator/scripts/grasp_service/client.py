@@ -10,6 +10,8 @@ import open3d as o3d
 import copy
 from cameraService.cameraClient import CameraClient
 from rob9Utils.graspGroup import GraspGroup, Grasp
+from grasp_service.cache import grasp_cache
+import rob9Utils.services as services
 
 class GraspingGeneratorClient(object):
     """docstring for GraspingGeneratorClient."""
@@ -28,6 +30,10 @@ class GraspingGeneratorClient(object):
         self.depth_min = 0
         self.depth_max = 0.03
 
+        # see grasp_service.cache, the key holds the settings the server
+        # publishes, see GraspServer.publishSettings()
+        self.use_cache = True
+
     def run(self, sampled_grasp_points, pcd_environment, frame_id, tool_id,
             affordance_id, object_instance):
         """ Input:
@@ -38,25 +44,56 @@ class GraspingGeneratorClient(object):
             grasps                  - rob9.GraspGroup()
         """
 
+        pcd_points = np.asanyarray(pcd_environment.points)
+
+        settings = None
+        if self.use_cache:
+            settings = self.getServerSettings()
+        use_cache = settings is not None
+        if use_cache:
+            settings = settings + (str(frame_id), int(tool_id), int(affordance_id), int(object_instance))
+            cached_grasps = grasp_cache.lookup(sampled_grasp_points, pcd_points, settings)
+            print("Grasp cache: ", grasp_cache.getStats())
+            if cached_grasps is not None:
+                msg = GraspGroupMsg()
+                msg.grasps = cached_grasps
+                return GraspGroup().fromGraspGroupMsg(msg)
+
         print("Waiting for grasp service")
-        rospy.wait_for_service("/iiwa/grasp_generator/result")
+        services.getProxy("/iiwa/grasp_generator/result", runGraspingSrv)
         print("Grasp service is up, generating grasps...")
-        graspGeneratorService = rospy.ServiceProxy("/iiwa/grasp_generator/result", runGraspingSrv)
 
         cam_client = CameraClient()
 
-        pcd_points = np.asanyarray(pcd_environment.points)
         pcd_msg, _ = cam_client.packPCD(pcd_points, None)
         grasp_points_msg, _ = cam_client.packPCD(sampled_grasp_points, None)
 
-        response = graspGeneratorService(grasp_points_msg, pcd_msg, String(frame_id),
-                                        Int32(tool_id), Int32(affordance_id),
-                                        Int32(object_instance))
+        response = services.call("/iiwa/grasp_generator/result", runGraspingSrv,
+                                grasp_points_msg, pcd_msg, String(frame_id),
+                                Int32(tool_id), Int32(affordance_id),
+                                Int32(object_instance))
 
         grasps = GraspGroup().fromGraspGroupMsg(response)
 
+        if use_cache:
+            grasp_cache.store(sampled_grasp_points, pcd_points, settings, response.grasps)
+
         return grasps
 
+    def getServerSettings(self):
+        """ Output:
+            settings    - tuple, sorted (name, value) of the settings the grasp
+                          server computes grasps with, None if the server does
+                          not publish them
+        """
+
+        settings = rospy.get_param("/iiwa/grasp_generator/settings", None)
+        if settings is None:
+            print("Grasp server settings are unknown, not using the grasp cache")
+            return None
+
+        return tuple(sorted(settings.items()))
+
     def packGrasps(self, poses, scores, frame_id, tool_id,
                                         affordance_id, obj_inst):
 
@@ -95,9 +132,7 @@ class GraspingGeneratorClient(object):
         self.depth_min = depth_min
         self.depth_max = depth_max
 
-        rospy.wait_for_service("/iiwa/grasp_generator/set_settings")
-        graspGeneratorService = rospy.ServiceProxy("/iiwa/grasp_generator/set_settings", setSettingsGraspingSrv)
-
-        response = graspGeneratorService(Float32(azimuth_step_size), Int32(azimuth_min), Float32(azimuth_max),
+        response = services.call("/iiwa/grasp_generator/set_settings", setSettingsGraspingSrv,
+                                        Float32(azimuth_step_size), Int32(azimuth_min), Float32(azimuth_max),
                                         Float32(polar_step_size), Int32(polar_min), Float32(polar_max),
                                         Float32(depth_step_size), Int32(depth_min), Float32(depth_max))
@@ -0,0 +1,135 @@
+import numpy as np
+
+class GripperCollisionModel(object):
+    """ The Panda hand as three fixed oriented bounding boxes, chasis, left
+        finger and right finger, in the gripper frame. Points are checked
+        against a whole batch of gripper poses at once by moving the points
+        into each gripper frame instead of moving the gripper.
+
+        Box dimensions are the ones of rob9Utils.visualize.createGripper().
+    """
+
+    def __init__(self, opening = 0.12):
+        """ Input:
+            opening         - float, how open is the gripper given in meters.
+        """
+
+        self.opening = opening
+
+        finger_width = 0.03 # y-axis when built, see createGripper()
+        finger_height = 0.045
+        finger_offset_z = 0.01
+
+        chasis_width = 0.04
+        chasis_length = 0.18
+        chasis_height = 0.12
+
+        # (min, max) corners of chasis, left finger, right finger
+        box_min = np.array([[-chasis_width / 2, -chasis_length / 2, -chasis_height - 0.035],
+                            [-chasis_width / 2, (-finger_width / 2) - (opening / 2), -finger_offset_z - finger_height],
+                            [-chasis_width, (-finger_width / 2) + (opening / 2), -finger_offset_z - finger_height]])
+        box_max = np.array([[chasis_width / 2, chasis_length / 2, -0.035],
+                            [chasis_width / 2, (finger_width / 2) - (opening / 2), finger_offset_z],
+                            [chasis_width, (finger_width / 2) + (opening / 2), finger_offset_z]])
+
+        self.centers = (box_min + box_max) / 2
+        self.half_extents = (box_max - box_min) / 2
+
+    def toGripperFrame(self, points, rotations, translation):
+        """ Input:
+            points          - np.array, shape (N, 3), points in world frame
+            rotations       - np.array, shape (K, 3, 3), gripper to world rotations
+            translation     - np.array, shape (3), gripper position in world frame
+
+            Output:
+            local_points    - np.array, shape (K, N, 3), points in each gripper frame
+        """
+
+        return np.einsum('kji,nj->kni', rotations, points - translation)
+
+    def checkCollision(self, points, rotations, translation):
+        """ Input:
+            points          - np.array, shape (N, 3), points in world frame
+            rotations       - np.array, shape (K, 3, 3), gripper to world rotations
+            translation     - np.array, shape (3), gripper position in world frame
+
+            Output:
+            collisions      - np.array, bool, shape (K, 3), True if any point is
+                              inside chasis, left finger, right finger
+        """
+
+        collisions = np.zeros((rotations.shape[0], 3), dtype=bool)
+        if points.shape[0] == 0:
+            return collisions
+
+        local_points = self.toGripperFrame(points, rotations, translation)
+        for box in range(3):
+            inside = np.all(np.abs(local_points - self.centers[box]) <= self.half_extents[box], axis=-1)
+            collisions[:, box] = np.any(inside, axis=-1)
+
+        return collisions
+
+    def getFingerCenters(self, rotations, translation):
+        """ Input:
+            rotations       - np.array, shape (K, 3, 3), gripper to world rotations
+            translation     - np.array, shape (3), gripper position in world frame
+
+            Output:
+            centers         - np.array, shape (K, 2, 3), left and right finger
+                              centers in world frame
+        """
+
+        return np.einsum('kij,fj->kfi', rotations, self.centers[1:]) + translation
+
+    def firstCollisionDepth(self, points, rotation, translation, direction, depth_values):
+        """ Finds the first depth at which the gripper collides when it is moved
+            from translation along direction. Points move along a straight line
+            in the gripper frame, so the depths where a point is inside a box
+            form an interval, and the first colliding depth is found with one
+            searchsorted per box.
+
+            Input:
+            points          - np.array, shape (N, 3), points in world frame
+            rotation        - np.array, shape (3, 3), gripper to world rotation
+            translation     - np.array, shape (3), gripper position at depth 0
+            direction       - np.array, shape (3), unit direction in world frame,
+                              the gripper is at translation + depth * direction
+            depth_values    - np.array, shape (D), ascending depths
+
+            Output:
+            index           - int, index of the first colliding depth, D if the
+                              gripper does not collide at any depth
+        """
+
+        num_depths = depth_values.shape[0]
+        if points.shape[0] == 0 or num_depths == 0:
+            return num_depths
+
+        local_points = np.dot(points - translation, rotation)
+        velocity = -np.dot(rotation.T, direction)
+
+        first = num_depths
+        for box in range(3):
+            low = np.full(points.shape[0], -np.inf)
+            high = np.full(points.shape[0], np.inf)
+
+            for axis in range(3):
+                lower = self.centers[box, axis] - self.half_extents[box, axis] - local_points[:, axis]
+                upper = self.centers[box, axis] + self.half_extents[box, axis] - local_points[:, axis]
+
+                if abs(velocity[axis]) < 1e-12:
+                    outside = np.logical_or(lower > 0, upper < 0)
+                    low[outside] = np.inf
+                else:
+                    d_1 = lower / velocity[axis]
+                    d_2 = upper / velocity[axis]
+                    low = np.maximum(low, np.minimum(d_1, d_2))
+                    high = np.minimum(high, np.maximum(d_1, d_2))
+
+            idx = np.searchsorted(depth_values, low, side='left')
+            hit = idx < num_depths
+            hit[hit] = depth_values[idx[hit]] <= high[hit]
+            if np.any(hit):
+                first = min(first, int(np.min(idx[hit])))
+
+        return first
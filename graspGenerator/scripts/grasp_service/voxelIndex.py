@@ -0,0 +1,88 @@
+import numpy as np
+
+class VoxelHashIndex(object):
+    """ Uniform voxel hash over a point cloud. Points are sorted by voxel so
+        every occupied voxel is a contiguous bucket of the sorted points and a
+        box query only touches the buckets overlapping the box.
+    """
+
+    def __init__(self, points, voxel_size = 0.1):
+        """ Input:
+            points          - np.array, shape (N, 3)
+            voxel_size      - float, edge length of a voxel in meters
+        """
+
+        self.voxel_size = voxel_size
+        points = np.asanyarray(points)
+
+        if points.shape[0] == 0:
+            self.origin = np.zeros(3)
+            self.dims = np.ones(3, dtype=np.int64)
+            self.points = points.reshape(0, 3)
+            self.keys = np.zeros(0, dtype=np.int64)
+            self.starts = np.zeros(1, dtype=np.int64)
+            return
+
+        self.origin = np.min(points, axis=0)
+        cells = self.toCells(points)
+        self.dims = np.max(cells, axis=0) + 1
+
+        keys = self.toKeys(cells)
+        order = np.argsort(keys, kind='stable')
+        self.points = points[order]
+
+        # one bucket per occupied voxel, bucket i is points[starts[i]:starts[i + 1]]
+        self.keys, starts = np.unique(keys[order], return_index=True)
+        self.starts = np.append(starts, points.shape[0])
+
+    def toCells(self, points):
+        return np.floor((points - self.origin) / self.voxel_size).astype(np.int64)
+
+    def toKeys(self, cells):
+        return (cells[..., 0] * self.dims[1] + cells[..., 1]) * self.dims[2] + cells[..., 2]
+
+    def getBuckets(self, center, half_size):
+        """ Input:
+            center          - np.array, shape (3)
+            half_size       - float, half edge length of the query box
+
+            Output:
+            buckets         - list[np.array], shape (n_i, 3), views into the sorted
+                              points of every occupied voxel overlapping the box
+        """
+
+        cell_min = np.maximum(self.toCells(center - half_size), 0)
+        cell_max = np.minimum(self.toCells(center + half_size), self.dims - 1)
+        if np.any(cell_max < cell_min):
+            return []
+
+        ranges = [np.arange(cell_min[axis], cell_max[axis] + 1) for axis in range(3)]
+        cells = np.stack(np.meshgrid(*ranges, indexing='ij'), axis=-1).reshape(-1, 3)
+        keys = self.toKeys(cells)
+
+        pos = np.searchsorted(self.keys, keys)
+        valid = pos < self.keys.shape[0]
+        pos, keys = pos[valid], keys[valid]
+        occupied = pos[self.keys[pos] == keys]
+
+        return [self.points[self.starts[i]:self.starts[i + 1]] for i in occupied]
+
+    def queryBox(self, center, half_size):
+        """ Points strictly inside an axis aligned box, same result as cropping
+            the full cloud with center - half_size < p < center + half_size.
+
+            Input:
+            center          - np.array, shape (3)
+            half_size       - float, half edge length of the query box
+
+            Output:
+            points          - np.array, shape (M, 3)
+        """
+
+        buckets = self.getBuckets(center, half_size)
+        if len(buckets) == 0:
+            return self.points[:0]
+
+        points = np.concatenate(buckets)
+        inside = np.all((points > center - half_size) & (points < center + half_size), axis=1)
+        return points[inside]
@@ -9,6 +9,9 @@ import cv2
 import math
 from scipy.spatial.transform import Rotation as R
 from sklearn.neighbors import NearestNeighbors
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
 
 from nav_msgs.msg import Path
 from geometry_msgs.msg import Pose
@@ -20,11 +23,281 @@ from rob9.msg import *
 from rob9.srv import *
 from rob9Utils.visualize import create_mesh_box, createGripper, visualizeGripper, visualizeFrameMesh
 from grasp_service.client import GraspingGeneratorClient
+from grasp_service.collision import GripperCollisionModel
+from grasp_service.voxelIndex import VoxelHashIndex
 from cameraService.cameraClient import CameraClient
 from scipy.spatial import distance
 #from rob9Utils.graspGroup import GraspGroup as rob9GraspGroup
 #from rob9Utils.grasp import Grasp as rob9Grasp
 
+class GraspPointEvaluator(object):
+    """ Orientation and depth sweep of a single sampled grasp point, holds
+        everything that is shared between the grasp points of a request.
+    """
+
+    def __init__(self, env_points, sampled_grasp_points, gripper, polar_values,
+                    azimuth_values, depth_values, local_size, sampling = "grid",
+                    coarse_stride = 4, refine_top_k = 3, evaluation_budget = 0):
+        """ Input:
+            env_points              - np.array, shape (N, 3), environment points
+            sampled_grasp_points    - np.array, shape (M, 3), downsampled grasp points
+            gripper                 - GripperCollisionModel
+            polar_values            - np.array, polar angles to sweep
+            azimuth_values          - np.array, azimuth angles to sweep
+            depth_values            - np.array, depths to sweep
+            local_size              - float, half size of the environment box
+                                      around a grasp point
+            sampling                - str, "grid" checks every polar, azimuth
+                                      combination, "adaptive" checks a coarse grid
+                                      and refines around the best free cells
+            coarse_stride           - int, grid cells between coarse samples
+            refine_top_k            - int, free cells refined per level
+            evaluation_budget       - int, max orientations checked per grasp
+                                      point in adaptive sampling, 0 for no limit
+        """
+
+        self.sampled_grasp_points = sampled_grasp_points
+        self.gripper = gripper
+        self.polar_values = polar_values
+        self.azimuth_values = azimuth_values
+        self.depth_values = depth_values
+        self.local_size = local_size
+        self.sampling = sampling
+        self.coarse_stride = max(1, int(coarse_stride))
+        self.refine_top_k = refine_top_k
+        self.evaluation_budget = evaluation_budget
+
+        # every polar, azimuth combination, row major in polar so the flat
+        # index matches blob_matrix
+        self.polar_grid, self.azimuth_grid = np.meshgrid(polar_values, azimuth_values, indexing='ij')
+        ee_rotations = np.zeros((self.polar_grid.size, 3))
+        ee_rotations[:, 0] = math.pi + (math.pi * self.polar_grid.flatten()) # franka
+        ee_rotations[:, 2] = math.pi * self.azimuth_grid.flatten()
+        self.eeRotMats = R.from_euler('XYZ', ee_rotations).as_matrix()
+
+        self.env_index = VoxelHashIndex(env_points, voxel_size = local_size)
+
+        # one tree over all grasp points, the current one is skipped at query time
+        self.neigh = NearestNeighbors(n_neighbors=min(2, sampled_grasp_points.shape[0]), algorithm='kd_tree')
+        self.neigh.fit(sampled_grasp_points)
+
+    def distanceToOtherGraspPoints(self, points, grasp_count):
+        """ Input:
+            points          - np.array, shape (N, 3)
+            grasp_count     - int, index of the grasp point being evaluated
+
+            Output:
+            distances       - np.array, shape (N), distance to the closest grasp
+                              point other than grasp_count, 0 if there is none
+        """
+
+        if self.neigh.n_samples_fit_ < 2:
+            return np.zeros(points.shape[0])
+
+        distances, indices = self.neigh.kneighbors(points, n_neighbors = 2, return_distance = True)
+        return np.where(indices[:, 0] == grasp_count, distances[:, 1], distances[:, 0])
+
+    def checkOrientations(self, s_grasp, local_points, grasp_count, flat_idx, free = None, clearance = None):
+        """ Checks a batch of grid orientations for collisions and computes the
+            finger clearance of the free ones.
+
+            Input:
+            s_grasp         - np.array, shape (3), grasp point
+            local_points    - np.array, shape (N, 3), environment around s_grasp
+            grasp_count     - int, index of the grasp point
+            flat_idx        - np.array, int, flat grid indices to check
+            free            - np.array, bool, shape (K), updated in place if given
+            clearance       - np.array, shape (K), updated in place if given
+
+            Output:
+            free            - np.array, bool, shape (K), True for checked
+                              collision free orientations
+            clearance       - np.array, shape (K), distance of the closest finger
+                              to the other grasp points, -1 if not free
+        """
+
+        if free is None:
+            free = np.zeros(self.eeRotMats.shape[0], dtype=bool)
+            clearance = np.full(self.eeRotMats.shape[0], -1.0)
+
+        eeRotMats = self.eeRotMats[flat_idx]
+        collision_env = np.any(self.gripper.checkCollision(local_points, eeRotMats, s_grasp), axis=1)
+        collision_self = np.any(self.gripper.checkCollision(self.sampled_grasp_points, eeRotMats, s_grasp), axis=1)
+        local_free = np.logical_and(~collision_env, ~collision_self)
+
+        free[flat_idx] = local_free
+        if np.any(local_free):
+            finger_centers = self.gripper.getFingerCenters(eeRotMats[local_free], s_grasp)
+            finger_distances = self.distanceToOtherGraspPoints(finger_centers.reshape(-1, 3), grasp_count)
+            clearance[flat_idx[local_free]] = np.min(finger_distances.reshape(-1, 2), axis=1)
+
+        return free, clearance
+
+    def sampleOrientationsAdaptive(self, s_grasp, local_points, grasp_count):
+        """ Coarse to fine orientation search. A grid with every coarse_stride
+            cell is checked first, then the stride is halved and the neighbours
+            of the refine_top_k free cells with the largest clearance are
+            checked, until the stride is 1 or evaluation_budget is spent.
+
+            Input:
+            s_grasp         - np.array, shape (3), grasp point
+            local_points    - np.array, shape (N, 3), environment around s_grasp
+            grasp_count     - int, index of the grasp point
+
+            Output:
+            free, clearance - see checkOrientations(), unchecked orientations
+                              are not free
+        """
+
+        num_polar, num_azimuth = self.polar_grid.shape
+        num_orientations = num_polar * num_azimuth
+
+        budget = self.evaluation_budget if self.evaluation_budget > 0 else num_orientations
+        checked = np.zeros(num_orientations, dtype=bool)
+
+        stride = self.coarse_stride
+        polar_idx = np.union1d(np.arange(0, num_polar, stride), [num_polar - 1])
+        azimuth_idx = np.union1d(np.arange(0, num_azimuth, stride), [num_azimuth - 1])
+        flat_idx = (polar_idx[:, np.newaxis] * num_azimuth + azimuth_idx[np.newaxis, :]).flatten()[:budget]
+
+        free, clearance = self.checkOrientations(s_grasp, local_points, grasp_count, flat_idx)
+        checked[flat_idx] = True
+        budget -= flat_idx.shape[0]
+
+        while stride > 1 and budget > 0:
+            stride = max(1, stride // 2)
+
+            candidates = np.flatnonzero(free)
+            if candidates.shape[0] == 0:
+                break
+            order = np.argsort(-clearance[candidates], kind='stable')
+            top = candidates[order[:self.refine_top_k]]
+
+            # neighbours at the new stride around every top cell, best cell first
+            offsets = np.array([(dp, da) for dp in (-stride, 0, stride) for da in (-stride, 0, stride)])
+            top_polar, top_azimuth = np.divmod(top, num_azimuth)
+            polar_n = top_polar[:, np.newaxis] + offsets[:, 0]
+            azimuth_n = top_azimuth[:, np.newaxis] + offsets[:, 1]
+            valid = (polar_n >= 0) & (polar_n < num_polar) & (azimuth_n >= 0) & (azimuth_n < num_azimuth)
+            flat_idx = (polar_n * num_azimuth + azimuth_n)[valid]
+
+            _, first = np.unique(flat_idx, return_index=True)
+            flat_idx = flat_idx[np.sort(first)]
+            flat_idx = flat_idx[~checked[flat_idx]][:budget]
+            if flat_idx.shape[0] == 0:
+                continue
+
+            self.checkOrientations(s_grasp, local_points, grasp_count, flat_idx, free, clearance)
+            checked[flat_idx] = True
+            budget -= flat_idx.shape[0]
+
+        return free, clearance
+
+    def evaluate(self, grasp_count):
+        """ Input:
+            grasp_count     - int, index of the grasp point
+
+            Output:
+            result          - (pose, score), pose is [x, y, z, qx, qy, qz, qw],
+                              None if every orientation collides
+        """
+
+        s_grasp = self.sampled_grasp_points[grasp_count]
+
+        local_points = self.env_index.queryBox(s_grasp, self.local_size)
+
+        blob_matrix = np.zeros((self.polar_values.shape[0],
+                                self.azimuth_values.shape[0])).astype(np.uint8)
+
+        largest_dist = 0
+        best_pol_val = 0
+        best_azi_val = 0
+
+        if self.sampling == "adaptive":
+            free, clearance = self.sampleOrientationsAdaptive(s_grasp, local_points, grasp_count)
+        else:
+            free, clearance = self.checkOrientations(s_grasp, local_points, grasp_count,
+                                                        np.arange(self.eeRotMats.shape[0]))
+
+        blob_matrix[free.reshape(blob_matrix.shape)] = 255
+
+        if np.any(free):
+            best = np.argmax(clearance)
+            if clearance[best] > largest_dist:
+                largest_dist = clearance[best]
+                best_pol_val = self.polar_grid.flat[best]
+                best_azi_val = self.azimuth_grid.flat[best]
+
+        if 255 in np.unique(blob_matrix):
+            #best_grasp_idx, score = self.processGrasps(blob_matrix)
+            #score = largest_dist
+
+            #polar_value = self.polar_values[best_grasp_idx[0]]
+            #azimuth_value = self.azimuth_values[best_grasp_idx[1]]
+
+            polar_value = best_pol_val
+            azimuth_value = best_azi_val
+
+            ee_rotation = np.array([math.pi + (math.pi * polar_value), 0, (math.pi *azimuth_value)]) # franka
+            #ee_rotation = np.array([0, math.pi / 2, math.pi/2])
+            #ee_rotation = np.array([0, math.pi / 2, 0])
+            #ee_rotation = np.array([(math.pi / 2.0) + (math.pi * azimuth_value) + math.pi, 0, (math.pi) + (math.pi * polar_value)])
+            #rotEE = R.from_euler('ZYX', ee_rotation)
+            rotEE = R.from_euler('XYZ', ee_rotation)
+            eeRotMat = rotEE.as_matrix()
+
+            # the gripper moves down along world z, the first colliding depth
+            # ends the sweep, its finger clearance is still part of the score
+            direction = np.array([0.0, 0.0, -1.0])
+            d_count = self.gripper.firstCollisionDepth(local_points, eeRotMat, s_grasp,
+                                                        direction, self.depth_values)
+            num_scored = min(d_count + 1, self.depth_values.shape[0])
+
+            finger_centers = self.gripper.getFingerCenters(eeRotMat[np.newaxis], s_grasp)
+            finger_centers = finger_centers + self.depth_values[:num_scored, np.newaxis, np.newaxis] * direction
+            finger_distances = self.distanceToOtherGraspPoints(finger_centers.reshape(-1, 3), grasp_count)
+            score = np.sum(np.min(finger_distances.reshape(-1, 2), axis=1))
+
+            #score = (d_count + 1) / self.depth_values.shape[0]
+
+            translation = s_grasp.copy()
+            translation[2] = s_grasp[2] - self.depth_values[int(d_count / 2)]
+            #score = 1 - distance.euclidean(np.linalg.norm(translation), np.linalg.norm(centroid))
+            #translation[2] = s_grasp[2] - self.depth_values[min(0, d_count-1)]
+
+            print(score)
+            #vis_gripper = visualizeGripper(gripper)
+            #gripper_frame = visualizeFrameMesh(translation, eeRotMat)
+            #o3d.visualization.draw_geometries([pcd_downsample, vis_gripper, gripper_frame])
+
+            quat = rotEE.as_quat()
+            pose = [translation[0], translation[1], translation[2],
+                        quat[0], quat[1], quat[2], quat[3]]
+
+            return pose, score
+
+        return None
+
+# evaluator of a grasp point worker process, see initGraspWorker()
+_grasp_worker = {}
+
+def initGraspWorker(env_name, env_shape, grasp_name, grasp_shape, gripper, settings):
+    """ Attaches a worker process to the shared environment and grasp point
+        arrays and builds its own GraspPointEvaluator over them.
+    """
+
+    env_shm = shared_memory.SharedMemory(name = env_name)
+    grasp_shm = shared_memory.SharedMemory(name = grasp_name)
+
+    env_points = np.ndarray(env_shape, dtype = np.float64, buffer = env_shm.buf)
+    grasp_points = np.ndarray(grasp_shape, dtype = np.float64, buffer = grasp_shm.buf)
+
+    _grasp_worker["shm"] = [env_shm, grasp_shm]
+    _grasp_worker["evaluator"] = GraspPointEvaluator(env_points, grasp_points, gripper, **settings)
+
+def evaluateGraspPoint(grasp_count):
+    return _grasp_worker["evaluator"].evaluate(grasp_count)
+
 class GraspServer(object):
     """docstring for GraspServer."""
 
@@ -48,6 +321,17 @@ class GraspServer(object):
         self.depth_min = 0
         self.depth_max = 0.03
 
+        self.gripper = GripperCollisionModel(opening = 0.12)
+        self.local_size = 0.1 # m, half size of the environment box around a grasp point
+        self.num_workers = rospy.get_param("~num_workers", 1) # grasp points evaluated in parallel
+
+        # orientation sampling, "grid" or "adaptive", see GraspPointEvaluator
+        self.orientation_sampling = rospy.get_param("~orientation_sampling", "grid")
+        self.coarse_stride = rospy.get_param("~coarse_stride", 4)
+        self.refine_top_k = rospy.get_param("~refine_top_k", 3)
+        self.evaluation_budget = rospy.get_param("~evaluation_budget", 0) # per grasp point, 0 for no limit
+        self.publishSettings()
+
         self.serviceRun = rospy.Service("grasp_generator/result", runGraspingSrv, self.run)
         self.serviceSetSettings = rospy.Service("grasp_generator/set_settings", setSettingsGraspingSrv, self.setSettings)
 
@@ -65,10 +349,34 @@ class GraspServer(object):
         self.depth_min = msg.depth_min.data
         self.depth_max = msg.depth_max.data
 
+        self.publishSettings()
         print("Updated settings")
 
         return setSettingsGraspingSrvResponse()
 
+    def publishSettings(self):
+        """ Publishes the settings the grasps are computed with on the
+            parameter server, next to the services, clients use them in the
+            key of their grasp cache, see GraspingGeneratorClient.run() """
+
+        rospy.set_param("grasp_generator/settings", {
+                        "azimuth_step_size": self.azimuth_step_size,
+                        "azimuth_min": self.azimuth_min,
+                        "azimuth_max": self.azimuth_max,
+                        "polar_step_size": self.polar_step_size,
+                        "polar_min": self.polar_min,
+                        "polar_max": self.polar_max,
+                        "depth_step_size": self.depth_step_size,
+                        "depth_min": self.depth_min,
+                        "depth_max": self.depth_max,
+                        "opening": self.gripper.opening,
+                        "local_size": self.local_size,
+                        "orientation_sampling": self.orientation_sampling,
+                        "coarse_stride": self.coarse_stride,
+                        "refine_top_k": self.refine_top_k,
+                        "evaluation_budget": self.evaluation_budget,
+                        "num_workers": self.num_workers})
+
     def run(self, msg):
 
         cam_client = CameraClient()
@@ -82,9 +390,6 @@ class GraspServer(object):
         affordance_id = msg.affordance_id.data
         obj_inst = msg.object_instance.data
 
-        pcd_downsample = o3d.geometry.PointCloud()
-        pcd_downsample.points = o3d.utility.Vector3dVector(pcd_env_points)
-
         sampled_grasps = o3d.geometry.PointCloud()
         sampled_grasps.points = o3d.utility.Vector3dVector(sampled_grasp_points)
         sampled_grasps = sampled_grasps.voxel_down_sample(voxel_size=0.02)
@@ -100,148 +405,24 @@ class GraspServer(object):
         centroid = sampled_grasps.get_center()
         bounds = sampled_grasps.get_max_bound() - sampled_grasps.get_min_bound()
 
+        settings = {"polar_values": polar_values, "azimuth_values": azimuth_values,
+                    "depth_values": depth_values, "local_size": self.local_size,
+                    "sampling": self.orientation_sampling, "coarse_stride": self.coarse_stride,
+                    "refine_top_k": self.refine_top_k, "evaluation_budget": self.evaluation_budget}
+
+        if sampled_grasp_points.shape[0] == 0:
+            results = []
+        elif self.num_workers > 1 and sampled_grasp_points.shape[0] > 1:
+            results = self.evaluateGraspPointsParallel(pcd_env_points, sampled_grasp_points, settings)
+        else:
+            evaluator = GraspPointEvaluator(pcd_env_points, sampled_grasp_points, self.gripper, **settings)
+            results = [evaluator.evaluate(grasp_count) for grasp_count in range(sampled_grasp_points.shape[0])]
+
         poses, scores = [], []
-        for grasp_count, s_grasp in enumerate(np.asanyarray(sampled_grasp_points)):
-
-
-            local_points = np.asanyarray(pcd_downsample.points)
-            idx_min_x = local_points[:,0] > (s_grasp[0] - 0.1)
-            local_points = local_points[idx_min_x]
-            idx_max_x = local_points[:,0] < (s_grasp[0] + 0.1)
-            local_points = local_points[idx_max_x]
-
-            idx_min_y = local_points[:,1] > (s_grasp[1] - 0.1)
-            local_points = local_points[idx_min_y]
-            idx_max_y = local_points[:,1] < (s_grasp[1] + 0.1)
-            local_points = local_points[idx_max_y]
-
-            idx_min_z = local_points[:,2] > (s_grasp[2] - 0.1)
-            local_points = local_points[idx_min_z]
-            idx_max_z = local_points[:,2] < (s_grasp[2] + 0.1)
-            local_points = local_points[idx_max_z]
-
-            blob_matrix = np.zeros((polar_values.shape[0],
-                                    azimuth_values.shape[0])).astype(np.uint8)
-
-            sampled_grasps_without_current = []
-            for g_count, g in enumerate(sampled_grasp_points):
-                if g_count != grasp_count:
-                    sampled_grasps_without_current.append(g)
-            sampled_grasps_without_current = np.array(sampled_grasps_without_current)
-            neigh= NearestNeighbors(n_neighbors=1)
-            neigh.fit(sampled_grasps_without_current)
-
-            largest_dist = 0
-            best_pol_val = 0
-            best_azi_val = 0
-
-            for y_count, polar_value in enumerate(polar_values):
-                for x_count, azimuth_value in enumerate(azimuth_values):
-
-                    # compute translation
-                    translation = s_grasp.copy()
-                    translation[2] = s_grasp[2]# - depth_value
-
-                    # compute orientation
-
-                    ee_rotation = np.array([math.pi + (math.pi * polar_value), 0, (math.pi *azimuth_value)]) # franka
-                    #ee_rotation = np.array([(math.pi / 2.0) + (math.pi * azimuth_value) + math.pi, 0, (math.pi) + (math.pi * polar_value)])
-                    rotEE = R.from_euler('XYZ', ee_rotation)
-                    eeRotMat = rotEE.as_matrix()
-
-                    #world_gripper = createGripper(opening = 0.08, translation = np.zeros(3), rotation = np.identity(3))
-                    #vis_world_gripper = visualizeGripper(world_gripper)
-                    #world_coordinate_frame = visualizeFrameMesh(np.zeros(3),np.identity(3))
-                    #o3d.visualization.draw_geometries([pcd_downsample,  vis_world_gripper, world_coordinate_frame])
-
-
-                    gripper = createGripper(opening = 0.12, translation = translation, rotation = eeRotMat)
-                    if self.checkCollisionEnvironment(gripper, local_points) == False:
-                        if self.checkCollisionEnvironment(gripper, sampled_grasp_points) == False:
-                            #vis_gripper = visualizeGripper(gripper)
-                            #gripper_frame = visualizeFrameMesh(translation, eeRotMat)
-                            #o3d.visualization.draw_geometries([pcd_downsample,  vis_gripper, gripper_frame])
-                            blob_matrix[y_count, x_count] = 255 #outcommented today
-                            distance_left_finger, _ = neigh.kneighbors(np.reshape(gripper[1].get_center(), (1, 3)), return_distance = True)
-                            distance_right_finger, _ = neigh.kneighbors(np.reshape(gripper[2].get_center(), (1, 3)), return_distance = True)
-                            distance_left_finger = distance_left_finger[0][0]
-                            distance_right_finger = distance_right_finger[0][0]
-                            dist_to_self = min(distance_left_finger, distance_right_finger)
-
-                            if dist_to_self > largest_dist:
-                                largest_dist = dist_to_self
-                                best_azi_val = azimuth_value
-                                best_pol_val = polar_value
-                            #print("Colliion self FALSE")
-
-                            #vis_gripper = visualizeGripper(gripper)
-                            #gripper_frame = visualizeFrameMesh(translation, eeRotMat)
-                            #o3d.visualization.draw_geometries([pcd_downsample,  vis_gripper, gripper_frame])
-                        #else:
-                        #    print("Collision self TRUE")
-                    #else:
-                    #    print("Colliion environment TRUE")
-
-
-
-            if 255 in np.unique(blob_matrix):
-                #best_grasp_idx, score = self.processGrasps(blob_matrix)
-                #score = largest_dist
-
-                #polar_value = polar_values[best_grasp_idx[0]]
-                #azimuth_value = azimuth_values[best_grasp_idx[1]]
-
-                polar_value = best_pol_val
-                azimuth_value = best_azi_val
-
-                ee_rotation = np.array([math.pi + (math.pi * polar_value), 0, (math.pi *azimuth_value)]) # franka
-                #ee_rotation = np.array([0, math.pi / 2, math.pi/2])
-                #ee_rotation = np.array([0, math.pi / 2, 0])
-                #ee_rotation = np.array([(math.pi / 2.0) + (math.pi * azimuth_value) + math.pi, 0, (math.pi) + (math.pi * polar_value)])
-                #rotEE = R.from_euler('ZYX', ee_rotation)
-                rotEE = R.from_euler('XYZ', ee_rotation)
-                eeRotMat = rotEE.as_matrix()
-
-                score = 0
-
-                d_count = 0
-                for depth_value in depth_values:
-
-                    translation = s_grasp.copy()
-                    translation[2] = translation[2] - depth_value
-                    gripper = createGripper(opening = 0.12, translation = translation, rotation = eeRotMat)
-
-                    distance_left_finger, _ = neigh.kneighbors(np.reshape(gripper[1].get_center(), (1, 3)), return_distance = True)
-                    distance_right_finger, _ = neigh.kneighbors(np.reshape(gripper[2].get_center(), (1, 3)), return_distance = True)
-                    distance_left_finger = distance_left_finger[0][0]
-                    distance_right_finger = distance_right_finger[0][0]
-                    dist_to_self = min(distance_left_finger, distance_right_finger)
-                    score += dist_to_self
-                    #vis_gripper = visualizeGripper(gripper)
-                    #gripper_frame = visualizeFrameMesh(translation, eeRotMat)
-                    #o3d.visualization.draw_geometries([pcd_downsample, vis_gripper, gripper_frame])
-
-                    if self.checkCollisionEnvironment(gripper, local_points) == True:
-                        break
-
-                    d_count += 1
-
-                #score = (d_count + 1) / depth_values.shape[0]
-
-                translation = s_grasp.copy()
-                translation[2] = s_grasp[2] - depth_values[int(d_count / 2)]
-                #score = 1 - distance.euclidean(np.linalg.norm(translation), np.linalg.norm(centroid))
-                #translation[2] = s_grasp[2] - depth_values[min(0, d_count-1)]
-
-                print(score)
-                #vis_gripper = visualizeGripper(gripper)
-                #gripper_frame = visualizeFrameMesh(translation, eeRotMat)
-                #o3d.visualization.draw_geometries([pcd_downsample, vis_gripper, gripper_frame])
-
-                quat = rotEE.as_quat()
-                poses.append([translation[0], translation[1], translation[2],
-                            quat[0], quat[1], quat[2], quat[3]])
-                scores.append(score)
+        for result in results:
+            if result is not None:
+                poses.append(result[0])
+                scores.append(result[1])
 
         print("Computed grasps, now sending...")
 
@@ -254,6 +435,46 @@ class GraspServer(object):
 
         return response
 
+    def evaluateGraspPointsParallel(self, env_points, sampled_grasp_points, settings):
+        """ Evaluates the grasp points on a process pool, the environment and
+            grasp points are shared with the workers through shared memory.
+
+            Input:
+            env_points              - np.array, shape (N, 3)
+            sampled_grasp_points    - np.array, shape (M, 3)
+            settings                - dict, keyword arguments of GraspPointEvaluator
+
+            Output:
+            results                 - list, GraspPointEvaluator.evaluate() of every
+                                      grasp point in order
+        """
+
+        env_points = np.ascontiguousarray(env_points, dtype = np.float64)
+        sampled_grasp_points = np.ascontiguousarray(sampled_grasp_points, dtype = np.float64)
+
+        env_shm = shared_memory.SharedMemory(create = True, size = max(env_points.nbytes, 1))
+        grasp_shm = shared_memory.SharedMemory(create = True, size = sampled_grasp_points.nbytes)
+        np.ndarray(env_points.shape, dtype = np.float64, buffer = env_shm.buf)[:] = env_points
+        np.ndarray(sampled_grasp_points.shape, dtype = np.float64, buffer = grasp_shm.buf)[:] = sampled_grasp_points
+
+        num_grasps = sampled_grasp_points.shape[0]
+        chunksize = max(1, num_grasps // (4 * self.num_workers))
+
+        try:
+            with ProcessPoolExecutor(max_workers = self.num_workers,
+                                    mp_context = multiprocessing.get_context("fork"),
+                                    initializer = initGraspWorker,
+                                    initargs = (env_shm.name, env_points.shape, grasp_shm.name,
+                                                sampled_grasp_points.shape, self.gripper, settings)) as executor:
+                results = list(executor.map(evaluateGraspPoint, range(num_grasps), chunksize = chunksize))
+        finally:
+            env_shm.close()
+            env_shm.unlink()
+            grasp_shm.close()
+            grasp_shm.unlink()
+
+        return results
+
     def processGrasps(self, blob_img):
 
 
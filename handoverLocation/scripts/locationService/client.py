@@ -3,6 +3,7 @@ import rospy
 from std_msgs.msg import Bool
 import numpy as np
 from location_service.srv import requestReceiverPose, requestReceiverPoseResponse
+import rob9Utils.services as services
 
 class LocationClient(object):
     """docstring for locationClient."""
@@ -13,12 +14,9 @@ class LocationClient(object):
 
     def getLocation(self):
 
-        rospy.wait_for_service('/iiwa/requestReceiverPose')
-        get_receiver_pose = rospy.ServiceProxy("/iiwa/requestReceiverPose", requestReceiverPose)
-
         req = Bool()
         req.data = True
-        resp = get_receiver_pose(req)
+        resp = services.call("/iiwa/requestReceiverPose", requestReceiverPose, req)
 
         location = self.unpackLocation(resp.receiver)
 
@@ -6,6 +6,7 @@ from cameraService.cameraClient import CameraClient
 from affordanceService.client import AffordanceClient
 from orientation_service.srv import runOrientationSrv, runOrientationSrvResponse
 from orientation_service.srv import setSettingsOrientationSrv, setSettingsOrientationSrvResponse
+import rob9Utils.services as services
 
 class OrientationClient(object):
     """docstring for orientationClient."""
@@ -17,9 +18,7 @@ class OrientationClient(object):
     def getOrientation(self, pcd_affordance):
 
         print("Waiting for orientation service...")
-        rospy.wait_for_service("/computation/handover_orientation/get")
-        print("Orientation service is up...")
-        orientationService = rospy.ServiceProxy("/computation/handover_orientation/get", runOrientationSrv)
+        services.getProxy("/computation/handover_orientation/get", runOrientationSrv)
         print("Connection to orientation service established!")
 
         camClient = CameraClient()
@@ -35,7 +34,8 @@ class OrientationClient(object):
 
         print("Message constructed")
 
-        response = orientationService(pcd_geometry_msg, pcd_color_msg)
+        response = services.call("/computation/handover_orientation/get", runOrientationSrv,
+                                    pcd_geometry_msg, pcd_color_msg)
 
         current_orientation, current_translation, goal_orientation = self.unpackOrientation(response.current, response.goal)
 
@@ -45,13 +45,11 @@ class OrientationClient(object):
 
     def setSettings(self, method):
 
-        if method == 0 or method == 1:
+        if method in [0, 1, 2, 3]:
             self.method = method
 
-            rospy.wait_for_service("/computation/handover_orientation/set_settings")
-            settingsService = rospy.ServiceProxy("/computation/handover_orientation/set_settings", setSettingsOrientationSrv)
-
-            _ = settingsService(Int32(method))
+            _ = services.call("/computation/handover_orientation/set_settings", setSettingsOrientationSrv,
+                                Int32(method))
 
         else:
             print("Invalid method")
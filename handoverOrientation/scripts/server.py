@@ -12,6 +12,11 @@ import time
 import sys, signal
 import cv2
 import scipy.optimize
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 from geometry_msgs.msg import Pose
 from std_msgs.msg import Header, Float32
@@ -20,6 +25,7 @@ from orientation_service.srv import runOrientationSrv, runOrientationSrvResponse
 from orientation_service.srv import setSettingsOrientationSrv, setSettingsOrientationSrvResponse
 
 from rob9Utils.affordancetools import getAffordancePointCloudBasedOnVariance, getPredictedAffordances, getAffordanceColors, getAffordanceContours, getObjectAffordancePointCloud, getAffordanceBoundingBoxes, getPredictedAffordancesInPointCloud
+from rob9Utils.affordancePointCloud import AffordancePointCloud
 from rob9Utils.utils import erodeMask, keepLargestContour, convexHullFromContours, maskFromConvexHull, thresholdMaskBySize, removeOverlapMask
 
 from cameraService.cameraClient import CameraClient
@@ -32,6 +38,287 @@ def signal_handler(signal, frame):
 
 signal.signal(signal.SIGINT, signal_handler)
 
+class RotationObjective(object):
+    """ Sum of nearest neighbour distances between a rotated source and an
+        observation, both centered on 0,0,0. Same value as
+        OrientationServer.objective_function(), but the observation index is
+        built once and rotations are plain matmuls into preallocated buffers,
+        so it can be evaluated for a batch of quaternions in one call.
+    """
+
+    def __init__(self, observation, source = None):
+        """ Input:
+            observation     - np.array(), shape (M, 3)
+            source          - np.array(), shape (N, 3), can be set later with setSource()
+        """
+
+        self.observation_center = np.mean(observation, axis = 0)
+        self.index = NearestNeighbors(n_neighbors = 1, algorithm = 'kd_tree')
+        self.index.fit(observation - self.observation_center)
+
+        self.source = None
+        self.buffer = None
+        self.batch_buffer = None
+        self.evaluations = 0
+
+        if source is not None:
+            self.setSource(source)
+
+    def setSource(self, source):
+        """ Input:
+            source          - np.array(), shape (N, 3)
+        """
+
+        self.source_center = np.mean(source, axis = 0)
+        self.source = np.ascontiguousarray(source - self.source_center)
+        self.buffer = np.empty_like(self.source)
+        self.batch_buffer = None
+
+    def rotate(self, quat):
+        """ Rotates the centered source into self.buffer.
+
+            Input:
+            quat            - np.array(), shape (4), x, y, z, w, need not be normalized
+
+            Output:
+            points          - np.array(), shape (N, 3), view of self.buffer
+        """
+
+        rot_mat = R.from_quat(quat / np.linalg.norm(quat)).as_matrix()
+        np.dot(self.source, rot_mat.T, out = self.buffer)
+        return self.buffer
+
+    def __call__(self, quat):
+        """ Input:
+            quat            - np.array(), shape (4), x, y, z, w
+
+            Output:
+            cost            - float
+        """
+
+        self.evaluations += 1
+        distances, _ = self.index.kneighbors(self.rotate(quat), return_distance = True)
+        return np.sum(distances)
+
+    def evaluateBatch(self, quats):
+        """ Input:
+            quats           - np.array(), shape (K, 4), x, y, z, w
+
+            Output:
+            costs           - np.array(), shape (K)
+        """
+
+        num_quats = quats.shape[0]
+        num_points = self.source.shape[0]
+        if self.batch_buffer is None or self.batch_buffer.shape[0] != num_quats:
+            self.batch_buffer = np.empty((num_quats, num_points, 3))
+
+        quats = quats / np.linalg.norm(quats, axis = 1, keepdims = True)
+        rot_mats = R.from_quat(quats).as_matrix()
+        np.matmul(self.source[np.newaxis], np.transpose(rot_mats, (0, 2, 1)), out = self.batch_buffer)
+
+        self.evaluations += num_quats
+        distances, _ = self.index.kneighbors(self.batch_buffer.reshape(-1, 3), return_distance = True)
+        return np.sum(distances.reshape(num_quats, num_points), axis = 1)
+
+    def score(self, quat, num_points = None):
+        """ Mean distance of the source rotated about its own center to the
+            observation, as scored by methodObservationQuat().
+
+            Input:
+            quat            - np.array(), shape (4), x, y, z, w
+            num_points      - int, the mean is divided by this, the number of
+                              points of the view before it was downsampled,
+                              default the number of source points
+
+            Output:
+            score           - float
+        """
+
+        if num_points is None:
+            num_points = self.source.shape[0]
+
+        points = self.rotate(quat) + (self.source_center - self.observation_center)
+        distances, _ = self.index.kneighbors(points, return_distance = True)
+        return np.mean(distances) / num_points
+
+    def minimizeBatch(self, initial_guess, population = 32, num_elites = 8,
+                        sigma = 0.5, min_sigma = 0.001, max_iterations = 50):
+        """ Cross-entropy style evolution strategy, each generation of
+            quaternions is evaluated with a single evaluateBatch() call.
+
+            Input:
+            initial_guess   - np.array(), shape (4), x, y, z, w
+            population      - int, quaternions per generation
+            num_elites      - int, best quaternions the next mean and spread are fit to
+            sigma           - float, initial standard deviation per component
+            min_sigma       - float, stops once the spread is below
+            max_iterations  - int
+
+            Output:
+            quat            - np.array(), shape (4), normalized
+            cost            - float
+        """
+
+        mean = initial_guess / np.linalg.norm(initial_guess)
+        best_quat, best_cost = mean, self(mean)
+
+        for i in range(max_iterations):
+            samples = mean + sigma * np.random.standard_normal((population, 4))
+            samples[0] = mean
+            samples = samples / np.linalg.norm(samples, axis = 1, keepdims = True)
+
+            # q and -q are the same rotation, keep all samples in the mean's hemisphere
+            samples[np.dot(samples, mean) < 0] *= -1
+
+            costs = self.evaluateBatch(samples)
+            order = np.argsort(costs)
+            if costs[order[0]] < best_cost:
+                best_quat, best_cost = samples[order[0]], costs[order[0]]
+
+            elites = samples[order[:num_elites]]
+            mean = np.mean(elites, axis = 0)
+            mean = mean / np.linalg.norm(mean)
+            sigma = np.mean(np.std(elites, axis = 0))
+
+            if sigma < min_sigma:
+                break
+
+        return best_quat, best_cost
+
+def refineRotation(objective, initial_guess, optimizer):
+    """ Input:
+        objective       - RotationObjective() with source set
+        initial_guess   - np.array(), shape (4), x, y, z, w
+        optimizer       - str, "nelder-mead" or "cross-entropy"
+
+        Output:
+        quat            - np.array(), shape (4), normalized
+    """
+
+    if optimizer == "cross-entropy":
+        quat, _ = objective.minimizeBatch(initial_guess)
+        return quat
+
+    xopt = scipy.optimize.minimize(objective, x0 = initial_guess, method='Nelder-Mead')
+    return xopt.x / np.linalg.norm(xopt.x)
+
+# state of a hypothesis worker process, see initHypothesisWorker()
+_hypothesis_worker = {}
+
+def initHypothesisWorker(stop_event):
+    """ Initializer of the persistent hypothesis pool, the worker attaches to
+        the shared memory of a request with attachHypothesisData().
+
+        Input:
+        stop_event      - multiprocessing.Event(), set once a hypothesis is good enough
+    """
+
+    # forked workers inherit the same random state, reseed from the os
+    np.random.seed()
+
+    _hypothesis_worker["stop_event"] = stop_event
+    _hypothesis_worker["names"] = None
+    _hypothesis_worker["shm"] = []
+
+def attachHypothesisData(target_name, target_shape, views_name, views_shape):
+    """ Attaches the worker to the shared memory blocks holding the observation
+        and the stacked single view point clouds of a request, the blocks of
+        the previous request are closed.
+
+        Input:
+        target_name     - str, name of shared memory block with observation points
+        target_shape    - tuple, shape of observation points
+        views_name      - str, name of shared memory block with all views stacked
+        views_shape     - tuple, shape of the stacked views
+    """
+
+    if _hypothesis_worker["names"] == (target_name, views_name):
+        return
+
+    for key in ["target", "views", "objective"]:
+        _hypothesis_worker.pop(key, None)
+    for shm in _hypothesis_worker["shm"]:
+        try:
+            shm.close()
+        except BufferError: # still referenced, unmapped once collected
+            pass
+
+    target_shm = shared_memory.SharedMemory(name = target_name)
+    views_shm = shared_memory.SharedMemory(name = views_name)
+
+    _hypothesis_worker["names"] = (target_name, views_name)
+    _hypothesis_worker["shm"] = [target_shm, views_shm]
+    _hypothesis_worker["target"] = np.ndarray(target_shape, dtype = np.float64, buffer = target_shm.buf)
+    _hypothesis_worker["views"] = np.ndarray(views_shape, dtype = np.float64, buffer = views_shm.buf)
+    _hypothesis_worker["objective"] = RotationObjective(_hypothesis_worker["target"])
+
+def evaluateHypothesis(shared, index, offset, count, num_points, initial_guess, score_threshold, optimizer):
+    """ Refines the rotation of one single view hypothesis with Nelder-Mead,
+        runs in a worker process initialized with initHypothesisWorker().
+
+        Input:
+        shared          - tuple, arguments of attachHypothesisData()
+        index           - int, index of the hypothesis
+        offset, count   - int, slice of the hypothesis in the stacked views
+        num_points      - int, points of the view before downsampling, see RotationObjective.score()
+        initial_guess   - np.array(), shape (4), quaternion x, y, z, w
+        score_threshold - float, sets the stop event when the score is below
+        optimizer       - str, see refineRotation()
+
+        Output:
+        index           - int, index of the hypothesis
+        quat            - np.array(), shape (4), or None if skipped
+        score           - float, or None if skipped
+    """
+
+    stop_event = _hypothesis_worker["stop_event"]
+    if stop_event.is_set():
+        return index, None, None
+
+    attachHypothesisData(*shared)
+
+    objective = _hypothesis_worker["objective"]
+    objective.setSource(_hypothesis_worker["views"][offset:offset + count])
+
+    quat = refineRotation(objective, initial_guess, optimizer)
+    score = objective.score(quat, num_points)
+
+    if score < score_threshold:
+        stop_event.set()
+
+    return index, quat, score
+
+def collectHypothesisResults(futures, stop_event):
+    """ Waits for the evaluateHypothesis() futures, once stop_event is set the
+        pending futures are cancelled and skipped.
+
+        Input:
+        futures         - list[concurrent.futures.Future], of evaluateHypothesis()
+        stop_event      - multiprocessing.Event(), see initHypothesisWorker()
+
+        Output:
+        results         - list[(score, index, quat)], the evaluated hypotheses
+    """
+
+    results = []
+    stopped = False
+    for future in as_completed(futures):
+        if future.cancelled():
+            continue
+
+        index, quat, score = future.result()
+        if score is not None:
+            results.append((score, index, quat))
+
+        if stop_event.is_set() and not stopped:
+            print("Best score below threshold")
+            stopped = True
+            for f in futures:
+                f.cancel()
+
+    return results
+
 class OrientationServer(object):
     """docstring for OrientationServer."""
 
@@ -51,17 +338,10 @@ class OrientationServer(object):
 
         self.intrinsics = o3d.camera.PinholeCameraIntrinsic(self.renderer_width, self.renderer_height,
                             self.renderer_fx, self.renderer_fy, self.renderer_cx, self.renderer_cy)
-        self.extrinsics = np.eye(4)
-        self.extrinsics[3,3] = 1.5
 
-        self.renderer = o3d.visualization.rendering.OffscreenRenderer(self.renderer_width,
-                        self.renderer_height)
-        self.renderer.scene.set_background(np.array([0,0,0,0]))
-        self.renderer.setup_camera(self.intrinsics, self.extrinsics)
-
-        self.material = o3d.visualization.rendering.MaterialRecord()
-        self.material.shader = 'defaultUnlit'
-        self.material.point_size = 15
+        # single view synthesis, see renderSingleView()
+        self.render_point_size = 15 # pixels covered by each point
+        self.render_depth_tolerance = 0.005 # m
 
         self.rate = rospy.Rate(5)
 
@@ -89,11 +369,41 @@ class OrientationServer(object):
 
         self.nn_classifier = self.createNNClassifier()
 
+        # binary cache of the canonical models, see getCanonicalModel()
+        self.cache_dir = os.path.join(root_dir, "cache")
+        self.canonical_voxel_sizes = [0.01, 0.02, 0.04] # in model units
+        self.canonical_models = {}
+        self.canonical_lock = threading.Lock()
+        for prediction, path in enumerate(self.pcd_paths):
+            if os.path.exists(path):
+                self.getCanonicalModel(prediction)
+
+        # KD-tree over the current ICP target, see getTargetIndex()
+        self.target_index = None
+        self.target_index_key = None
+        self.target_index_lock = threading.Lock()
+
         self.method = 0 # observation based
 
+        # budget of the batched rotation search, see methodObservationBatched()
+        self.search_num_candidates = 4096
+        self.search_num_points = 200
+        self.search_top_k = 5
+        self.search_time_budget = 1.0 # s
+
+        # per view hypotheses of methodObservationQuat(), 1 worker runs them
+        # serially, more workers share one persistent process pool
+        self.hypothesis_workers = rospy.get_param("~hypothesis_workers", 1)
+        self.hypothesis_pool = None
+        self.hypothesis_stop_event = None
+        self.hypothesis_pool_lock = threading.Lock()
+        rospy.on_shutdown(self.shutdownHypothesisPool)
+        self.hypothesis_score_threshold = 0.02
+        self.hypothesis_optimizer = rospy.get_param("~hypothesis_optimizer", "nelder-mead") # or "cross-entropy", see refineRotation()
+
     def setSettings(self, msg):
 
-        int_to_method = {0: "observation-based", 1: "rule-based"}
+        int_to_method = {0: "observation-based", 1: "rule-based", 2: "observation-based batched", 3: "observation-based quaternion"}
 
         self.method = msg.method.data
 
@@ -178,8 +488,8 @@ class OrientationServer(object):
         return pcd, np.identity(3)
 
     def preparePointCloudForRenderer(self, pcd):
-        """ Scales and translates the input point cloud to a size that fits with
-            the open3d offscreen renderer, also normalizes colors.
+        """ Scales and translates the input point cloud to a size that fits in
+            the view of the virtual camera, also normalizes colors.
 
             Input:
             pcd             - o3d.geometry.PointCloud()
@@ -201,6 +511,48 @@ class OrientationServer(object):
 
         return pcd
 
+    def renderSingleView(self, pcd):
+        """ Synthesizes the single view point cloud seen by the virtual camera
+            described by self.intrinsics without a renderer. Points are
+            projected with the pinhole model and a z-buffer keeps the points
+            closest to the camera, each point covers a square of
+            self.render_point_size pixels like the splats of the old renderer.
+
+            Input:
+            pcd             - o3d.geometry.PointCloud(), prepared with
+                              preparePointCloudForRenderer()
+
+            Output:
+            pcd             - o3d.geometry.PointCloud(), visible points only
+        """
+
+        points = np.asanyarray(pcd.points)
+        colors = np.asanyarray(pcd.colors)
+
+        in_front = points[:, 2] > 0
+        points, colors = points[in_front], colors[in_front]
+
+        u = (self.renderer_fx * points[:, 0] / points[:, 2]) + self.renderer_cx
+        v = (self.renderer_fy * points[:, 1] / points[:, 2]) + self.renderer_cy
+
+        in_view = (u >= 0) & (u < self.renderer_width) & (v >= 0) & (v < self.renderer_height)
+        points, colors = points[in_view], colors[in_view]
+        u, v = u[in_view], v[in_view]
+
+        cells_w = int(math.ceil(self.renderer_width / self.render_point_size))
+        cells_h = int(math.ceil(self.renderer_height / self.render_point_size))
+        cell = ((v / self.render_point_size).astype(int) * cells_w) + (u / self.render_point_size).astype(int)
+
+        z_buffer = np.full(cells_w * cells_h, np.inf)
+        np.minimum.at(z_buffer, cell, points[:, 2])
+        visible = points[:, 2] <= z_buffer[cell] + self.render_depth_tolerance
+
+        pcd_single_view = o3d.geometry.PointCloud()
+        pcd_single_view.points = o3d.utility.Vector3dVector(points[visible])
+        pcd_single_view.colors = o3d.utility.Vector3dVector(colors[visible])
+
+        return pcd_single_view
+
     def postProcessSingleViewPointCloud(self, pcd):
         """ Post processing by changing color values and cropping away background
 
@@ -258,7 +610,6 @@ class OrientationServer(object):
 
     def findBestTransform(self, target_pcd, source_pcd, x_range = 5,
                         y_range = 5, z_range = 5):
-        global depth_image, rgb_image, capture
         """ Samples source_pcd from single view with different rotations applied and
             finds the best transform to target_pcd using affordance ICP
 
@@ -278,10 +629,10 @@ class OrientationServer(object):
 
         target_pcd.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=0.2, max_nn=30))
         target_pcd.normalize_normals()
+        target_affordances, _ = getPredictedAffordancesInPointCloud(target_pcd)
 
         #source_pcd_downscaled = self.preparePointCloudForRenderer(source_pcd)
 
-        depth_image, rgb_image = None, None
         for x in range(x_range):
             for y in range(y_range):
                 for z in range(z_range):
@@ -294,23 +645,7 @@ class OrientationServer(object):
                     pcd_rotated = o3d.geometry.PointCloud(source_pcd)
                     pcd_rotated.rotate(rot_mat)
 
-                    self.renderer.scene.clear_geometry()
-                    self.renderer.scene.add_geometry("pcd", pcd_rotated, self.material)
-
-                    capture = True
-                    waiting = True
-                    while waiting:
-                        if capture:
-                            time.sleep(0.1)
-                        else:
-                            waiting = False
-
-                    rgbd = o3d.geometry.RGBDImage.create_from_color_and_depth(rgb_image, depth_image,
-                                                                            depth_scale = 1,
-                                                                            convert_rgb_to_intensity = False)
-                    #depth_image, rgb_image = None, None
-                    pcd_single_view = o3d.geometry.PointCloud.create_from_rgbd_image(rgbd, self.intrinsics,
-                                                                                    project_valid_depth_only = True)
+                    pcd_single_view = self.renderSingleView(pcd_rotated)
                     pcd_single_view = self.postProcessSingleViewPointCloud(pcd_single_view)
                     pcd_single_view = self.scalePcdToTargetPcd(pcd_single_view, target_pcd)
 
@@ -348,7 +683,6 @@ class OrientationServer(object):
 
                     source_affordances, _ = getPredictedAffordancesInPointCloud(pcd_single_view)
                     source_affordances[0] = 0
-                    target_affordances, _ = getPredictedAffordancesInPointCloud(target_pcd)
 
                     if np.array_equal(source_affordances, target_affordances):
 
@@ -439,20 +773,13 @@ class OrientationServer(object):
 
         feature_vector = self.computeFeatureVector(pcd_affordance)
         dist, predictions = self.nn_classifier.kneighbors(feature_vector, n_neighbors = 1)
-        source_pcd = self.getSourcePointCloud(prediction = predictions[0][0])
+        model = self.getCanonicalModel(prediction = predictions[0][0])
 
         target_bounds = pcd_affordance.get_max_bound() - pcd_affordance.get_min_bound()
-        source_bounds = source_pcd.get_max_bound() - source_pcd.get_min_bound()
-        scale = np.max(target_bounds) / np.max(source_bounds)
-
-        source_pcd_points = np.asarray(source_pcd.points)
-        source_pcd_points = source_pcd_points * scale
-        source_pcd.points = o3d.utility.Vector3dVector(source_pcd_points)
+        scale = np.max(target_bounds) / np.max(model["bounds"])
 
-        T, distances, iterations = self.icp(source_points = np.asanyarray(source_pcd.points),
-                                        source_colors = np.asanyarray(source_pcd.colors),
-                                        target_points = np.asanyarray(pcd_affordance.points),
-                                        target_colors = np.asanyarray(pcd_affordance.colors),
+        T, distances, iterations = self.icpToModel(prediction = predictions[0][0],
+                                        scale = scale, pcd_affordance = pcd_affordance,
                                         tolerance=0.00001)
 
 
@@ -521,7 +848,8 @@ class OrientationServer(object):
         return np.sum(distances)
 
 
-    def objective_function(self, solution, observation, source):
+    @staticmethod
+    def objective_function(solution, observation, source):
         #_, cols = observation.shape
         #distances = np.zeros(cols)
         # center on 0,0,0
@@ -560,7 +888,9 @@ class OrientationServer(object):
         return rotated_pc
 
     def methodObservationQuat(self, pcd_affordance):
-        global depth_image, rgb_image, capture
+        if self.hypothesis_workers > 1:
+            return self.methodObservationQuatParallel(pcd_affordance)
+
         feature_vector = self.computeFeatureVector(pcd_affordance)
         dist, predictions = self.nn_classifier.kneighbors(feature_vector, n_neighbors = 1)
         source_pcd = self.getSourcePointCloud(prediction = predictions[0][0])
@@ -604,12 +934,13 @@ class OrientationServer(object):
         best_score = 10000000000000
         transformation = np.eye(4)
         source_pcd = self.preparePointCloudForRenderer(source_pcd)
+        objective = RotationObjective(np.asanyarray(pcd_affordance.points))
+        target_affordances, _ = getPredictedAffordancesInPointCloud(pcd_affordance)
 
         x_range = 5
         y_range = 5
         z_range = 5
 
-        depth_image, rgb_image = None, None
         count = 1
         for x in range(x_range):
             for y in range(y_range):
@@ -623,23 +954,7 @@ class OrientationServer(object):
                     pcd_rotated = o3d.geometry.PointCloud(source_pcd)
                     pcd_rotated.rotate(rot_mat)
 
-                    self.renderer.scene.clear_geometry()
-                    self.renderer.scene.add_geometry("pcd", pcd_rotated, self.material)
-
-                    capture = True
-                    waiting = True
-                    while waiting:
-                        if capture:
-                            time.sleep(0.1)
-                        else:
-                            waiting = False
-
-                    rgbd = o3d.geometry.RGBDImage.create_from_color_and_depth(rgb_image, depth_image,
-                                                                            depth_scale = 1,
-                                                                            convert_rgb_to_intensity = False)
-                    #depth_image, rgb_image = None, None
-                    pcd_single_view = o3d.geometry.PointCloud.create_from_rgbd_image(rgbd, self.intrinsics,
-                                                                                    project_valid_depth_only = True)
+                    pcd_single_view = self.renderSingleView(pcd_rotated)
                     pcd_single_view = self.postProcessSingleViewPointCloud(pcd_single_view)
                     pcd_single_view = self.scalePcdToTargetPcd(pcd_single_view, pcd_affordance)
 
@@ -650,7 +965,6 @@ class OrientationServer(object):
 
                     source_affordances, _ = getPredictedAffordancesInPointCloud(pcd_single_view)
                     source_affordances[0] = 0
-                    target_affordances, _ = getPredictedAffordancesInPointCloud(pcd_affordance)
 
                     source_points = np.asanyarray(pcd_single_view.points)
                     source_colors = np.asanyarray(pcd_single_view.colors)
@@ -668,25 +982,11 @@ class OrientationServer(object):
                         #source_aff = np.hstack((source_points, np.asanyarray(pcd_single_view.colors)))
 
                         #xopt = scipy.optimize.minimize(self.objective_function_with_affordances, x0 = initial_guess, method='Nelder-Mead', args=(target_points, target_colors, source_points, source_colors))
-                        xopt = scipy.optimize.minimize(self.objective_function, x0 = initial_guess, method='Nelder-Mead', args=(target_points, source_points))
-
-                        solution_mag = np.linalg.norm(xopt.x)
-                        solution = xopt.x/solution_mag
-                        quat = solution
+                        objective.setSource(source_points)
+                        quat = refineRotation(objective, initial_guess, self.hypothesis_optimizer)
 
                         rot_mat_sol = R.from_quat(quat).as_matrix()
-
-                        pcd_score = o3d.geometry.PointCloud()
-                        pcd_score.points = o3d.utility.Vector3dVector(source_points)
-                        pcd_score.rotate(rot_mat_sol)
-
-                        pcd_score_points = np.asanyarray(pcd_score.points)
-
-                        neigh = NearestNeighbors(n_neighbors=1)
-                        neigh.fit(target_points)
-                        distances, indices = neigh.kneighbors(pcd_score_points, return_distance=True)
-
-                        score = np.mean(distances) / num_source_points
+                        score = objective.score(quat, num_source_points)
 
                         centroid = pcd_affordance.get_center()
                         T = np.eye(4)
@@ -713,7 +1013,7 @@ class OrientationServer(object):
 
                         o3d.visualization.draw_geometries([pcd_affordance, pcd_single_view])
 
-                    if best_score < 0.02:
+                    if best_score < self.hypothesis_score_threshold:
                         print("Best score below threshold")
                         x = x_range
                         y = y_range
@@ -728,6 +1028,285 @@ class OrientationServer(object):
         o3d.visualization.draw_geometries([pcd_affordance, source_pcd.transform(best_T)])
         return best_T, self.getGoalOrientation(predictions[0][0])
 
+    def methodObservationQuatParallel(self, pcd_affordance):
+        """ Same hypotheses as methodObservationQuat(), but the Nelder-Mead
+            refinement of each view is spread over a process pool. The single
+            views are rendered up front and shared with the workers through
+            shared memory, all workers stop once a hypothesis scores below
+            self.hypothesis_score_threshold.
+
+            Input:
+            pcd_affordance  - o3d.geometry.PointCloud(), observed object
+
+            Output:
+            best_T          - np.array(), shape (4, 4)
+            goal            - see getGoalOrientation()
+        """
+
+        feature_vector = self.computeFeatureVector(pcd_affordance)
+        dist, predictions = self.nn_classifier.kneighbors(feature_vector, n_neighbors = 1)
+        source_pcd = self.getSourcePointCloud(prediction = predictions[0][0])
+
+        ts = time.time()
+
+        source_pcd = self.preparePointCloudForRenderer(source_pcd)
+        target_points = np.ascontiguousarray(np.asanyarray(pcd_affordance.points), dtype = np.float64)
+        target_affordances, _ = getPredictedAffordancesInPointCloud(pcd_affordance)
+
+        x_range = 5
+        y_range = 5
+        z_range = 5
+
+        # render every view and keep the ones showing the observed affordances
+        rot_mats, views, view_sizes = [], [], []
+        for x in range(x_range):
+            for y in range(y_range):
+                for z in range(z_range):
+
+                    xr = (2*math.pi / x_range) * x
+                    yr = (2*math.pi / y_range) * y
+                    zr = (2*math.pi / z_range) * z
+
+                    rot_mat = R.from_euler("xyz", [xr, yr, zr]).as_matrix()
+                    pcd_rotated = o3d.geometry.PointCloud(source_pcd)
+                    pcd_rotated.rotate(rot_mat)
+
+                    pcd_single_view = self.renderSingleView(pcd_rotated)
+                    pcd_single_view = self.postProcessSingleViewPointCloud(pcd_single_view)
+                    pcd_single_view = self.scalePcdToTargetPcd(pcd_single_view, pcd_affordance)
+
+                    num_source_points = np.asanyarray(pcd_single_view.points).shape[0]
+                    pcd_single_view = pcd_single_view.random_down_sample(target_points.shape[0] / num_source_points)
+
+                    source_affordances, _ = getPredictedAffordancesInPointCloud(pcd_single_view)
+                    source_affordances[0] = 0
+
+                    if np.array_equal(source_affordances, target_affordances):
+                        rot_mats.append(rot_mat)
+                        views.append(np.asanyarray(pcd_single_view.points))
+                        view_sizes.append(num_source_points)
+
+        print("Evaluating ", len(views), " / ", x_range*y_range*z_range, " hypotheses on ", self.hypothesis_workers, " workers")
+
+        best_T = np.eye(4)
+        if len(views) == 0:
+            return best_T, self.getGoalOrientation(predictions[0][0])
+
+        counts = np.array([view.shape[0] for view in views])
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        views = np.vstack(views)
+
+        target_shm = shared_memory.SharedMemory(create = True, size = target_points.nbytes)
+        views_shm = shared_memory.SharedMemory(create = True, size = views.nbytes)
+        np.ndarray(target_points.shape, dtype = np.float64, buffer = target_shm.buf)[:] = target_points
+        np.ndarray(views.shape, dtype = np.float64, buffer = views_shm.buf)[:] = views
+
+        shared = (target_shm.name, target_points.shape, views_shm.name, views.shape)
+
+        try:
+            # one request at a time uses the pool and its stop event
+            with self.hypothesis_pool_lock:
+                executor, stop_event = self.getHypothesisPool()
+                stop_event.clear()
+
+                try:
+                    futures = [executor.submit(evaluateHypothesis, shared, i, offsets[i], counts[i], view_sizes[i],
+                                                self.get_random_quaternion(), self.hypothesis_score_threshold,
+                                                self.hypothesis_optimizer)
+                                for i in range(len(rot_mats))]
+
+                    results = collectHypothesisResults(futures, stop_event)
+                except BrokenProcessPool:
+                    self.shutdownHypothesisPool()
+                    raise
+        finally:
+            target_shm.close()
+            target_shm.unlink()
+            views_shm.close()
+            views_shm.unlink()
+
+        best_score, index, quat = min(results, key = lambda result: result[0])
+        print("Best score: ", best_score)
+
+        # same transformation as the serial loop, the refinement rotates the
+        # view about its own center which is then moved to the observation
+        view = views[offsets[index]:offsets[index] + counts[index]]
+        rot_mat_sol = R.from_quat(quat).as_matrix()
+        best_T[:3, :3] = np.matmul(rot_mat_sol, rot_mats[index])
+        best_T[:3, 3] = np.dot(rot_mat_sol, np.mean(view, axis = 0)) + pcd_affordance.get_center()
+
+        te = time.time()
+        print("Found transformation in: ", te -ts, " s")
+
+        return best_T, self.getGoalOrientation(predictions[0][0])
+
+    def getHypothesisPool(self):
+        """ Creates the process pool of methodObservationQuatParallel() on first
+            use and keeps it for the following requests. Workers are started
+            by a forkserver, so they do not inherit the sockets and locks of the
+            threads of this node.
+
+            Output:
+            executor        - concurrent.futures.ProcessPoolExecutor()
+            stop_event      - multiprocessing.Event(), shared with the workers
+        """
+
+        if self.hypothesis_pool is None:
+            context = multiprocessing.get_context("forkserver")
+            self.hypothesis_stop_event = context.Event()
+            self.hypothesis_pool = ProcessPoolExecutor(max_workers = self.hypothesis_workers, mp_context = context,
+                                                        initializer = initHypothesisWorker,
+                                                        initargs = (self.hypothesis_stop_event,))
+
+        return self.hypothesis_pool, self.hypothesis_stop_event
+
+    def shutdownHypothesisPool(self):
+
+        if self.hypothesis_pool is not None:
+            self.hypothesis_pool.shutdown(wait = False)
+            self.hypothesis_pool = None
+            self.hypothesis_stop_event = None
+
+    def sampleRotations(self, num_samples):
+        """ Samples rotations uniformly from SO(3) using a super-Fibonacci
+            spiral, https://arxiv.org/abs/2112.07675
+
+            Input:
+            num_samples     - int, number of rotations
+
+            Output:
+            rotations       - np.array(), shape (num_samples, 3, 3)
+        """
+
+        phi = math.sqrt(2.0)
+        psi = 1.533751168755204288118041
+
+        s = np.arange(num_samples) + 0.5
+        r = np.sqrt(s / num_samples)
+        r_c = np.sqrt(1.0 - (s / num_samples))
+        alpha = 2.0 * math.pi * s / phi
+        beta = 2.0 * math.pi * s / psi
+
+        quats = np.stack((r * np.sin(alpha), r * np.cos(alpha),
+                        r_c * np.sin(beta), r_c * np.cos(beta)), axis = 1)
+
+        return R.from_quat(quats).as_matrix()
+
+    def scoreRotations(self, rotations, target_points, target_colors, source_index):
+        """ Scores all candidate rotations of the source against the target in
+            one batched query. Distances are rotation invariant, so instead of
+            rotating the source K times the target is rotated by the inverse
+            rotation and queried against a single KD-tree over the source.
+
+            Input:
+            rotations       - np.array(), shape (K, 3, 3)
+            target_points   - np.array(), shape (N, 3), centered on 0, 0, 0
+            target_colors   - np.array(), shape (N, 3)
+            source_index    - sklearn.neighbors.NearestNeighbors fitted on the
+                              centered source points and colors
+
+            Output:
+            scores          - np.array(), shape (K), mean nearest neighbour
+                              distance, lower is better
+        """
+
+        num_rotations, num_points = rotations.shape[0], target_points.shape[0]
+
+        query = np.empty((num_rotations, num_points, 6))
+        query[:, :, :3] = np.einsum('kji,nj->kni', rotations, target_points)
+        query[:, :, 3:] = target_colors
+
+        distances, _ = source_index.kneighbors(query.reshape(-1, 6), return_distance = True)
+
+        return distances.reshape(num_rotations, num_points).mean(axis = 1)
+
+    def methodObservationBatched(self, pcd_affordance):
+        """ Same as methodObservation but the initial orientation is found by
+            scoring a uniform grid of SO(3) rotations in batches, only the
+            self.search_top_k best candidates are refined with ICP.
+
+            Input:
+            pcd_affordance  - o3d.geometry.PointCloud(), point cloud of object
+                              where each point's color is their respective
+                              affordance
+            Output:
+            T               - np.array(), shape (4,4) homogeneous transformation
+                              matrix describing current pose of object
+            G               - goal orientation
+        """
+
+        ts = time.time()
+
+        feature_vector = self.computeFeatureVector(pcd_affordance)
+        dist, predictions = self.nn_classifier.kneighbors(feature_vector, n_neighbors = 1)
+        source_pcd = self.getSourcePointCloud(prediction = predictions[0][0])
+        source_pcd = self.scalePcdToTargetPcd(source_pcd, pcd_affordance)
+
+        source_points = np.asanyarray(source_pcd.points)
+        source_colors = np.asanyarray(source_pcd.colors)
+        target_points = np.asanyarray(pcd_affordance.points)
+        target_colors = np.asanyarray(pcd_affordance.colors)
+
+        if np.max(source_colors) > 1:
+            source_colors = source_colors / 255
+        if np.max(target_colors) > 1:
+            target_colors = target_colors / 255
+
+        source_centroid = np.mean(source_points, axis = 0)
+        target_centroid = np.mean(target_points, axis = 0)
+
+        source_index = NearestNeighbors(n_neighbors = 1, algorithm = 'kd_tree')
+        source_index.fit(np.hstack((source_points - source_centroid, source_colors)))
+
+        num_points = min(self.search_num_points, target_points.shape[0])
+        idx = np.random.choice(target_points.shape[0], num_points, replace = False)
+        query_points = target_points[idx] - target_centroid
+        query_colors = target_colors[idx]
+
+        # visit the grid in a random order so a truncated search still covers SO(3)
+        rotations = self.sampleRotations(self.search_num_candidates)
+        rotations = rotations[np.random.permutation(rotations.shape[0])]
+
+        scores = np.full(rotations.shape[0], np.inf)
+        batch_size = 256
+        for start in range(0, rotations.shape[0], batch_size):
+            end = min(start + batch_size, rotations.shape[0])
+            scores[start:end] = self.scoreRotations(rotations[start:end],
+                                                query_points, query_colors,
+                                                source_index)
+            if time.time() - ts > self.search_time_budget:
+                print("Rotation search budget exceeded after ", end, " candidates")
+                break
+
+        top_k = np.argsort(scores)[:self.search_top_k]
+        top_k = top_k[np.isfinite(scores[top_k])]
+
+        best_T = np.eye(4)
+        best_score = np.inf
+        for k in top_k:
+
+            # rotation maps the source on to the target, centroid to centroid
+            init_pose = np.eye(4)
+            init_pose[:3, :3] = rotations[k]
+            init_pose[:3, 3] = target_centroid - np.dot(rotations[k], source_centroid)
+
+            T, distances, iterations = self.icp(source_points = source_points,
+                                            source_colors = source_colors,
+                                            target_points = target_points,
+                                            target_colors = target_colors,
+                                            init_pose = init_pose,
+                                            tolerance=0.00001)
+
+            score = np.mean(distances)
+            if score < best_score:
+                best_score = score
+                best_T = T
+
+        te = time.time()
+        print("Found transformation in: ", te -ts, " s, score: ", best_score)
+
+        return best_T, self.getGoalOrientation(predictions[0][0])
+
     def run(self, msg):
 
         print("received request...")
@@ -747,6 +1326,10 @@ class OrientationServer(object):
             #T, G = self.methodObservationQuat(pcd_affordance)
         elif self.method == 1:
             T, G = self.methodRule(pcd_affordance)
+        elif self.method == 2:
+            T, G = self.methodObservationBatched(pcd_affordance)
+        elif self.method == 3:
+            T, G = self.methodObservationQuat(pcd_affordance)
 
         np.set_printoptions(suppress=True)
         print(T)
@@ -778,12 +1361,140 @@ class OrientationServer(object):
 
         return nn_classifier
 
-    def getSourcePointCloud(self, prediction):
+    def getSourcePointCloud(self, prediction, voxel_size = None):
+        """ Input:
+            prediction      - int, index of the canonical model
+            voxel_size      - float, one of self.canonical_voxel_sizes, if None
+                              the full resolution model is returned
+
+            Output:
+            pcd             - o3d.geometry.PointCloud(), a copy of the model
+        """
+
+        model = self.getCanonicalModel(prediction)
+
+        idx = np.arange(model["points"].shape[0])
+        if voxel_size is not None:
+            idx = model["levels"][voxel_size]
+
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(model["points"][idx])
+        pcd.colors = o3d.utility.Vector3dVector(model["colors"][idx])
+        pcd.normals = o3d.utility.Vector3dVector(model["normals"][idx])
+
+        return pcd
+
+    def getCanonicalModel(self, prediction):
+        """ Returns the canonical model of an object class. Models are kept in
+            memory once loaded, on disk they are cached as .npz next to the
+            xyzrgb text files, the cache is (re)built the first time a model is
+            requested or when the text file is newer than the cache.
+
+            Input:
+            prediction      - int, index of the canonical model
+
+            Output:
+            model           - dict with
+                              points, colors, normals - np.array(), shape (N, 3)
+                              bounds                  - np.array(), shape (3)
+                              levels                  - dict {voxel_size: np.array() indices}
+                              affordance_counts       - np.array(), int, shape (A)
+                              affordance_centroids    - np.array(), shape (A, 3), nan
+                                                        for absent affordances
+        """
+
+        if prediction in self.canonical_models:
+            return self.canonical_models[prediction]
 
         path = self.pcd_paths[prediction]
+        name = os.path.splitext(os.path.basename(path))[0]
+        cache_path = os.path.join(self.cache_dir, name + ".npz")
+
+        cache_valid = False
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            with np.load(cache_path) as data:
+                cache_valid = np.array_equal(data["voxel_sizes"], self.canonical_voxel_sizes)
+                cache_valid = cache_valid and "affordance_centroids" in data.files
+
+        if not cache_valid:
+            print("Building canonical model cache for ", name)
+            self.buildCanonicalModelCache(path, cache_path)
+
+        model = {}
+        with np.load(cache_path) as data:
+            model["points"] = data["points"]
+            model["colors"] = data["colors"]
+            model["normals"] = data["normals"]
+            model["bounds"] = data["bounds"]
+            model["affordance_counts"] = data["affordance_counts"]
+            model["affordance_centroids"] = data["affordance_centroids"]
+            model["levels"] = {}
+            for level, voxel_size in enumerate(self.canonical_voxel_sizes):
+                model["levels"][voxel_size] = data["level_" + str(level)]
+
+        self.canonical_models[prediction] = model
+        return model
+
+    def getCanonicalModelIndex(self, prediction):
+        """ Returns the canonical model as an AffordancePointCloud, built the
+            first time it is requested. Its per affordance KD-trees are built
+            on first use as well and are kept with the model.
+
+            Input:
+            prediction      - int, index of the canonical model
+
+            Output:
+            cloud           - AffordancePointCloud(), labels of getAffordanceColors()
+        """
+
+        model = self.getCanonicalModel(prediction)
+
+        with self.canonical_lock:
+            if "affordance_cloud" not in model:
+                model["affordance_cloud"] = AffordancePointCloud(model["points"], model["colors"],
+                                                                getAffordanceColors())
+            return model["affordance_cloud"]
+
+    def buildCanonicalModelCache(self, path, cache_path):
+        """ Parses an xyzrgb canonical model and writes it as a binary .npz with
+            normals, voxel downsampled levels and per affordance centroids.
+
+            Input:
+            path            - str, path to xyzrgb text file
+            cache_path      - str, path to the .npz file to write
+        """
+
         pcd = o3d.io.read_point_cloud(path, format='xyzrgb')
+        pcd.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=0.05, max_nn=30))
+        pcd.normalize_normals()
 
-        return pcd
+        points = np.asanyarray(pcd.points)
+        colors = np.asanyarray(pcd.colors)
+        normals = np.asanyarray(pcd.normals)
+
+        data = {}
+        data["points"] = points
+        data["colors"] = colors
+        data["normals"] = normals
+        data["bounds"] = np.max(points, axis = 0) - np.min(points, axis = 0)
+        data["voxel_sizes"] = np.array(self.canonical_voxel_sizes)
+
+        # keep one original point per voxel so affordance colors are not blended
+        for level, voxel_size in enumerate(self.canonical_voxel_sizes):
+            voxels = np.floor((points - np.min(points, axis = 0)) / voxel_size).astype(np.int64)
+            _, idx = np.unique(voxels, axis = 0, return_index = True)
+            data["level_" + str(level)] = np.sort(idx)
+
+        # per affordance label of getAffordanceColors(), nan for absent labels
+        cloud = AffordancePointCloud(points, colors, getAffordanceColors())
+        centroids = np.full((cloud.num_labels, 3), np.nan)
+        for label in cloud.getPresentLabels():
+            centroids[label] = cloud.getCentroid(label)
+        data["affordance_counts"] = cloud.getCounts()
+        data["affordance_centroids"] = centroids
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok = True)
+        np.savez(cache_path, **data)
 
     def getGoalOrientation(self, prediction):
 
@@ -794,25 +1505,12 @@ class OrientationServer(object):
 
     def computeFeatureVector(self, pcd):
 
-        label_colors = {(0, 0, 255): 1, # grasp
-        (0, 255, 0): 2, # cut
-        (123, 255, 123): 3, # scoop
-        (255, 0, 0): 4, # contain
-        (255, 255, 0): 5, # pound
-        (255, 255, 255): 6, # support
-        (255, 0, 255): 7} # wrap-grasp
+        # bg, grasp, cut, scoop, contain, pound, support, w-grasp share their
+        # label with getAffordanceColors()
+        cloud = AffordancePointCloud.fromPointCloud(pcd, getAffordanceColors())
 
         feature_vector = np.zeros((1,8))
-
-        pcd_colors = np.asanyarray(pcd.colors).astype(np.uint8)
-        if np.max(pcd_colors) <= 1:
-            pcd_colors = pcd_colors * 255
-
-        for label_color in label_colors:
-            idx = pcd_colors == label_color
-            idx = np.sum(idx, axis = -1) == 3
-            if True in idx:
-                feature_vector[0, label_colors[label_color]] = 1
+        feature_vector[0, 1:] = cloud.getCounts()[1:8] > 0
 
         return feature_vector
 
@@ -862,25 +1560,107 @@ class OrientationServer(object):
         return T, R, t
 
 
-    def nearest_neighbor(self, src, dst):
-        '''
-        https://github.com/ClayFlannigan/icp
-        Find the nearest (Euclidean) neighbor in dst for each point in src
-        Input:
-            src: Nxm array of points
-            dst: Nxm array of points
-        Output:
-            distances: Euclidean distances of the nearest neighbor
-            indices: dst indices of the nearest neighbor
-        '''
+    def icpToModel(self, prediction, scale, pcd_affordance, max_iterations=100, tolerance=0.0001):
+        """ ICP of the observation onto the canonical model. Every observed
+            point is matched to the nearest model point of the same affordance
+            with the cached per affordance KD-trees of the model, so no index is
+            built per request. The observation is scaled into model units
+            instead of scaling the model, same affordance nearest neighbours do
+            not depend on the scale. The start pose moves the observed
+            affordance centroids onto the cached model centroids.
 
-        assert src.shape == dst.shape
+            Input:
+            prediction      - int, index of the canonical model
+            scale           - float, observation size / model size
+            pcd_affordance  - o3d.geometry.PointCloud(), observation with
+                              affordance colors
+
+            Output:
+            T               - np.array(), shape (4, 4), maps the model scaled by
+                              scale onto the observation
+            distances       - np.array(), nearest neighbour distances of the
+                              observation points, in observation units
+            i               - int, number of iterations
+        """
+
+        model = self.getCanonicalModel(prediction)
+        model_cloud = self.getCanonicalModelIndex(prediction)
+        target = AffordancePointCloud.fromPointCloud(pcd_affordance, getAffordanceColors())
+
+        labels = [label for label in target.getPresentLabels() if model_cloud.getCount(label) > 0]
+        if len(labels) == 0:
+            # no affordance in common, plain icp in the joint xyz + colour space
+            return self.icp(source_points = model["points"] * scale, source_colors = model["colors"],
+                            target_points = np.asanyarray(pcd_affordance.points),
+                            target_colors = np.asanyarray(pcd_affordance.colors),
+                            max_iterations = max_iterations, tolerance = tolerance)
+
+        # observed points of the shared affordances in model units, one slice per label
+        A = np.vstack([target.getPoints(label) for label in labels]) / scale
+        offsets = np.cumsum([0] + [target.getCount(label) for label in labels])
+        indices = [model_cloud.getIndex(label) for label in labels]
+
+        observed_centroids = np.array([target.getCentroid(label) for label in labels]) / scale
+        model_centroids = model["affordance_centroids"][labels]
+        src = A + (np.mean(model_centroids, axis = 0) - np.mean(observed_centroids, axis = 0))
+
+        dst = np.zeros(A.shape)
+        distances = np.zeros(A.shape[0])
+        prev_error = 0
 
-        neigh = NearestNeighbors(n_neighbors=1)
-        neigh.fit(dst)
-        distances, indices = neigh.kneighbors(src, return_distance=True)
-        return distances.ravel(), indices.ravel()
+        for i in range(max_iterations):
+            for n, label in enumerate(labels):
+                part = slice(offsets[n], offsets[n + 1])
+                label_distances, label_indices = indices[n].kneighbors(src[part], return_distance=True)
+                distances[part] = label_distances.ravel()
+                dst[part] = model_cloud.getPoints(label)[label_indices.ravel()]
 
+            T,_,_ = self.best_fit_transform(src, dst)
+            src = np.dot(src, T[:3, :3].T) + T[:3, 3]
+
+            mean_error = np.mean(distances) * scale # tolerance is in observation units
+            if np.abs(prev_error - mean_error) < tolerance:
+                break
+            prev_error = mean_error
+
+        # observation (model units) -> model, inverted and scaled back
+        T,_,_ = self.best_fit_transform(A, src)
+        T_model = np.identity(4)
+        T_model[:3, :3] = T[:3, :3].T
+        T_model[:3, 3] = -scale * np.dot(T[:3, :3].T, T[:3, 3])
+
+        return T_model, distances * scale, i
+
+    def getTargetIndex(self, target_points, target_colors):
+        """ Returns a KD-tree over the target cloud in the joint xyz + affordance
+            colour space. The tree is only rebuilt when the target changes, so
+            repeated ICP calls against the same observation share one index.
+
+            Input:
+            target_points   - np.array(), shape (N, 3), x, y, z
+            target_colors   - np.array(), shape (N, 3), r, g, b
+
+            Output:
+            index           - sklearn.neighbors.NearestNeighbors, fitted
+        """
+
+        key = (target_points.shape, target_colors.shape,
+                hash(target_points.tobytes()), hash(target_colors.tobytes()))
+
+        # service callbacks run concurrently, the cached key and index are only
+        # read and replaced together under the lock, a tree is built outside it
+        with self.target_index_lock:
+            if self.target_index is not None and self.target_index_key == key:
+                return self.target_index
+
+        index = NearestNeighbors(n_neighbors = 1, algorithm = 'kd_tree')
+        index.fit(np.hstack((target_points, target_colors)))
+
+        with self.target_index_lock:
+            self.target_index = index
+            self.target_index_key = key
+
+        return index
 
     def icp(self, source_points, source_colors, target_points, target_colors, init_pose=None, max_iterations=100, tolerance=0.0001):
         '''
@@ -888,7 +1668,7 @@ class OrientationServer(object):
         The Iterative Closest Point method: finds best-fit transform that maps points A on to points B
         Input:
             A: Nxm numpy array of source mD points
-            B: Nxm numpy array of destination mD point
+            B: Kxm numpy array of destination mD point
             init_pose: (m+1)x(m+1) homogeneous transformation
             max_iterations: exit algorithm after max_iterations
             tolerance: convergence criteria
@@ -898,50 +1678,37 @@ class OrientationServer(object):
             i: number of iterations to converge
         '''
 
+        # the target is indexed as a whole, only an oversized source is subsampled
         if source_points.shape[0] > target_points.shape[0]:
-            indices = t_indices = random.sample(range(0, source_points.shape[0]), target_points.shape[0])
+            indices = random.sample(range(0, source_points.shape[0]), target_points.shape[0])
             source_points = source_points[indices]
             source_colors = source_colors[indices]
 
-        elif target_points.shape[0] > source_points.shape[0]:
-            indices = t_indices = random.sample(range(0, target_points.shape[0]), source_points.shape[0])
-            target_points = target_points[indices]
-            target_colors = target_colors[indices]
+        index = self.getTargetIndex(target_points, target_colors)
 
-        assert source_points.shape == target_points.shape
         A = source_points
-        B = target_points
-
-        # get number of dimensions
         m = A.shape[1]
 
-        # make points homogeneous, copy them to maintain the originals
-        src = np.ones((m+1,A.shape[0]))
-        dst = np.ones((m+1,B.shape[0]))
-        src[:m,:] = np.copy(A.T)
-        dst[:m,:] = np.copy(B.T)
+        # query buffer, xyz part is updated in place every iteration
+        query = np.hstack((A, source_colors)).astype(np.float64)
+        src = query[:, :m]
 
         # apply the initial pose estimation
         if init_pose is not None:
-            src = np.dot(init_pose, src)
+            src[:] = np.dot(src, init_pose[:m, :m].T) + init_pose[:m, m]
 
         prev_error = 0
 
         for i in range(max_iterations):
             # find the nearest neighbors between the current source and destination points
-            src_aff = np.hstack((src[:m,:].T, source_colors))
-            distances, indices = self.nearest_neighbor(np.hstack((src[:m,:].T, source_colors)),
-                                                    np.hstack((dst[:m,:].T, target_colors)))
-
-            #distances, indices = self.nearest_neighbor(src[:m,:].T, dst[:m,:].T)
+            distances, indices = index.kneighbors(query, return_distance=True)
+            distances, indices = distances.ravel(), indices.ravel()
 
             # compute the transformation between the current source and nearest destination points
-            T,_,_ = self.best_fit_transform(src[:m,:].T, dst[:m,indices].T)
-
-
+            T,_,_ = self.best_fit_transform(src, target_points[indices])
 
             # update the current source
-            src = np.dot(T, src)
+            src[:] = np.dot(src, T[:m, :m].T) + T[:m, m]
 
             # check error
             mean_error = np.mean(distances)
@@ -950,18 +1717,21 @@ class OrientationServer(object):
             prev_error = mean_error
 
         # calculate final transformation
-        T,_,_ = self.best_fit_transform(A, src[:m,:].T)
+        T,_,_ = self.best_fit_transform(A, src)
 
         return T, distances, i
 
     def icpWithNormals(self, source_points, source_colors, source_normals, target_points, target_colors, target_normals, init_pose=None, max_iterations=100, tolerance=0.0001):
         '''
-        https://github.com/ClayFlannigan/icp
-        The Iterative Closest Point method: finds best-fit transform that maps points A on to points B
+        Point-to-plane variant of icp(), correspondences are found in the joint
+        xyz + affordance colour space and every step solves the linearized
+        point-to-plane least squares problem for all correspondences at once.
         Input:
-            A: Nxm numpy array of source mD points
-            B: Nxm numpy array of destination mD point
-            init_pose: (m+1)x(m+1) homogeneous transformation
+            source_points: Nx3 numpy array of source points
+            source_normals: Nx3 numpy array, kept for interface compatibility
+            target_points: Kx3 numpy array of destination points
+            target_normals: Kx3 numpy array of destination normals
+            init_pose: 4x4 homogeneous transformation
             max_iterations: exit algorithm after max_iterations
             tolerance: convergence criteria
         Output:
@@ -971,82 +1741,59 @@ class OrientationServer(object):
         '''
 
         if source_points.shape[0] > target_points.shape[0]:
-            indices = t_indices = random.sample(range(0, source_points.shape[0]), target_points.shape[0])
+            indices = random.sample(range(0, source_points.shape[0]), target_points.shape[0])
             source_points = source_points[indices]
             source_colors = source_colors[indices]
             source_normals = source_normals[indices]
 
-        elif target_points.shape[0] > source_points.shape[0]:
-            indices = t_indices = random.sample(range(0, target_points.shape[0]), source_points.shape[0])
-            target_points = target_points[indices]
-            target_colors = target_colors[indices]
-            target_normals = target_normals[indices]
+        index = self.getTargetIndex(target_points, target_colors)
 
-        assert source_points.shape == target_points.shape
         A = source_points
-        B = target_points
-
-
-        # get number of dimensions
-        m = A.shape[1]
 
-        # make points homogeneous, copy them to maintain the originals
-        src = np.ones((m+1,A.shape[0]))
-        dst = np.ones((m+1,B.shape[0]))
-        src[:m,:] = np.copy(A.T)
-        dst[:m,:] = np.copy(B.T)
+        query = np.hstack((A, source_colors)).astype(np.float64)
+        src = query[:, :3]
 
-        # apply the initial pose estimation
+        T_total = np.identity(4)
         if init_pose is not None:
-            src = np.dot(init_pose, src)
+            src[:] = np.dot(src, init_pose[:3, :3].T) + init_pose[:3, 3]
+            T_total = np.copy(init_pose)
 
+        J = np.zeros((A.shape[0], 6))
         prev_error = 0
 
         for i in range(max_iterations):
-            # find the nearest neighbors between the current source and destination points
-            src_aff = np.hstack((src[:m,:].T, source_colors))
-            #distances, indices = self.nearest_neighbor(np.hstack((src[:m,:].T, source_colors)),
-            #                                        np.hstack((dst[:m,:].T, target_colors)))
+            distances, indices = index.kneighbors(query, return_distance=True)
+            distances, indices = distances.ravel(), indices.ravel()
 
-            distances, indices = self.nearest_neighbor(np.hstack((source_normals, source_colors)),
-                                                    np.hstack((source_normals, target_colors)))
+            dst = target_points[indices]
+            normals = target_normals[indices]
 
-            #distances, indices = self.nearest_neighbor(src[:m,:].T, dst[:m,:].T)
+            # residual along the target normal and its jacobian w.r.t. [rotation, translation]
+            residuals = np.einsum('ij,ij->i', src - dst, normals)
+            J[:, :3] = np.cross(src, normals)
+            J[:, 3:] = normals
 
-            # compute the transformation between the current source and nearest destination points
-            T,_,_ = self.best_fit_transform(src[:m,:].T, dst[:m,indices].T)
+            x, _, _, _ = np.linalg.lstsq(J, -residuals, rcond=None)
 
-            # update the current source
-            src = np.dot(T, src)
+            T = np.identity(4)
+            T[:3, :3] = R.from_rotvec(x[:3]).as_matrix()
+            T[:3, 3] = x[3:]
+
+            src[:] = np.dot(src, T[:3, :3].T) + T[:3, 3]
+            T_total = np.dot(T, T_total)
 
-            # check error
             mean_error = np.mean(distances)
             if np.abs(prev_error - mean_error) < tolerance:
                 break
             prev_error = mean_error
 
-        # calculate final transformation
-        T,_,_ = self.best_fit_transform(A, src[:m,:].T)
-
-        return T, distances, i
+        return T_total, distances, i
 
 if __name__ == "__main__":
-    global depth_image, rgb_image, capture
-
 
     rospy.init_node('orientation_service', anonymous=True)
-    rate = rospy.Rate(10)
 
     orientation_predictor = OrientationServer()
-    capture = False
-
-    while True: # The offscreen renderer has to run on the main thread
-        rate.sleep()
-        if capture:
-            depth_image = orientation_predictor.renderer.render_to_depth_image()
-            rgb_image = orientation_predictor.renderer.render_to_image()
-
-            capture = False
 
     while not rospy.is_shutdown():
         rospy.spin()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+for module in ["rospy", "open3d", "cv2", "sklearn", "orientation_service.srv", "rob9Utils.affordancetools"]:
+    pytest.importorskip(module)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "scripts"))
+from server import collectHypothesisResults
+
+def test_stop_threshold_cancels_pending_hypotheses():
+    """ The first hypothesis meets the stop threshold, the pending ones are
+        cancelled and must not raise CancelledError """
+
+    stop_event = threading.Event()
+    futures = []
+    started = []
+
+    def evaluate(index):
+        started.append(index)
+        if index == 1:
+            # keeps the only worker busy until the pending hypotheses are cancelled
+            deadline = time.time() + 5
+            while not (futures and futures[-1].cancelled()) and time.time() < deadline:
+                time.sleep(0.001)
+        if stop_event.is_set():
+            return index, None, None
+        if index == 0:
+            stop_event.set()
+            return index, [0, 0, 0, 1], 0.001
+        return index, [0, 0, 0, 1], 1.0
+
+    with ThreadPoolExecutor(max_workers = 1) as executor:
+        futures.extend([executor.submit(evaluate, i) for i in range(20)])
+        results = collectHypothesisResults(futures, stop_event)
+
+    assert stop_event.is_set()
+    assert any(future.cancelled() for future in futures)
+    assert min(results, key = lambda result: result[0])[1] == 0
+    assert len(started) < len(futures)
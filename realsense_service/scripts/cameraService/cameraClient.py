@@ -7,6 +7,7 @@ import sensor_msgs.point_cloud2 as pc2
 from std_msgs.msg import Header, Float32MultiArray, MultiArrayLayout, MultiArrayDimension
 from sensor_msgs.msg import Image, PointCloud2, PointField
 import sensor_msgs.point_cloud2 as pc2
+import rob9Utils.services as services
 
 class CameraClient(object):
     """docstring for CameraClient."""
@@ -30,23 +31,32 @@ class CameraClient(object):
         self.serviceNameUV = self.baseService + "/pointcloud/static/uv"
         self.serviceNamePointcloud = self.baseService + "/pointcloud/static"
 
+        self.FIELDS_XYZ = [
+            PointField(name='x', offset=0, datatype=PointField.FLOAT32, count=1),
+            PointField(name='y', offset=4, datatype=PointField.FLOAT32, count=1),
+            PointField(name='z', offset=8, datatype=PointField.FLOAT32, count=1),
+        ]
+        self.FIELDS_XYZRGB = self.FIELDS_XYZ + [
+            PointField(name='rgb', offset=12, datatype=PointField.FLOAT32, count=1),
+        ]
+        self.POINTFIELD_DTYPES = {PointField.INT8: 'i1', PointField.UINT8: 'u1',
+                                PointField.INT16: 'i2', PointField.UINT16: 'u2',
+                                PointField.INT32: 'i4', PointField.UINT32: 'u4',
+                                PointField.FLOAT32: 'f4', PointField.FLOAT64: 'f8'}
+
     def captureNewScene(self):
         """ Tells the camera service to update the static data """
 
-        rospy.wait_for_service(self.serviceNameCapture)
-        captureService = rospy.ServiceProxy(self.serviceNameCapture, capture)
         msg = capture()
         msg.data = True
-        response = captureService(msg)
+        response = services.call(self.serviceNameCapture, capture, msg)
 
     def getRGB(self):
         """ Sets the self.rgb to current static rgb captured by camera """
 
-        rospy.wait_for_service(self.serviceNameRGB)
-        rgbService = rospy.ServiceProxy(self.serviceNameRGB, rgb)
         msg = rgb()
         msg.data = True
-        response = rgbService(msg)
+        response = services.call(self.serviceNameRGB, rgb, msg)
         img = np.frombuffer(response.img.data, dtype=np.uint8).reshape(response.img.height, response.img.width, -1)
         self.rgb = img
         return self.rgb
@@ -56,11 +66,9 @@ class CameraClient(object):
         """ Sets the self.depth to current static depth image captured by
         camera """
 
-        rospy.wait_for_service(self.serviceNameDepth)
-        depthService = rospy.ServiceProxy(self.serviceNameDepth, depth)
         msg = depth()
         msg.data = True
-        response = depthService(msg)
+        response = services.call(self.serviceNameDepth, depth, msg)
         img = np.frombuffer(response.img.data, dtype=np.float16).reshape(response.img.height, response.img.width, -1)
         #img = np.frombuffer(response.img.data, dtype=np.uint8).reshape(response.img.height, response.img.width, -1)
         self.depth = img
@@ -70,12 +78,10 @@ class CameraClient(object):
         """ Sets the self.uv to current static uv coordinates for translation
         from pixel coordinates to point cloud coordinates """
 
-        rospy.wait_for_service(self.serviceNameUV)
-        uvStaticService = rospy.ServiceProxy(self.serviceNameUV, uvSrv)
         msg = uvSrv()
 
         msg.data = True
-        response = uvStaticService(msg)
+        response = services.call(self.serviceNameUV, uvSrv, msg)
         uv = self.unpackUV(response.uv)
 
         self.uv = uv
@@ -85,74 +91,139 @@ class CameraClient(object):
         """ sets self.pointcloud to the current static point cloud with geometry
         only """
 
-        rospy.wait_for_service(self.serviceNamePointcloud)
-        pointcloudStaticService = rospy.ServiceProxy(self.serviceNamePointcloud, pointcloud)
-
         msg = pointcloud()
         msg.data = True
-        response = pointcloudStaticService(msg)
+        response = services.call(self.serviceNamePointcloud, pointcloud, msg)
         self.pointcloud, self.pointcloudColor = self.unpackPCD(response.pc, response.color)
 
         return self.pointcloud, self.pointcloudColor
 
     def packPCD(self, geometry, color):
-        """ Input:
+        """ Packs x, y, z and optionally r, g, b into a single PointCloud2, the
+            colors are stored as the packed float 'rgb' field (bytes b, g, r, 0)
+            used by pcl and rviz.
+
+            Input:
             geometry    - np.array, contains x, y, z information
-            color       - np.array, contains r, g, b information
+            color       - np.array, contains r, g, b information, 0 - 255,
+                          channel order as captured, unpackPCD() returns them
+                          flipped and scaled to 0 - 1
 
             Output:
             msg_geometry - sensor_msgs.msg.PointCloud2
-            msg_color    - std_msgs.Float32MultiArray
+            msg_color    - std_msgs.Float32MultiArray, empty as the colors
+                           are in msg_geometry, 0 if color is None
         """
-        FIELDS_XYZ = [
-            PointField(name='x', offset=0, datatype=PointField.FLOAT32, count=1),
-            PointField(name='y', offset=4, datatype=PointField.FLOAT32, count=1),
-            PointField(name='z', offset=8, datatype=PointField.FLOAT32, count=1),
-        ]
 
         header = Header()
         header.stamp = rospy.Time.now()
         header.frame_id = "ptu_camera_color_optical_frame"
 
-        msg_geometry = pc2.create_cloud(header, FIELDS_XYZ, geometry)
+        geometry = np.asarray(geometry, dtype=np.float32).reshape(-1, 3)
+
+        if color is None:
+            fields = self.FIELDS_XYZ
+            cloud = np.empty(geometry.shape[0], dtype=[('xyz', '<f4', (3,))])
+        else:
+            fields = self.FIELDS_XYZRGB
+            cloud = np.zeros(geometry.shape[0], dtype=[('xyz', '<f4', (3,)), ('rgb', 'u1', (4,))])
+            cloud['rgb'][:, :3] = np.clip(np.rint(np.asarray(color).reshape(-1, 3)), 0, 255)
+        cloud['xyz'] = geometry
+
+        msg_geometry = PointCloud2()
+        msg_geometry.header = header
+        msg_geometry.height = 1
+        msg_geometry.width = cloud.shape[0]
+        msg_geometry.fields = fields
+        msg_geometry.is_bigendian = False
+        msg_geometry.point_step = cloud.dtype.itemsize
+        msg_geometry.row_step = cloud.dtype.itemsize * cloud.shape[0]
+        msg_geometry.is_dense = bool(np.all(np.isfinite(geometry)))
+        msg_geometry.data = cloud.tobytes()
+
         msg_color = 0
         if color is not None:
             msg_color = Float32MultiArray()
-            msg_color.data = color.astype(float).flatten().tolist()
 
         return msg_geometry, msg_color
 
     def unpackPCD(self, msg_geometry, msg_color):
-        """ Input:
+        """ Reads the PointCloud2 buffer in place through a numpy dtype built
+            from its fields, NaN points are skipped.
+
+            Input:
             msg_geometry - sensor_msgs.msg.PointCloud2
-            msg_color    - std_msgs.Float32MultiArray
+            msg_color    - std_msgs.Float32MultiArray, only read if msg_geometry
+                           has no 'rgb' field (clouds packed before colors were
+                           embedded)
 
             Output:
             geometry    - np.array, contains x, y, z information
             color       - np.array, contains r, g, b information
         """
 
-        # Get cloud data from ros_cloud
-        field_names = [field.name for field in msg_geometry.fields]
-        geometry_data = list(pc2.read_points(msg_geometry, skip_nans=True, field_names = field_names))
+        num_points = msg_geometry.width * msg_geometry.height
 
         # Check empty
-        if len(geometry_data)==0:
+        if num_points == 0:
             print("Converting an empty cloud")
             return None, None
 
-        geometry = [(x, y, z) for x, y, z in geometry_data ] # get xyz
-        geometry = np.array(geometry)
+        cloud = self.pointCloud2ToArray(msg_geometry)
+
+        geometry = np.stack((cloud['x'], cloud['y'], cloud['z']), axis=-1).astype(np.float64)
+        valid = np.all(np.isfinite(geometry), axis=1)
+        geometry = geometry[valid]
+
+        if geometry.shape[0] == 0:
+            print("Converting an empty cloud")
+            return None, None
 
         # get colors
         color = 0
-        if msg_color is not None:
+        if 'rgb' in cloud.dtype.names:
+            color = cloud['rgb'][valid, 2::-1] / 255
+        elif msg_color is not None and len(msg_color.data) > 0:
             color = np.asarray(msg_color.data)
             color = np.reshape(color, (-1,3)) / 255
             color = np.flip(color, axis=1)
+            if color.shape[0] == valid.shape[0]:
+                color = color[valid]
 
         return geometry, color
 
+    def pointCloud2ToArray(self, msg):
+        """ Structured view of the PointCloud2 data, no copy is made when the
+            rows are not padded. 'rgb' and 'rgba' fields are read as 4 bytes.
+
+            Input:
+            msg         - sensor_msgs.msg.PointCloud2
+
+            Output:
+            cloud       - np.array, structured, shape (height * width)
+        """
+
+        byte_order = '>' if msg.is_bigendian else '<'
+        names, formats, offsets = [], [], []
+        for field in msg.fields:
+            if field.name in ['rgb', 'rgba']:
+                names.append('rgb')
+                formats.append(('u1', 4))
+            else:
+                names.append(field.name)
+                dtype = byte_order + self.POINTFIELD_DTYPES[field.datatype]
+                formats.append(dtype if field.count == 1 else (dtype, field.count))
+            offsets.append(field.offset)
+
+        dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                            'itemsize': msg.point_step})
+
+        data = np.frombuffer(msg.data, dtype=np.uint8)
+        if msg.row_step != msg.width * msg.point_step:
+            data = data.reshape(msg.height, msg.row_step)[:, :msg.width * msg.point_step]
+            data = np.ascontiguousarray(data).ravel()
+
+        return data.view(dtype)
 
     def packUV(self, uv):
         """ packs the uv data into a Float32MultiArray
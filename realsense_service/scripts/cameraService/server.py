@@ -11,6 +11,7 @@ from std_msgs.msg import Header, Float32MultiArray, MultiArrayLayout, MultiArray
 from sensor_msgs.msg import Image, PointCloud2, PointField
 import sensor_msgs.point_cloud2 as pc2
 import rospy
+from cameraService.cameraClient import CameraClient
 import pyrealsense2 as rs
 import numpy as np
 from cv_bridge import CvBridge
@@ -51,8 +52,10 @@ class RealsenseServer(object):
         self.uvStatic = 0
         self.framesRGB = []
         self.framesDepth = []
+        self.subsampleMethod = "random" # "random" or "stride", see generatePointcloud()
 
         self.br = CvBridge()
+        self.codec = CameraClient(type = type) # packPCD() shared with the clients
 
         self.FIELDS_XYZ = [
             PointField(name='x', offset=0, datatype=PointField.FLOAT32, count=1),
@@ -182,33 +185,47 @@ class RealsenseServer(object):
 
 
     def generatePointcloud(self, depth_frame, color_frame, color_image, maxDistanceMeters = 0.5, maxVertices = 80000):
-        """ Generate point cloud and update the dynamic point clouds """
+        """ Generate point cloud and update the dynamic point clouds
+
+            Input:
+            depth_frame         - rs.depth_frame
+            color_frame         - rs.video_frame
+            color_image         - np.array, uint8, shape (h, w, 3)
+            maxDistanceMeters   - float, points further away are discarded
+            maxVertices         - int, number of points kept, fewer if not
+                                  enough points are in range
+
+            Output:
+            cloudGeometry       - np.array, float32, shape (N, 3)
+            cloudColor          - np.array, uint8, shape (N * 3), b, g, r
+            uv                  - np.array, int, shape (N, 2), row, col
+        """
 
         cloud = rs.pointcloud()
         cloud.map_to(color_frame)
         points = rs.points()
         points = cloud.calculate(depth_frame)
-        cloud = np.array(np.array(points.get_vertices()).tolist())
 
-        uv = np.array(np.array(points.get_texture_coordinates()).tolist())
-        uv[:,0] = uv[:,0] * self.cam_width
-        uv[:,1] = uv[:,1] * self.cam_height
-        uv[:, [1, 0]] = uv[:, [0, 1]]
-        uv = np.rint(np.array(uv)).astype(int)
+        # view the realsense vertex and texture coordinate buffers, no copy
+        cloud = np.asanyarray(points.get_vertices()).view(np.float32).reshape(-1, 3)
+        tex = np.asanyarray(points.get_texture_coordinates()).view(np.float32).reshape(-1, 2)
 
-        idx = cloud[:,2] < maxDistanceMeters
-        cloud = cloud[idx]
-        uv = uv[idx]
-        idxs = np.random.choice(cloud.shape[0], maxVertices, replace=False)
-        cloudGeometry = cloud[idxs]
-        uv = uv[idxs]
+        idx = np.flatnonzero(cloud[:,2] < maxDistanceMeters)
 
-        colors = []
-        for idx in uv:
-            colors.append(color_image[idx[0], idx[1]])
-        colors = np.array(colors)
+        if idx.shape[0] > maxVertices:
+            if self.subsampleMethod == "stride":
+                idx = idx[(np.arange(maxVertices) * idx.shape[0]) // maxVertices]
+            else:
+                idx = idx[np.sort(np.random.choice(idx.shape[0], maxVertices, replace=False))]
 
-        cloudColor = colors.flatten()
+        cloudGeometry = cloud[idx]
+
+        # texture coordinates to row, col pixel coordinates
+        uv = np.empty((idx.shape[0], 2), dtype=int)
+        uv[:,0] = np.clip(np.rint(tex[idx, 1] * self.cam_height), 0, color_image.shape[0] - 1)
+        uv[:,1] = np.clip(np.rint(tex[idx, 0] * self.cam_width), 0, color_image.shape[1] - 1)
+
+        cloudColor = color_image[uv[:,0], uv[:,1]].flatten()
 
         return cloudGeometry, cloudColor, uv
 
@@ -248,12 +265,8 @@ class RealsenseServer(object):
         return msg
 
     def servicePointCloud(self, command):
-        header = Header()
-        header.stamp = rospy.Time.now()
-        header.frame_id = "ptu_camera_color_optical_frame"
         msg = pointcloudResponse()
-        msg.pc = pc2.create_cloud(header, self.FIELDS_XYZ, self.cloudGeometryStatic)
-        msg.color.data = camera.cloudColorStatic
+        msg.pc, msg.color = self.codec.packPCD(self.cloudGeometryStatic, self.cloudColorStatic)
         return msg
 
     def updateStatic(self, capture):
@@ -292,10 +305,8 @@ if __name__ == "__main__":
         # publish static
         #camera.pubStaticRGB.publish(br.cv2_to_imgmsg(camera.colorImageStatic))
 
-        header = Header()
-        header.stamp = rospy.Time.now()
-        header.frame_id = "ptu_camera_color_optical_frame"
-        camera.pubPointCloudGeometryStatic.publish(pc2.create_cloud(header, camera.FIELDS_XYZ, camera.cloudGeometryStatic))
+        msg_geometry, _ = camera.codec.packPCD(camera.cloudGeometryStatic, None)
+        camera.pubPointCloudGeometryStatic.publish(msg_geometry)
 
         #msg = Float32MultiArray()
         #msg.data = camera.cloudColorStatic
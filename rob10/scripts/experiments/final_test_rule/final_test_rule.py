@@ -224,10 +224,7 @@ if __name__ == '__main__':
             print("Segmenting affordance maps")
             aff_client = AffordanceClient()
 
-            aff_client.start(GPU=True)
-            _ = aff_client.run(img, CONF_THRESHOLD = 0.5)
-
-            masks, labels, scores, bboxs = aff_client.getAffordanceResult()
+            masks, labels, scores, bboxs = aff_client.runAndGetResult(img, CONF_THRESHOLD = 0.5, GPU = True)
             masks = aff_client.processMasks(masks, conf_threshold = 0, erode_kernel=(1,1))
 
             if args.save:
@@ -0,0 +1,167 @@
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+
+class AffordancePointCloud(object):
+    """ Point cloud where every point carries an affordance label decoded once
+        from its color. Points are sorted by label so the points of a label
+        are a contiguous slice, counts are kept per label and centroids,
+        covariances and KD-trees are computed once per label on request.
+
+        Labels are indices into the provided label colors. If the same color
+        appears more than once (e.g. pound and (255, 255, 0) in
+        getAffordanceColors()) its points belong to the first index, but every
+        per label accessor also answers for the duplicate index.
+    """
+
+    def __init__(self, points, colors, label_colors):
+        """ Input:
+            points          - np.array(), shape (N, 3)
+            colors          - np.array(), shape (N, 3), r, g, b in [0, 1] or [0, 255]
+            label_colors    - list[(r, g, b)], color of each label, see
+                              rob9Utils.affordancetools.getAffordanceColors()
+        """
+
+        points = np.asanyarray(points)
+        colors = np.asanyarray(colors)
+
+        if colors.shape[0] > 0 and np.max(colors) <= 1.0:
+            colors = colors * 255
+
+        self.label_colors = list(label_colors)
+        self.num_labels = len(self.label_colors)
+
+        # map every label to the first label sharing its color
+        label_keys = self.colorKey(np.array(self.label_colors))
+        unique_keys, first_label = np.unique(label_keys, return_index = True)
+        self.canonical = first_label[np.searchsorted(unique_keys, label_keys)]
+
+        # decode colors, points with a color not in label_colors get -1
+        keys = self.colorKey(np.rint(colors).astype(np.int64))
+        pos = np.clip(np.searchsorted(unique_keys, keys), 0, unique_keys.shape[0] - 1)
+        labels = np.where(unique_keys[pos] == keys, first_label[pos], -1)
+
+        order = np.argsort(labels, kind = 'stable')
+        self.points = points[order]
+        self.colors = colors[order]
+        self.labels = labels[order]
+        self.order = order
+
+        self.offsets = np.searchsorted(self.labels, np.arange(self.num_labels + 1))
+        self.counts = np.diff(self.offsets)
+        self.counts = self.counts[self.canonical]
+
+        self.centroids = {}
+        self.covariances = {}
+        self.indices = {}
+
+    @staticmethod
+    def colorKey(colors):
+        """ Input:
+            colors          - np.array(), int, shape (N, 3)
+
+            Output:
+            keys            - np.array(), int, shape (N), one integer per color
+        """
+
+        colors = colors.astype(np.int64)
+        return (colors[:, 0] << 16) | (colors[:, 1] << 8) | colors[:, 2]
+
+    @classmethod
+    def fromPointCloud(cls, pcd, label_colors):
+        """ Input:
+            pcd             - o3d.geometry.PointCloud() or AffordancePointCloud()
+            label_colors    - list[(r, g, b)]
+
+            Output:
+            cloud           - AffordancePointCloud(), pcd itself if it already is one
+        """
+
+        if isinstance(pcd, cls):
+            return pcd
+
+        return cls(np.asanyarray(pcd.points), np.asanyarray(pcd.colors), label_colors)
+
+    def getCounts(self):
+        """ Output:
+            counts          - np.array(), int, shape (num_labels), points per label
+        """
+
+        return self.counts
+
+    def getCount(self, label):
+        return self.counts[label]
+
+    def getPresentLabels(self):
+        """ Output:
+            labels          - np.array(), int, labels with at least one point
+        """
+
+        return np.flatnonzero(self.counts)
+
+    def getPoints(self, label):
+        """ Input:
+            label           - int
+
+            Output:
+            points          - np.array(), shape (count, 3), view into the sorted points
+        """
+
+        label = self.canonical[label]
+        return self.points[self.offsets[label]:self.offsets[label + 1]]
+
+    def getCentroid(self, label):
+        """ Input:
+            label           - int
+
+            Output:
+            centroid        - np.array(), shape (3), None if the label has no points
+        """
+
+        label = self.canonical[label]
+        if label not in self.centroids:
+            points = self.getPoints(label)
+            self.centroids[label] = np.mean(points, axis = 0) if points.shape[0] > 0 else None
+        return self.centroids[label]
+
+    def getCovariance(self, label):
+        """ Input:
+            label           - int
+
+            Output:
+            covariance      - np.array(), shape (3, 3), population covariance,
+                              None if the label has no points
+        """
+
+        label = self.canonical[label]
+        if label not in self.covariances:
+            points = self.getPoints(label)
+            self.covariances[label] = np.cov(points, rowvar = False, bias = True) if points.shape[0] > 0 else None
+        return self.covariances[label]
+
+    def getStd(self, label):
+        """ Input:
+            label           - int
+
+            Output:
+            std             - np.array(), shape (3), per axis standard deviation
+        """
+
+        return np.sqrt(np.diag(self.getCovariance(label)))
+
+    def getIndex(self, label):
+        """ Input:
+            label           - int
+
+            Output:
+            index           - sklearn NearestNeighbors fitted on the points of
+                              the label, None if the label has no points
+        """
+
+        label = self.canonical[label]
+        if label not in self.indices:
+            points = self.getPoints(label)
+            index = None
+            if points.shape[0] > 0:
+                index = NearestNeighbors(n_neighbors = 1, algorithm = 'kd_tree').fit(points)
+            self.indices[label] = index
+        return self.indices[label]
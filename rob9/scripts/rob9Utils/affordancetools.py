@@ -2,42 +2,36 @@ import numpy as np
 import cv2
 import open3d as o3d
 
+from rob9Utils.affordancePointCloud import AffordancePointCloud
+
 def getAffordancePointCloudBasedOnVariance(pcd):
     """ Computes 9 points for each affordance, based on standard deviation,
         present in the point cloud
 
         Input:
-        pcd             - o3d.geometry.PointCloud()
+        pcd             - o3d.geometry.PointCloud() or AffordancePointCloud()
 
         Output:
         pcd_box        - o3d.geometry.PointCloud()
     """
 
-    affordances, affordance_counts = getPredictedAffordancesInPointCloud(pcd)
+    label_colors = getAffordanceColors()
+    cloud = AffordancePointCloud.fromPointCloud(pcd, label_colors)
+
+    affordance_counts = cloud.getCounts()
     affordance_counts = affordance_counts / np.linalg.norm(affordance_counts)
 
     out_points, out_colors = [], []
-    points = np.asanyarray(pcd.points)
-    colors = np.asanyarray(pcd.colors)
-
-    if np.max(colors) <= 1.0:
-        colors = colors * 255
-
-    label_colors = getAffordanceColors()
 
     first = True
     for label_count, label_color in enumerate(label_colors):
         if label_count != 0:
             if affordance_counts[label_count] > 0.005:
 
-                idx = colors == label_color
-                idx = np.sum(idx, axis = -1) == 3
-
-                if True in idx:
-                    aff_points = points[idx]
+                if cloud.getCount(label_count) > 0:
 
-                    x_c, y_c, z_c = np.mean(aff_points, axis = 0)
-                    x_std, y_std, z_std = np.std(aff_points, axis = 0) / 2
+                    x_c, y_c, z_c = cloud.getCentroid(label_count)
+                    x_std, y_std, z_std = cloud.getStd(label_count) / 2
 
                     box_points = []
                     box_points.append([x_c, y_c, z_c]) # centroid
@@ -71,31 +65,17 @@ def getAffordancePointCloudBasedOnVariance(pcd):
 
 def getPredictedAffordancesInPointCloud(pcd):
     """ Input:
-        pcd         - o3d.geometry.PointCloud()
+        pcd         - o3d.geometry.PointCloud() or AffordancePointCloud()
 
         Output:
         affordances - list[], one-hot-encoded vector with present affordances.
         counts      - np.array(), shape(num_affordances), int count of every affordance.
     """
 
-    label_colors = getAffordanceColors()
-
-    colors = np.asanyarray(pcd.colors)
-    if np.max(colors) <= 1.0:
-        colors = colors * 255
-
-    affordances, counts = [], []
+    cloud = AffordancePointCloud.fromPointCloud(pcd, getAffordanceColors())
+    counts = cloud.getCounts()
 
-    for label_color in label_colors:
-        idx = colors == label_color
-        idx = np.sum(idx, axis = -1) == 3
-
-        if True in idx:
-            affordances.append(1)
-            counts.append(np.count_nonzero(idx == True))
-        else:
-            affordances.append(0)
-            counts.append(0)
+    affordances = [1 if count > 0 else 0 for count in counts]
 
     return affordances, np.array(counts)
 
@@ -155,31 +135,21 @@ def getAffordanceBoundingBoxes(pcd):
 
         Input:
         pcd     - o3d.geometry.PointCloud where each point has an affordance
-                  assigned.
+                  assigned, or AffordancePointCloud()
         Output:
         points  - np.array (N, 3) x, y, z points
         colors  - np.array (N, 3) r, g, b associated with each affordance
     """
 
-    pcd_points = np.asanyarray(pcd.points)
-    pcd_colors = np.asanyarray(pcd.colors).astype(np.uint8)
-
-    if np.max(pcd_colors) <= 1.0:
-        pcd_colors = pcd_colors * 255
-
     label_colors = getAffordanceColors()
+    cloud = AffordancePointCloud.fromPointCloud(pcd, label_colors)
 
     points = []
     colors = []
 
-    #print(np.unique(pcd_colors, axis = 0))
-
-    for color in label_colors:
-        idx = pcd_colors == color
-        idx = np.sum(idx, axis = -1) == 3
-
-        if True in idx:
-            aff_points = o3d.utility.Vector3dVector(pcd_points[idx])
+    for label, color in enumerate(label_colors):
+        if cloud.getCount(label) > 0:
+            aff_points = o3d.utility.Vector3dVector(cloud.getPoints(label))
             bbox = np.asanyarray(o3d.geometry.OrientedBoundingBox.create_from_points(aff_points).get_box_points())
             bbox_colors = [color for i in range(bbox.shape[0])]
 
@@ -212,47 +182,66 @@ def getPointCloudAffordanceMask(affordance_id, points, uvs, masks, remove_outlie
     if points.shape[0] <= 0:
         return False, 0
 
-    # select affordance mask in bbox of object
+    # Check if the affordance mask has the requested affordance
+    m = masks[affordance_id]
     if bbox is not None:
-        m = masks[affordance_id, bbox[1]:bbox[3], bbox[0]:bbox[2]]
-
-        # do the same for points and uv
-        points = points[np.where(uvs[:,0] > bbox[1])]
-        uvs = uvs[np.where(uvs[:,0] > bbox[1])]
-        points = points[np.where(uvs[:,0] < bbox[3])]
-        uvs = uvs[np.where(uvs[:,0] < bbox[3])]
-        points = points[np.where(uvs[:,1] > bbox[0])]
-        uvs = uvs[np.where(uvs[:,1] > bbox[0])]
-        points = points[np.where(uvs[:,1] < bbox[2])]
-        uvs = uvs[np.where(uvs[:,1] < bbox[2])]
-        uvs[:,0] -= bbox[1]
-        uvs[:,1] -= bbox[0]
-
-    else:
-        m = masks[affordance_id, :, :]
+        m = m[bbox[1]:bbox[3], bbox[0]:bbox[2]]
 
-    # Check if the affordance mask has the requested affordance
-    if not 255 in np.unique(m) and not 1 in np.unique(m):
+    if not np.any((m == 255) | (m == 1)):
         return False, 0
 
     # get points belonging to affordance
-    cloud_masked = []
-    for count, uv in enumerate(uvs):
-        if m[uv[0], uv[1]] != False:
-            cloud_masked.append(points[count])
-
-    points = np.array(cloud_masked)
+    points, hits = getPointCloudAffordanceLabels(points = points, uvs = uvs,
+                                masks = masks[affordance_id:affordance_id + 1], bbox = bbox)
+    points = points[hits[0]]
 
     if remove_outliers:
-        pcd = o3d.geometry.PointCloud()
-        pcd.points = o3d.utility.Vector3dVector(points)
-        pcd = pcd.voxel_down_sample(voxel_size=0.005)
-        pcd, _ = pcd.remove_statistical_outlier(nb_neighbors=20, std_ratio=2.0)
-
-        points = np.asanyarray(pcd.points)
+        points = removeAffordanceOutliers(points)
 
     return True, points
 
+def getPointCloudAffordanceLabels(points, uvs, masks, bbox = None):
+    """ Looks up every affordance mask for every point in a single gather
+
+        Input:
+        points          - np.array, shape: (n, 3), xyz points
+        uvs             - np.array, shape (n, 2)
+        masks           - np.array, boolean, shape (affordances, h, w)
+        bbox            - np.array, shape (4, 2) if provided only points
+                          strictly inside the bbox are returned
+
+        Output:
+        points          - np.array, shape: (m, 3), xyz points, inside bbox
+        hits            - np.array, bool, shape (affordances, m), True where
+                          the point is inside the affordance mask
+    """
+
+    if bbox is not None:
+        keep = ((uvs[:,0] > bbox[1]) & (uvs[:,0] < bbox[3]) &
+                (uvs[:,1] > bbox[0]) & (uvs[:,1] < bbox[2]))
+        points = points[keep]
+        uvs = uvs[keep]
+
+    hits = masks[:, uvs[:,0], uvs[:,1]] != False
+
+    return points, hits
+
+def removeAffordanceOutliers(points):
+    """ Input:
+        points          - np.array, shape: (n, 3), xyz points
+
+        Output:
+        points          - np.array, shape: (m, 3), voxel downsampled xyz points
+                          without statistical outliers
+    """
+
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(points)
+    pcd = pcd.voxel_down_sample(voxel_size=0.005)
+    pcd, _ = pcd.remove_statistical_outlier(nb_neighbors=20, std_ratio=2.0)
+
+    return np.asanyarray(pcd.points)
+
 def getObjectAffordancePointCloud(pcd, masks, uvs):
     """ Returns the points in the point cloud associated with the mask affordances
         also correctly collored
@@ -288,12 +277,12 @@ def getObjectAffordancePointCloud(pcd, masks, uvs):
         colors[count] = cs
 
     observed_affordances = getPredictedAffordances(masks)
+    _, hits = getPointCloudAffordanceLabels(points = points, uvs = uvs, masks = masks)
 
     aff_points = []
     aff_colors = []
     for aff in observed_affordances:
-        _, local_aff_mask = getPointCloudAffordanceMask(affordance_id = aff,
-                                        points = points, uvs = uvs, masks = masks)
+        local_aff_mask = removeAffordanceOutliers(points[hits[aff]])
         local_aff_colors = [colors[aff] for i in range(local_aff_mask.shape[0])]
         local_aff_colors = np.array(local_aff_colors)
         if len(aff_points) == 0:
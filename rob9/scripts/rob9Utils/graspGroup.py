@@ -6,145 +6,298 @@ from geometry_msgs.msg import Pose, Pose
 from std_msgs.msg import String, Float32, Int32, Header
 from rob9.msg import GraspMsg, GraspGroupMsg
 from rob9.srv import graspGroupSrv, graspGroupSrvResponse
-from rob9Utils.grasp import Grasp
+from rob9Utils.grasp import Grasp, Position, Orientation
+import rob9Utils.transformations as transform
+
+# stored in the id arrays for ids that are None in Grasp()
+NO_ID = np.iinfo(np.int64).min
 
 class GraspGroup(object):
-    """docstring for GraspGroup."""
+    """ Group of grasps stored column wise, one row per grasp:
+
+        positions           - np.array, shape (N, 3), x, y, z
+        quaternions         - np.array, shape (N, 4), qx, qy, qz, qw
+        scores              - np.array, shape (N)
+        tool_ids            - np.array, int, shape (N), NO_ID if not set
+        affordance_ids      - np.array, int, shape (N), NO_ID if not set
+        object_instances    - np.array, int, shape (N), NO_ID if not set
+        frame_ids           - np.array, object, shape (N), str
+
+        Indexing and iterating give Grasp() objects built from the rows, they
+        are copies, write them back with group[i] = grasp.
+    """
 
     def __init__(self, grasps = []):
 
         if type(grasps) is not list:
             print("Only accepts grasps as list")
-            return None
-        self.grasps = grasps
+            grasps = []
+
+        self.positions = np.zeros((0, 3))
+        self.quaternions = np.zeros((0, 4))
+        self.scores = np.zeros(0)
+        self.tool_ids = np.zeros(0, dtype=np.int64)
+        self.affordance_ids = np.zeros(0, dtype=np.int64)
+        self.object_instances = np.zeros(0, dtype=np.int64)
+        self.frame_ids = np.zeros(0, dtype=object)
+
+        if len(grasps) > 0:
+            self.grasps = grasps
 
     def __getitem__(self, index):
-        return self.grasps[index]
+        if isinstance(index, (int, np.integer)):
+            return self.getGrasp(index)
+        return self.select(index).grasps
 
     def __setitem__(self, index, item):
-        self.grasps[index] = item
+        self.setGrasp(index, item)
 
     def __len__(self):
-        return len(self.grasps)
+        return self.scores.shape[0]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.getGrasp(i)
+
+    @property
+    def grasps(self):
+        """ list[Grasp()], built from the arrays """
+
+        return [self.getGrasp(i) for i in range(len(self))]
+
+    @grasps.setter
+    def grasps(self, grasps):
+
+        num_grasps = len(grasps)
+        self.positions = np.array([[g.position.x, g.position.y, g.position.z] for g in grasps], dtype=np.float64).reshape(num_grasps, 3)
+        self.quaternions = np.array([[g.orientation.x, g.orientation.y, g.orientation.z, g.orientation.w] for g in grasps], dtype=np.float64).reshape(num_grasps, 4)
+        self.scores = np.array([g.score for g in grasps], dtype=np.float64).reshape(num_grasps)
+        self.tool_ids = self.toIdArray([g.tool_id for g in grasps])
+        self.affordance_ids = self.toIdArray([g.affordance_id for g in grasps])
+        self.object_instances = self.toIdArray([g.object_instance for g in grasps])
+        self.frame_ids = self.toFrameArray([g.frame_id for g in grasps])
+
+    @staticmethod
+    def toIdArray(ids):
+        return np.array([NO_ID if id is None else int(id) for id in ids], dtype=np.int64)
+
+    @staticmethod
+    def fromId(id):
+        return None if id == NO_ID else int(id)
+
+    @staticmethod
+    def toFrameArray(frame_ids):
+        frames = np.empty(len(frame_ids), dtype=object)
+        frames[:] = [str(frame) for frame in frame_ids]
+        return frames
+
+    def getGrasp(self, index):
+        """ Input:
+            index           - int
+
+            Output:
+            grasp           - rob9Utils.grasp.Grasp(), copy of the row
+        """
+
+        grasp = Grasp(frame_id = self.frame_ids[index])
+        x, y, z = self.positions[index].tolist()
+        qx, qy, qz, qw = self.quaternions[index].tolist()
+        grasp.position = Position(x = x, y = y, z = z)
+        grasp.orientation = Orientation(qx = qx, qy = qy, qz = qz, qw = qw)
+        grasp.score = float(self.scores[index])
+        grasp.tool_id = self.fromId(self.tool_ids[index])
+        grasp.affordance_id = self.fromId(self.affordance_ids[index])
+        grasp.object_instance = self.fromId(self.object_instances[index])
+
+        return grasp
+
+    def setGrasp(self, index, grasp):
+
+        self.positions[index] = [grasp.position.x, grasp.position.y, grasp.position.z]
+        self.quaternions[index] = [grasp.orientation.x, grasp.orientation.y, grasp.orientation.z, grasp.orientation.w]
+        self.scores[index] = grasp.score
+        self.tool_ids[index] = self.toIdArray([grasp.tool_id])[0]
+        self.affordance_ids[index] = self.toIdArray([grasp.affordance_id])[0]
+        self.object_instances[index] = self.toIdArray([grasp.object_instance])[0]
+        self.frame_ids[index] = str(grasp.frame_id)
+
+    def select(self, index):
+        """ Input:
+            index           - bool mask, int array or slice over the grasps
+
+            Output:
+            group           - GraspGroup(), new group with the selected grasps
+        """
+
+        group = GraspGroup()
+        group.positions = self.positions[index]
+        group.quaternions = self.quaternions[index]
+        group.scores = self.scores[index]
+        group.tool_ids = self.tool_ids[index]
+        group.affordance_ids = self.affordance_ids[index]
+        group.object_instances = self.object_instances[index]
+        group.frame_ids = self.frame_ids[index]
+
+        return group
 
     def add(self, grasp):
-        self.grasps.append(grasp)
+        self.combine(GraspGroup([grasp]))
 
     def combine(self, other):
 
-        for grasp in other.grasps:
-            self.add(grasp)
+        self.positions = np.vstack((self.positions, other.positions))
+        self.quaternions = np.vstack((self.quaternions, other.quaternions))
+        self.scores = np.concatenate((self.scores, other.scores))
+        self.tool_ids = np.concatenate((self.tool_ids, other.tool_ids))
+        self.affordance_ids = np.concatenate((self.affordance_ids, other.affordance_ids))
+        self.object_instances = np.concatenate((self.object_instances, other.object_instances))
+        self.frame_ids = np.concatenate((self.frame_ids, other.frame_ids))
 
         return self
 
     def fromPath(self, msg):
         self.__init__()
-        self.grasps = []
-        for poseMsg in msg.poses:
-            self.add(Grasp().fromPoseStampedMsg(poseMsg))
+
+        poses = [poseMsg.pose for poseMsg in msg.poses]
+        self.fromPoseArray(self.posesToArray(poses), frame_id = "ptu_camera_color_optical_frame")
+        self.frame_ids = self.toFrameArray([poseMsg.header.frame_id for poseMsg in msg.poses])
 
         return self
 
     def fromGraspGroupMsg(self, msg):
+        """ Input:
+            msg             - rob9.msg.GraspGroupMsg or anything with a .grasps
+                              list of rob9.msg.GraspMsg
+        """
+
         self.__init__()
-        self.grasps = []
-        for graspMsg in msg.grasps:
-            self.add(Grasp().fromGraspMsg(graspMsg))
+
+        graspMsgs = msg.grasps
+        self.fromPoseArray(self.posesToArray([graspMsg.pose for graspMsg in graspMsgs]))
+        self.scores = np.array([graspMsg.score.data for graspMsg in graspMsgs], dtype=np.float64)
+        self.tool_ids = np.array([graspMsg.tool_id.data for graspMsg in graspMsgs], dtype=np.int64)
+        self.affordance_ids = np.array([graspMsg.affordance_id.data for graspMsg in graspMsgs], dtype=np.int64)
+        self.object_instances = np.array([graspMsg.object_instance.data for graspMsg in graspMsgs], dtype=np.int64)
+        self.frame_ids = self.toFrameArray([graspMsg.frame_id.data for graspMsg in graspMsgs])
 
         return self
 
     def fromGraspGroupSrv(self, msg):
-
-        self.__init__()
-        self.grasps = []
-        for graspMsg in msg.grasps:
-            self.add(Grasp().fromGraspMsg(graspMsg))
+        return self.fromGraspGroupMsg(msg)
+
+    def fromPoseArray(self, poses, scores = None, frame_id = "ptu_camera_color_optical_frame"):
+        """ Input:
+            poses           - np.array, shape (N, 7), x, y, z, qx, qy, qz, qw
+            scores          - np.array, shape (N), zeros if None
+            frame_id        - str, frame of every pose
+        """
+
+        poses = np.asanyarray(poses, dtype=np.float64).reshape(-1, 7)
+        num_grasps = poses.shape[0]
+
+        self.positions = poses[:, :3].copy()
+        self.quaternions = poses[:, 3:].copy()
+        self.scores = np.zeros(num_grasps) if scores is None else np.asanyarray(scores, dtype=np.float64).reshape(num_grasps)
+        self.tool_ids = np.full(num_grasps, NO_ID, dtype=np.int64)
+        self.affordance_ids = np.full(num_grasps, NO_ID, dtype=np.int64)
+        self.object_instances = np.full(num_grasps, NO_ID, dtype=np.int64)
+        self.frame_ids = self.toFrameArray([frame_id] * num_grasps)
 
         return self
 
-    def getgraspsByAffordanceLabel(self, label):
+    @staticmethod
+    def posesToArray(poses):
+        """ Input:
+            poses           - list[geometry_msgs.msg.Pose]
 
-        grasps = []
-        for grasp in self.grasps:
-            if grasp.affordance_id == label:
-                grasps.append(grasp)
+            Output:
+            poses           - np.array, shape (N, 7), x, y, z, qx, qy, qz, qw
+        """
 
-        return grasps
+        return np.array([[p.position.x, p.position.y, p.position.z,
+                        p.orientation.x, p.orientation.y, p.orientation.z, p.orientation.w]
+                        for p in poses], dtype=np.float64).reshape(-1, 7)
 
-    def getGraspsByFrame(self, frame):
+    def toPoseArray(self):
+        """ Output:
+            poses           - np.array, shape (N, 7), x, y, z, qx, qy, qz, qw
+        """
 
-        grasps = []
-        for grasp in self.grasps:
-            if grasp.frame_id == frame:
-                grasps.append(grasp)
+        return np.hstack((self.positions, self.quaternions))
 
-        return grasps
-
-    def getGraspsByInstance(self, instance):
+    def getgraspsByAffordanceLabel(self, label):
+        return self.select(self.affordance_ids == label).grasps
 
-        grasps = []
-        for grasp in self.grasps:
-            if grasp.object_instance == instance:
-                grasps.append(grasp)
+    def getGraspsByFrame(self, frame):
+        return self.select(self.frame_ids == str(frame)).grasps
 
-        return grasps
+    def getGraspsByInstance(self, instance):
+        return self.select(self.object_instances == instance).grasps
 
     def getgraspsByTool(self, id):
-
-        grasps = []
-        for grasp in self.grasps:
-            if grasp.tool_id == id:
-                grasps.append(grasp)
-
-        return grasps
+        return self.select(self.tool_ids == id).grasps
 
     def setAffordanceID(self, id):
-
-        for grasp in self.grasps:
-            grasp.affordance_id = id
+        self.affordance_ids[:] = self.toIdArray([id])[0]
 
     def setFrameId(self, id):
-
-        for grasp in self.grasps:
-            grasp.frame_id = str(id)
+        self.frame_ids[:] = str(id)
 
     def setObjectInstance(self, instance):
-
-        for grasp in self.grasps:
-            grasp.object_instance = instance
+        self.object_instances[:] = self.toIdArray([instance])[0]
 
     def setToolId(self, id):
-
-        for grasp in self.grasps:
-            grasp.tool_id = id
+        self.tool_ids[:] = self.toIdArray([id])[0]
 
     def sortByScore(self):
+        """ Sorts the grasps by descending score, equal scores keep the order
+            of the old list based implementation """
 
-        scores = []
-        for grasp in self.grasps:
-            scores.append(grasp.score)
-
-        idx = sorted(range(len(scores)), key=lambda k: scores[k])
-        idx.reverse()
-        grasps = [self.grasps[i] for i in idx]
-        self.grasps = grasps
+        idx = np.argsort(self.scores, kind='stable')[::-1]
+        sorted_group = self.select(idx)
+        self.__dict__.update(sorted_group.__dict__)
 
     def thresholdByScore(self, thresh):
-
-        thresholdGrasps = []
-        for grasp in self.grasps:
-            if grasp.score >= thresh:
-                thresholdGrasps.append(grasp)
-        self.grasps = thresholdGrasps
+        thresholded = self.select(self.scores >= thresh)
+        self.__dict__.update(thresholded.__dict__)
+
+    def toGraspMsgs(self):
+        """ Output:
+            msgs            - list[rob9.msg.GraspMsg]
+        """
+
+        stamp = rospy.Time.now()
+        poses = self.toPoseArray().tolist()
+        scores = self.scores.tolist()
+        tool_ids = np.where(self.tool_ids == NO_ID, 0, self.tool_ids).tolist()
+        affordance_ids = np.where(self.affordance_ids == NO_ID, 0, self.affordance_ids).tolist()
+        object_instances = np.where(self.object_instances == NO_ID, -1, self.object_instances).tolist()
+
+        msgs = []
+        for i in range(len(self)):
+            frame_id = str(self.frame_ids[i])
+
+            msg = GraspMsg()
+            msg.frame_id = String(frame_id)
+            msg.score = Float32(scores[i])
+            msg.tool_id = Int32(tool_ids[i])
+            msg.affordance_id = Int32(affordance_ids[i])
+            msg.object_instance = Int32(object_instances[i])
+            msg.header = Header(stamp = stamp, frame_id = frame_id)
+
+            x, y, z, qx, qy, qz, qw = poses[i]
+            msg.pose.position.x, msg.pose.position.y, msg.pose.position.z = x, y, z
+            msg.pose.orientation.x, msg.pose.orientation.y = qx, qy
+            msg.pose.orientation.z, msg.pose.orientation.w = qz, qw
+            msgs.append(msg)
+
+        return msgs
 
     def toGraspGroupMsg(self):
         """ returns a graspGroup message """
 
         #msg = GraspGroupMsg() # outcommented Nov 29
-        graspList = []
-
-        for grasp in self.grasps:
-            graspList.append(grasp.toGraspMsg())
+        graspList = self.toGraspMsgs()
 
         #msg.grasps = graspList
         return graspList
@@ -153,16 +306,21 @@ class GraspGroup(object):
         """ returns a graspGroup message """
 
         msg = graspGroupSrvResponse()
-        graspList = []
-
-        for grasp in self.grasps:
-            graspList.append(grasp.toGraspMsg())
-
-        msg.grasps = graspList
+        msg.grasps = self.toGraspMsgs()
         return msg
 
-    def transformToFrame(self, tf_buffer, frame_dest):
-
-        grasps = []
-        for grasp in self.grasps:
-            grasp.transformToFrame(tf_buffer, frame_dest)
+    def transformToFrame(self, frame_dest):
+        """ Transforms every grasp into frame_dest with one transform lookup
+            per source frame, a transform younger than
+            TRANSFORM_CACHE_TOLERANCE is reused, see
+            rob9Utils.transformations.transformPosesToFrame()
+        """
+
+        for frame in np.unique(self.frame_ids.astype(str)):
+            mask = self.frame_ids == frame
+            poses = transform.transformPosesToFrame(self.toPoseArray()[mask], frame_dest, currentFrame = frame,
+                                                    tolerance = transform.TRANSFORM_CACHE_TOLERANCE)
+            self.positions[mask] = poses[:, :3]
+            self.quaternions[mask] = poses[:, 3:]
+
+        self.frame_ids[:] = str(frame_dest)
@@ -7,10 +7,11 @@ from moveit_msgs.msg import PositionIKRequest, RobotState, MoveItErrorCodes
 from iiwa_msgs.msg import JointPosition, Spline, SplineSegment, MoveAlongSplineAction, MoveToJointPositionAction, MoveToJointPositionGoal, MoveToJointPositionResult, MoveAlongSplineGoal
 from iiwa_msgs.srv import SetPTPJointSpeedLimits, SetEndpointFrame, SetPTPCartesianSpeedLimits
 
+import rob9Utils.services as services
+
 def setEndpointFrame(frame_id = "iiwa_link_ee"):
 	print("Setting endpoint frame to \"", frame_id, "\"...")
-	set_endpoint_frame_client = rospy.ServiceProxy("/iiwa/configuration/setEndpointFrame", SetEndpointFrame)
-	response = set_endpoint_frame_client.call(frame_id)
+	response = services.call("/iiwa/configuration/setEndpointFrame", SetEndpointFrame, frame_id)
 
 	if not response.success:
 		print("Service call returned error: ", response.error)
@@ -20,9 +21,8 @@ def setEndpointFrame(frame_id = "iiwa_link_ee"):
 
 def setPTPJointSpeedLimits(joint_rel_vel = 1.0, joint_rel_acc = 1.0):
     print("Setting PTP joint speed limits...")
-    set_ptp_joint_speed_client = rospy.ServiceProxy("/iiwa/configuration/setPTPJointLimits", SetPTPJointSpeedLimits)
-
-    response = set_ptp_joint_speed_client.call(joint_rel_vel, joint_rel_acc)
+    response = services.call("/iiwa/configuration/setPTPJointLimits", SetPTPJointSpeedLimits,
+                                joint_rel_vel, joint_rel_acc)
 
 
     if not response.success:
@@ -36,10 +36,9 @@ def setPTPCartesianSpeedLimits(max_cart_vel = 1.0, max_cart_acc = 1.0,
                                 max_cart_jerk = 1.0, max_orien_vel = 1.0,
                                 max_orien_acc = 1.0, max_orien_jerk = 1.0):
     print("Setting PTP Cartesian speed limits...")
-    set_ptp_cartesian_speed_client = rospy.ServiceProxy("/iiwa/configuration/setPTPCartesianLimits", SetPTPCartesianSpeedLimits)
-
-    response = set_ptp_cartesian_speed_client(max_cart_vel, max_cart_acc, max_cart_jerk,
-                                                max_orien_vel, max_orien_acc, max_orien_jerk)
+    response = services.call("/iiwa/configuration/setPTPCartesianLimits", SetPTPCartesianSpeedLimits,
+                                max_cart_vel, max_cart_acc, max_cart_jerk,
+                                max_orien_vel, max_orien_acc, max_orien_jerk)
 
     if not response.success:
         print("Service call returned error: ", response.error);
@@ -76,9 +75,6 @@ def execute_spline_trajectory(plan):
 
     # Compute cartesian poses for each point in joint trajectory
 
-    rospy.wait_for_service('/iiwa/compute_fk')
-    moveit_fk = rospy.ServiceProxy('/iiwa/compute_fk', GetPositionFK)
-
     cartesian_poses = []
 
     end_effector_link = ['iiwa_link_ee']
@@ -92,7 +88,7 @@ def execute_spline_trajectory(plan):
         rs = RobotState()
         rs.joint_state.name = joint_names
         rs.joint_state.position = joint_positions
-        fk_result = moveit_fk(header, end_effector_link, rs) # Lookup the pose
+        fk_result = services.call('/iiwa/compute_fk', GetPositionFK, header, end_effector_link, rs) # Lookup the pose
 
         x, y, z = fk_result.pose_stamped[0].pose.position.x, fk_result.pose_stamped[0].pose.position.y, fk_result.pose_stamped[0].pose.position.z
         qx, qy, qz, qw = fk_result.pose_stamped[0].pose.orientation.x, fk_result.pose_stamped[0].pose.orientation.y, fk_result.pose_stamped[0].pose.orientation.z, fk_result.pose_stamped[0].pose.orientation.w
@@ -19,6 +19,8 @@ from rob9.srv import moveitPlanToPoseSrv, moveitPlanToPoseSrvResponse
 from rob9.srv import moveitPlanFromPoseToPoseSrv, moveitPlanFromPoseToPoseSrvResponse
 from rob9.srv import moveitGetJointPositionAtNamed, moveitGetJointPositionAtNamedResponse
 
+import rob9Utils.services as services
+
 
 
 def getRobotStateAtPose(pose_msg):
@@ -45,10 +47,7 @@ def getRobotStateAtPose(pose_msg):
     ik_request_msg.timeout = rospy.Duration(1.0) #
     ik_request_msg.attempts = 10
 
-    rospy.wait_for_service('/iiwa/compute_ik')
-    ik_calculator = rospy.ServiceProxy("/iiwa/compute_ik", GetPositionIK)
-
-    state = ik_calculator(ik_request_msg)
+    state = services.call("/iiwa/compute_ik", GetPositionIK, ik_request_msg)
     valid = False
     if state.error_code.val == 1:
         valid = True
@@ -70,10 +69,7 @@ def getInverseKinematicsSolution(initial_state, pose_msg):
     ik_request_msg.timeout = rospy.Duration(0.25) #
     ik_request_msg.attempts = 5
 
-    rospy.wait_for_service('/iiwa/compute_ik')
-    ik_calculator = rospy.ServiceProxy("/iiwa/compute_ik", GetPositionIK)
-
-    state = ik_calculator(ik_request_msg)
+    state = services.call("/iiwa/compute_ik", GetPositionIK, ik_request_msg)
     valid = False
     if state.error_code.val == 1:
         valid = True
@@ -86,72 +82,53 @@ def moveToNamed(name):
         print("ERROR: Specify a named pose")
         return 0
 
-    rospy.wait_for_service("/rob9/moveit/move_to_named")
-    tf2Service = rospy.ServiceProxy("/rob9/moveit/move_to_named", moveitMoveToNamedSrv)
-
     msg = moveitMoveToNamedSrv()
     msg.data = name
 
-    success = tf2Service(msg)
+    success = services.call("/rob9/moveit/move_to_named", moveitMoveToNamedSrv, msg, retry = False)
 
     return success
 
 def execute(plan):
 
-    rospy.wait_for_service("/rob9/moveit/execute")
-    tf2Service = rospy.ServiceProxy("/rob9/moveit/execute", moveitExecuteSrv)
-
     msg = moveitExecuteSrv()
     msg = plan
 
-    success = tf2Service(msg)
+    success = services.call("/rob9/moveit/execute", moveitExecuteSrv, msg, retry = False)
     print(success)
 
     return success
 
 def planToNamed(name):
 
-    rospy.wait_for_service("/rob9/moveit/plan_to_named")
-    service = rospy.ServiceProxy("/rob9/moveit/plan_to_named", moveitPlanToNamedSrv)
-
     msg = moveitPlanToNamedSrv()
     msg.data = name
 
-    response = service(msg)
+    response = services.call("/rob9/moveit/plan_to_named", moveitPlanToNamedSrv, msg)
     return response.plan
 
 def planFromPoseToPose(start_pose, goal_pose):
 
-    rospy.wait_for_service("/rob9/moveit/plan_from_pose_to_pose")
-    service = rospy.ServiceProxy("/rob9/moveit/plan_from_pose_to_pose", moveitPlanFromPoseToPoseSrv)
-
-    response = service(start_pose, goal_pose)
+    response = services.call("/rob9/moveit/plan_from_pose_to_pose", moveitPlanFromPoseToPoseSrv,
+                                start_pose, goal_pose)
     return response.success, response.plan
 
 def planToPose(pose):
 
-    rospy.wait_for_service("/rob9/moveit/plan_to_pose")
-    service = rospy.ServiceProxy("/rob9/moveit/plan_to_pose", moveitPlanToPoseSrv)
-
-    response = service(pose)
+    response = services.call("/rob9/moveit/plan_to_pose", moveitPlanToPoseSrv, pose)
     return response.success, response.plan
 
 def getCurrentState():
 
-    rospy.wait_for_service("/rob9/moveit/getRobotState")
-    tf2Service = rospy.ServiceProxy("/rob9/moveit/getRobotState", moveitRobotStateSrv)
-
     msg = moveitRobotStateSrv()
     msg.data = True
 
-    state = tf2Service(msg).state
+    state = services.call("/rob9/moveit/getRobotState", moveitRobotStateSrv, msg).state
 
     return state
 
 def getJointPositionAtNamed(target):
-    rospy.wait_for_service("/rob9/moveit/getJointPositionAtNamed")
-    service = rospy.ServiceProxy("/rob9/moveit/getJointPositionAtNamed", moveitGetJointPositionAtNamed)
     msg = moveitGetJointPositionAtNamed()
     msg.data = target
-    response = service(msg)
+    response = services.call("/rob9/moveit/getJointPositionAtNamed", moveitGetJointPositionAtNamed, msg)
     return response
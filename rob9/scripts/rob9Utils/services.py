@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+import time
+import threading
+import rospy
+
+class ServiceProxyPool(object):
+    """ Keeps one persistent rospy.ServiceProxy per service name, created on
+        first use, so repeated calls skip wait_for_service and the connection
+        setup. A proxy whose call fails is closed and created again on the
+        next call. The time of every call is recorded per service.
+
+        A persistent proxy is not thread safe, the pool can be shared between
+        threads, e.g. rospy service callbacks, calls to the same service are
+        made one at a time and calls to different services run concurrently.
+    """
+
+    def __init__(self, persistent = True):
+        """ Input:
+            persistent      - bool, keep the connection to the service open
+        """
+
+        self.persistent = persistent
+        self.proxies = {}
+        self.stats = {}
+
+        self.lock = threading.Lock() # guards proxies, stats and service_locks
+        self.service_locks = {}
+
+    def getProxy(self, name, service_class):
+        """ Input:
+            name            - string, service name
+            service_class   - service type, e.g. rob9.srv.tf2GetTransformSrv
+
+            Output:
+            proxy           - rospy.ServiceProxy
+        """
+
+        with self.getServiceLock(name):
+            return self.connect(name, service_class)
+
+    def getServiceLock(self, name):
+        """ Output:
+            lock            - threading.RLock(), held while the proxy of name is
+                              created or called
+        """
+
+        with self.lock:
+            if name not in self.service_locks:
+                self.service_locks[name] = threading.RLock()
+            return self.service_locks[name]
+
+    def connect(self, name, service_class):
+        """ Creates the proxy of name if there is none, the service lock of
+            name must be held """
+
+        with self.lock:
+            proxy = self.proxies.get(name)
+        if proxy is not None:
+            return proxy
+
+        rospy.wait_for_service(name)
+        proxy = rospy.ServiceProxy(name, service_class, persistent = self.persistent)
+        with self.lock:
+            self.proxies[name] = proxy
+            self.getServiceStats(name)["connects"] += 1
+
+        return proxy
+
+    def call(self, name, service_class, *args, retry = True, **kwargs):
+        """ Calls the service, a failed call drops the proxy and is made once
+            more on a new connection if retry is True. Do not retry services
+            that must not run twice, e.g. executing a motion.
+
+            Input:
+            name            - string, service name
+            service_class   - service type
+            args, kwargs    - request fields passed on to the proxy
+            retry           - bool, call again after a failed call
+
+            Output:
+            response        - the service response
+        """
+
+        with self.getServiceLock(name):
+            proxy = self.connect(name, service_class)
+
+            start = time.time()
+            try:
+                response = proxy(*args, **kwargs)
+            except (rospy.ServiceException, rospy.ROSException) as e:
+                with self.lock:
+                    self.getServiceStats(name)["failures"] += 1
+                self.close(name)
+                if not retry:
+                    raise
+                print("Service call to ", name, " failed, reconnecting: ", e)
+
+                proxy = self.connect(name, service_class)
+                start = time.time()
+                response = proxy(*args, **kwargs)
+
+            elapsed = time.time() - start
+
+        with self.lock:
+            stats = self.getServiceStats(name)
+            stats["calls"] += 1
+            stats["total_time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+
+        return response
+
+    def getServiceStats(self, name):
+        """ Stats of name, self.lock must be held """
+
+        if name not in self.stats:
+            self.stats[name] = {"calls": 0, "failures": 0, "connects": 0,
+                                "total_time": 0.0, "max_time": 0.0}
+        return self.stats[name]
+
+    def getStats(self):
+        """ Output:
+            stats           - dict, service name -> dict with calls, failures,
+                              connects, total_time, mean_time and max_time in s
+        """
+
+        stats = {}
+        with self.lock:
+            for name, service_stats in self.stats.items():
+                stats[name] = dict(service_stats)
+                stats[name]["mean_time"] = service_stats["total_time"] / max(service_stats["calls"], 1)
+        return stats
+
+    def printStats(self):
+
+        for name, stats in sorted(self.getStats().items()):
+            print(name, ": ", stats["calls"], " calls, mean ", round(stats["mean_time"] * 1000, 2),
+                    " ms, max ", round(stats["max_time"] * 1000, 2), " ms, ",
+                    stats["failures"], " failures")
+
+    def close(self, name = None):
+        """ Closes the proxy of name, or every proxy if name is None """
+
+        with self.lock:
+            names = list(self.proxies.keys()) if name is None else [name]
+
+        for service_name in names:
+            # waits for a call in progress on the proxy
+            with self.getServiceLock(service_name):
+                with self.lock:
+                    proxy = self.proxies.pop(service_name, None)
+                if proxy is not None:
+                    proxy.close()
+
+_pool = ServiceProxyPool()
+
+def getProxy(name, service_class):
+    """ Persistent proxy of the shared pool, see ServiceProxyPool.getProxy() """
+
+    return _pool.getProxy(name, service_class)
+
+def call(name, service_class, *args, retry = True, **kwargs):
+    """ Calls a service through the shared pool, see ServiceProxyPool.call() """
+
+    return _pool.call(name, service_class, *args, retry = retry, **kwargs)
+
+def getStats():
+    return _pool.getStats()
+
+def printStats():
+    _pool.printStats()
+
+def close(name = None):
+    _pool.close(name)
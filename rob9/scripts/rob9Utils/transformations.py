@@ -12,16 +12,21 @@ from rob9.srv import tf2TransformPathSrv, tf2TransformPathSrvResponse
 from rob9.srv import tf2GetTransformSrv, tf2GetTransformSrvResponse
 from rob9.srv import tf2VisualizeTransformSrv, tf2VisualizeTransformSrvResponse
 
+import rob9Utils.services as services
+
+# (source_frame, target_frame) -> (time, T, transl, rot, quat), see getTransform()
+_transform_cache = {}
+
+# how old in seconds a cached transform may be before it is requested again
+TRANSFORM_CACHE_TOLERANCE = 0.5
+
 def visualizeTransform(transform, name):
     """ Input:
         transform           - geometry_msgs.Transform()
         name                - string, name of transform
     """
 
-    rospy.wait_for_service("/tf2/visualize_transform")
-    tf2Service = rospy.ServiceProxy("/tf2/visualize_transform", tf2VisualizeTransformSrv)
-
-    _ = tf2Service(transform, String(name))
+    _ = services.call("/tf2/visualize_transform", tf2VisualizeTransformSrv, transform, String(name))
 
 
 def transformToFrame(pose, newFrame, currentFrame = "ptu_camera_color_optical_frame"):
@@ -29,38 +34,83 @@ def transformToFrame(pose, newFrame, currentFrame = "ptu_camera_color_optical_fr
                         numpy array (x, y, z)
                         numpy array (x, y, z, qx, qy, qz, qw)
                 newFrame - desired frame for pose to be transformed into.
-        output: transformed_pose_msg - pose in newFrame """
+        output: transformed_pose_msg - pose in newFrame
+
+        The transform is always requested, never taken from the cache of
+        getTransform() """
 
     if isinstance(pose, (np.ndarray, np.generic) ):
-        npArr = pose
+        npArr = np.asanyarray(pose, dtype=np.float64).flatten()
+
+        poseArr = np.zeros(7)
+        poseArr[6] = 1 # no orientation provided
+        poseArr[:npArr.shape[0]] = npArr[:7]
+    else:
+        currentFrame = pose.header.frame_id
+        poseArr = np.array([pose.pose.position.x, pose.pose.position.y, pose.pose.position.z,
+                            pose.pose.orientation.x, pose.pose.orientation.y,
+                            pose.pose.orientation.z, pose.pose.orientation.w])
+
+    newPose = transformPosesToFrame(poseArr[np.newaxis], newFrame, currentFrame, tolerance = 0)[0]
+
+    response = PoseStamped()
+    response.header.stamp = rospy.Time.now()
+    response.header.frame_id = newFrame
+    response.pose.position.x = newPose[0]
+    response.pose.position.y = newPose[1]
+    response.pose.position.z = newPose[2]
+    response.pose.orientation.x = newPose[3]
+    response.pose.orientation.y = newPose[4]
+    response.pose.orientation.z = newPose[5]
+    response.pose.orientation.w = newPose[6]
 
-        pose = PoseStamped()
-        pose.pose.position.x = npArr[0]
-        pose.pose.position.y = npArr[1]
-        pose.pose.position.z = npArr[2]
+    return response
 
-        if npArr.shape[0] < 4: # no orientation provided:
-            pose.pose.orientation.w = 1
-            pose.pose.orientation.x = 0
-            pose.pose.orientation.y = 0
-            pose.pose.orientation.z = 0
+def transformPosesToFrame(poses, newFrame, currentFrame = "ptu_camera_color_optical_frame",
+                            tolerance = 0):
+    """ Transforms many poses with one transform lookup, the transform is
+        requested through getTransform(), a cached transform is only reused
+        when the caller allows it with tolerance.
+
+        Input:
+        poses           - np.array, shape (N, 3) x, y, z
+                                 or shape (N, 7) x, y, z, qx, qy, qz, qw
+        newFrame        - string, desired frame for the poses
+        currentFrame    - string, frame of the poses
+        tolerance       - float, max age of a cached transform in seconds,
+                          0 always requests the transform, see
+                          TRANSFORM_CACHE_TOLERANCE
 
-        else:
-            pose.pose.orientation.w = npArr[6]
-            pose.pose.orientation.x = npArr[3]
-            pose.pose.orientation.y = npArr[4]
-            pose.pose.orientation.z = npArr[5]
-        pose.header.frame_id = currentFrame
+        Output:
+        poses           - np.array, same shape as input, poses in newFrame
+    """
 
+    poses = np.asanyarray(poses, dtype=np.float64)
+    if poses.ndim == 1:
+        poses = poses[np.newaxis]
 
-    pose.header.stamp = rospy.Time.now()
+    if currentFrame == newFrame:
+        return poses.copy()
 
-    rospy.wait_for_service("/tf2/transformPoseStamped")
-    tf2Service = rospy.ServiceProxy("/tf2/transformPoseStamped", tf2TransformPoseStampedSrv)
+    _, transl, rot = getTransform(currentFrame, newFrame, tolerance = tolerance)
+    quat = _transform_cache[(currentFrame, newFrame)][4]
 
-    response = tf2Service(pose, String(newFrame)).data
+    newPoses = np.empty_like(poses)
+    newPoses[:, :3] = np.dot(poses[:, :3], rot.T) + transl
 
-    return response
+    if poses.shape[1] > 3:
+        # quat * q for every q, xyzw
+        v1, w1 = quat[:3], quat[3]
+        v2, w2 = poses[:, 3:6], poses[:, 6]
+        newPoses[:, 3:6] = w1 * v2 + w2[:, np.newaxis] * v1 + np.cross(v1, v2)
+        newPoses[:, 6] = w1 * w2 - np.dot(v2, v1)
+
+    return newPoses
+
+def clearTransformCache():
+    """ Forgets every cached transform, call when a frame moved """
+
+    _transform_cache.clear()
 
 def transformToFramePath(path, newFrame):
     """ input:  pose - nav_msgs.Path()
@@ -69,10 +119,7 @@ def transformToFramePath(path, newFrame):
 
     pose.header.stamp = rospy.Time.now()
 
-    rospy.wait_for_service("/tf2/transformPath")
-    tf2Service = rospy.ServiceProxy("/tf2/transformPath", tf2TransformPathSrv)
-
-    response = tf2Service(path, String(newFrame))
+    response = services.call("/tf2/transformPath", tf2TransformPathSrv, path, String(newFrame))
 
     return response
 
@@ -119,10 +166,13 @@ def poseMsgToTransformMsg(pose):
     return transform
 
 
-def getTransform(source_frame, target_frame):
+def getTransform(source_frame, target_frame, tolerance = 0):
     """ input:
         source_frame    - string
         target_frame    - string
+        tolerance       - float, a cached transform younger than tolerance
+                          seconds is returned without calling the service,
+                          0 always calls the service
 
         output:
         T               - 4x4 homogeneous transformation, np.array()
@@ -130,15 +180,19 @@ def getTransform(source_frame, target_frame):
         rot             - 3x3 rotation matrix, np.array(), shape (3, 3)
     """
 
-    rospy.wait_for_service("/tf2/get_transform")
-    tf2Service = rospy.ServiceProxy("/tf2/get_transform", tf2GetTransformSrv)
+    key = (source_frame, target_frame)
+    now = rospy.get_time()
+    if tolerance > 0 and key in _transform_cache:
+        stamp, T, transl, rot, _ = _transform_cache[key]
+        if now - stamp <= tolerance:
+            return T.copy(), transl.copy(), rot.copy()
 
     source_msg = String()
     source_msg.data = source_frame
     target_msg = String()
     target_msg.data = target_frame
 
-    response = tf2Service(source_msg, target_msg)
+    response = services.call("/tf2/get_transform", tf2GetTransformSrv, source_msg, target_msg)
 
     transl = np.zeros((3, 1))
     transl[0] = response.transform.translation.x
@@ -155,7 +209,10 @@ def getTransform(source_frame, target_frame):
     T[1, 3] = response.transform.translation.y
     T[2, 3] = response.transform.translation.z
 
-    return T, transl.flatten(), rot
+    transl = transl.flatten()
+    _transform_cache[key] = (now, T.copy(), transl.copy(), rot.copy(), np.array(quat))
+
+    return T, transl, rot
 
 def quatToRot(q):
     """ input:  -   q, array [x, y, z, w]